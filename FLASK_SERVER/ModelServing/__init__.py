@@ -0,0 +1,9 @@
+from .registry import ModelRegistry, get_registry, get_jina_retriever, default_device
+from .text_cache import TextFeatureCache, get_text_cache
+from .client import ModelServerClient, RemoteSketchEncoder, RemoteFaissIndex, RemoteJinaRetriever, RemoteAnnoyIndex
+
+__all__ = [
+    'ModelRegistry', 'get_registry', 'get_jina_retriever', 'default_device',
+    'TextFeatureCache', 'get_text_cache',
+    'ModelServerClient', 'RemoteSketchEncoder', 'RemoteFaissIndex', 'RemoteJinaRetriever', 'RemoteAnnoyIndex'
+]
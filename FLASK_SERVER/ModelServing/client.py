@@ -0,0 +1,156 @@
+import socket
+import threading
+from typing import List, Optional, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+from . import protocol
+
+
+class ModelServerClient:
+    """
+    Connection to the model server. Each worker thread keeps its own persistent
+    Unix socket, so concurrent requests never interleave frames.
+    """
+    def __init__(self, socket_path: str, timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._local.sock = sock
+        return sock
+
+    def call(self, op: int, header: dict = None, body: bytes = b''):
+        """
+        Send one request and return the (header, body) of the response. Only a request
+        that never reached the server (stale connection after a model server restart)
+        is sent again; a timeout or a failure while awaiting the response is raised, so
+        slow requests are never duplicated.
+        """
+        for attempt in range(2):
+            try:
+                sock = getattr(self._local, 'sock', None) or self._connect()
+                protocol.send_message(sock, op, header, body)
+            except socket.timeout:
+                self._close()
+                raise
+            except (ConnectionError, OSError):
+                # Connecting or writing failed (e.g. the model server restarted): reconnect once
+                self._close()
+                if attempt:
+                    raise
+                continue
+            try:
+                status, response_header, response_body = protocol.recv_message(sock)
+            except (ConnectionError, OSError):
+                self._close()
+                raise
+            break
+        if status != protocol.STATUS_OK:
+            raise RuntimeError(f"Model server error: {response_header.get('error')}")
+        return response_header, response_body
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def ping(self) -> bool:
+        return self.call(protocol.OP_PING)[0].get('pong', False)
+
+    def stats(self) -> dict:
+        return self.call(protocol.OP_STATS)[0]
+
+
+def _rgb_pixels(image: Image.Image) -> np.ndarray:
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image, dtype=np.uint8)
+
+
+class RemoteSketchEncoder:
+    """Stands in for the TSBIR model: `get_feature` runs in the model server"""
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def get_feature(self, query_sketch: Optional[Image.Image] = None, query_text: Optional[str] = None) -> torch.Tensor:
+        header = {'caption': query_text or ''}
+        body = b''
+        if query_sketch is not None:
+            pixels = _rgb_pixels(query_sketch)
+            header['sketch_shape'] = list(pixels.shape)
+            body = pixels.tobytes()
+        response_header, response_body = self.client.call(protocol.OP_SKETCH_FEATURE, header, body)
+        return torch.from_numpy(protocol.unpack_array(response_header, response_body).copy())
+
+
+class RemoteFaissIndex:
+    """Stands in for FaissMetadataIndex: searches run in the model server"""
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def _call(self, method, query_embedding, kwargs):
+        fields, body = protocol.pack_array(np.asarray(query_embedding, dtype=np.float32))
+        header = dict(fields, method=method, kwargs=kwargs)
+        return self.client.call(protocol.OP_INDEX_CALL, header, body)[0]['results']
+
+    def search(self, query_embedding, k=10, **kwargs):
+        return self._call('search', query_embedding, dict(kwargs, k=k))
+
+    def search_grouped(self, query_embedding, n_tours=20, **kwargs):
+        return self._call('search_grouped', query_embedding, dict(kwargs, n_tours=n_tours))
+
+
+class RemoteJinaRetriever:
+    """Same embedding interface as JinaRetriever, served by the model server"""
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def get_text_embeddings(self,
+                            texts: Union[str, List[str]],
+                            normalize: bool = True,
+                            output_dim: int = None) -> torch.Tensor:
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        header = {'texts': texts, 'normalize': normalize, 'output_dim': output_dim}
+        response_header, response_body = self.client.call(protocol.OP_JINA_TEXT, header)
+        return torch.from_numpy(protocol.unpack_array(response_header, response_body).copy())
+
+    def get_image_embeddings(self,
+                             images: Union[Image.Image, List[Image.Image]],
+                             normalize: bool = True,
+                             output_dim: int = None) -> torch.Tensor:
+        images = [images] if isinstance(images, Image.Image) else list(images)
+        pixels = [_rgb_pixels(image) for image in images]
+        header = {'shapes': [list(p.shape) for p in pixels], 'normalize': normalize, 'output_dim': output_dim}
+        body = b''.join(p.tobytes() for p in pixels)
+        response_header, response_body = self.client.call(protocol.OP_JINA_IMAGE, header, body)
+        return torch.from_numpy(protocol.unpack_array(response_header, response_body).copy())
+
+
+class RemoteAnnoyIndex:
+    """The read-only part of the AnnoyIndex API used by ContentBasedTourRecommender"""
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def get_nns_by_vector(self, vector, n, search_k=-1, include_distances=False):
+        fields, body = protocol.pack_array(np.asarray(vector, dtype=np.float32))
+        header = dict(fields, n=int(n), search_k=int(search_k))
+        response = self.client.call(protocol.OP_ANNOY_NNS, header, body)[0]
+        if include_distances:
+            return response['indices'], response['distances']
+        return response['indices']
+
+    def get_item_vector(self, item):
+        response_header, response_body = self.client.call(protocol.OP_ANNOY_ITEM, {'item': int(item)})
+        return protocol.unpack_array(response_header, response_body).tolist()
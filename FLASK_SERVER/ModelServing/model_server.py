@@ -0,0 +1,167 @@
+"""
+Long-lived inference process that owns the CLIP/Jina models and the FAISS/Annoy indexes.
+
+gunicorn starts it once before forking its HTTP workers (see gunicorn.conf.py); the
+workers then talk to it over a Unix socket with the framing in `protocol.py` instead
+of loading their own copies of every model and index.
+
+Run standalone with:
+    python -m ModelServing.model_server --socket /run/user/$UID/fantasy2reality/models.sock
+"""
+import argparse
+import os
+import socketserver
+import sys
+import tempfile
+import traceback
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from . import protocol
+from .registry import get_registry, get_jina_retriever
+from .text_cache import get_text_cache
+from .snapshot import load_snapshot, load_tour_data
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / 'Data'
+
+# FaissMetadataIndex methods that workers are allowed to call remotely
+INDEX_METHODS = {'search', 'search_grouped'}
+
+
+class ServingState:
+    """Models and indexes held by the model server"""
+    def __init__(self, embedding_dim: int = 1024, max_batch_size: int = 16, window_ms: float = 5.0):
+        from Sketch2ImageRetriever import initialize_model, FeatureBatcher
+        from RecommendationSystem import ContentBasedTourRecommender
+
+        snapshot = load_snapshot()
+        self.sketch_model, self.faiss_index, _ = initialize_model(snapshot.faiss_index_dir if snapshot else None,
+                                                                  tour_data=load_tour_data(snapshot))
+        # Sketch queries from every HTTP worker are micro-batched here
+        self.batcher = FeatureBatcher(self.sketch_model, max_batch_size=max_batch_size, window_ms=window_ms)
+        self.jina = get_jina_retriever()
+
+        recommender = ContentBasedTourRecommender(self.jina, embedding_dim=embedding_dim)
+        index_path = snapshot.recommendation_index_path if snapshot else DATA_DIR / 'recommendation_index.ann'
+        recommender.load_or_build_index(str(index_path), str(DATA_DIR / 'final_data_multi.json'))
+        self.annoy_index = recommender.annoy_index
+
+    def handle(self, op, header, body):
+        """Dispatch one request; returns (header, body) of the response"""
+        if op == protocol.OP_PING:
+            return {'pong': True}, b''
+
+        if op == protocol.OP_SKETCH_FEATURE:
+            sketch = None
+            if header.get('sketch_shape'):
+                pixels = np.frombuffer(body, dtype=np.uint8).reshape(header['sketch_shape'])
+                sketch = Image.fromarray(pixels, 'RGB')
+            feature = self.batcher.get_feature(sketch, header.get('caption', ''))
+            return protocol.pack_array(feature.float().cpu().numpy())
+
+        if op == protocol.OP_INDEX_CALL:
+            method = header.get('method')
+            if method not in INDEX_METHODS:
+                raise ValueError(f"Index method {method!r} is not served")
+            query = protocol.unpack_array(header, body)
+            results = getattr(self.faiss_index, method)(query, **header.get('kwargs', {}))
+            return {'results': results}, b''
+
+        if op == protocol.OP_JINA_TEXT:
+            features = self.jina.get_text_embeddings(header['texts'], normalize=header.get('normalize', True),
+                                                     output_dim=header.get('output_dim'))
+            return protocol.pack_array(features.numpy())
+
+        if op == protocol.OP_JINA_IMAGE:
+            images = []
+            offset = 0
+            for shape in header['shapes']:
+                size = int(np.prod(shape))
+                pixels = np.frombuffer(body, dtype=np.uint8, count=size, offset=offset).reshape(shape)
+                images.append(Image.fromarray(pixels, 'RGB'))
+                offset += size
+            features = self.jina.get_image_embeddings(images, normalize=header.get('normalize', True),
+                                                      output_dim=header.get('output_dim'))
+            return protocol.pack_array(features.numpy())
+
+        if op == protocol.OP_ANNOY_NNS:
+            vector = protocol.unpack_array(header, body)
+            indices, distances = self.annoy_index.get_nns_by_vector(
+                vector.tolist(), header['n'], header.get('search_k', -1), include_distances=True)
+            return {'indices': indices, 'distances': distances}, b''
+
+        if op == protocol.OP_ANNOY_ITEM:
+            vector = self.annoy_index.get_item_vector(int(header['item']))
+            return protocol.pack_array(np.asarray(vector, dtype=np.float32))
+
+        if op == protocol.OP_STATS:
+            return {'memory': get_registry().memory_report(), 'sketch_batching': self.batcher.metrics(),
+                    'text_cache': get_text_cache().metrics()}, b''
+
+        raise ValueError(f"Unknown opcode {op}")
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # Connections are persistent: serve requests until the worker disconnects
+        while True:
+            try:
+                op, header, body = protocol.recv_message(self.request)
+            except ConnectionError:
+                return
+            try:
+                with torch.no_grad():
+                    response_header, response_body = self.server.state.handle(op, header, body)
+                protocol.send_message(self.request, protocol.STATUS_OK, response_header, response_body)
+            except Exception as e:
+                traceback.print_exc()
+                protocol.send_message(self.request, protocol.STATUS_ERROR, {'error': str(e)})
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, state: ServingState):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.state = state
+        super().__init__(socket_path, _RequestHandler)
+        # Only this user's workers may connect
+        os.chmod(socket_path, 0o600)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fantasy2Reality model server")
+    parser.add_argument('--socket', default=os.environ.get('F2R_MODEL_SERVER_SOCKET'),
+                        help="Unix socket path (default: models.sock in a new 0700 temp directory)")
+    parser.add_argument('--embedding-dim', type=int, default=1024)
+    parser.add_argument('--max-batch-size', type=int, default=int(os.environ.get('SKETCH_MAX_BATCH_SIZE', 16)))
+    parser.add_argument('--batch-window-ms', type=float, default=float(os.environ.get('SKETCH_BATCH_WINDOW_MS', 5)))
+    args = parser.parse_args(argv)
+    if args.socket is None:
+        args.socket = os.path.join(tempfile.mkdtemp(prefix='fantasy2reality-', dir=os.environ.get('XDG_RUNTIME_DIR')),
+                                   'models.sock')
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.socket)), mode=0o700, exist_ok=True)
+
+    # Model and index paths are relative to the FLASK_SERVER directory
+    os.chdir(BASE_DIR)
+    state = ServingState(embedding_dim=args.embedding_dim, max_batch_size=args.max_batch_size,
+                         window_ms=args.batch_window_ms)
+    server = ModelServer(args.socket, state)
+    print(f"Model server listening on {args.socket}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compact binary framing used between the HTTP workers and the model server.
+
+Every message (request or response) is
+
+    uint8  code         opcode for requests, status for responses
+    uint32 header_len   length of the UTF-8 JSON header
+    uint32 body_len     length of the raw body
+    header              small JSON object (arguments, shapes, metadata)
+    body                raw bytes (float32 vectors, uint8 pixels, ...)
+
+so vectors and images travel without any text encoding.
+"""
+import json
+import socket
+import struct
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+FRAME = struct.Struct('!BII')
+
+# Request opcodes
+OP_PING = 0
+OP_SKETCH_FEATURE = 1
+OP_INDEX_CALL = 2
+OP_JINA_TEXT = 3
+OP_JINA_IMAGE = 4
+OP_ANNOY_NNS = 5
+OP_ANNOY_ITEM = 6
+OP_STATS = 7
+
+# Response status codes
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Model server connection closed")
+        received += n
+    return bytes(buf)
+
+
+def send_message(sock: socket.socket, code: int, header: Dict[str, Any] = None, body: bytes = b'') -> None:
+    header_bytes = json.dumps(header or {}, separators=(',', ':')).encode('utf-8')
+    sock.sendall(FRAME.pack(code, len(header_bytes), len(body)) + header_bytes + body)
+
+
+def recv_message(sock: socket.socket) -> Tuple[int, Dict[str, Any], bytes]:
+    code, header_len, body_len = FRAME.unpack(_recv_exact(sock, FRAME.size))
+    header = json.loads(_recv_exact(sock, header_len).decode('utf-8')) if header_len else {}
+    body = _recv_exact(sock, body_len) if body_len else b''
+    return code, header, body
+
+
+def pack_array(array: np.ndarray) -> Tuple[Dict[str, Any], bytes]:
+    """Return the (header fields, body) pair describing a numpy array"""
+    array = np.ascontiguousarray(array)
+    return {'dtype': array.dtype.str, 'shape': list(array.shape)}, array.tobytes()
+
+
+def unpack_array(header: Dict[str, Any], body: bytes) -> np.ndarray:
+    return np.frombuffer(body, dtype=np.dtype(header['dtype'])).reshape(header['shape'])
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import torch
+
+
+def _process_rss_bytes() -> int:
+    """Current resident set size of this process (Linux /proc, 0 if unavailable)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _tensor_bytes(model: Any) -> int:
+    """Bytes held by the parameters and buffers of a model (or of `model.model`)."""
+    module = model if isinstance(model, torch.nn.Module) else getattr(model, 'model', None)
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    seen = set()
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        # weight-tied tensors (e.g. visual2 = visual) must only be counted once
+        if tensor.data_ptr() in seen:
+            continue
+        seen.add(tensor.data_ptr())
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    """
+    Process-wide registry that loads every model once per (name, device) and hands
+    the same instance to all subsystems (quiz, recommendations, sketch retrieval).
+    Loading is serialized per key, so concurrent callers asking for the same model
+    wait for the first load instead of loading it a second time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._models: Dict[Tuple[str, str], Any] = {}
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def get(self, name: str, device: str, loader: Callable[[], Any]) -> Any:
+        """
+        Return the shared model registered under (name, device), calling `loader`
+        to build it the first time it is requested.
+        """
+        key = (name, str(device))
+        with self._lock:
+            if key in self._models:
+                self._stats[key]['requests'] += 1
+                return self._models[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._stats[key]['requests'] += 1
+                    return self._models[key]
+
+            cuda_before = torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+            rss_before = _process_rss_bytes()
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+            rss_after = _process_rss_bytes()
+            cuda_after = torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+
+            stats = {
+                'name': name,
+                'device': str(device),
+                'load_seconds': round(load_seconds, 3),
+                'tensor_mb': round(_tensor_bytes(model) / 2**20, 2),
+                'rss_delta_mb': round((rss_after - rss_before) / 2**20, 2),
+                'cuda_delta_mb': round((cuda_after - cuda_before) / 2**20, 2),
+                'requests': 1,
+            }
+            with self._lock:
+                self._models[key] = model
+                self._stats[key] = stats
+            print(f"Loaded model {name} on {device}: {stats['tensor_mb']} MB of weights, "
+                  f"RSS +{stats['rss_delta_mb']} MB in {stats['load_seconds']}s")
+            return model
+
+    def memory_report(self) -> Dict[str, Any]:
+        """Per-model memory usage and the current resident memory of the process."""
+        with self._lock:
+            models = [dict(stats) for stats in self._stats.values()]
+        return {
+            'process_rss_mb': round(_process_rss_bytes() / 2**20, 2),
+            'models': models,
+        }
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    return _registry
+
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_jina_retriever(model_name: str = "jinaai/jina-clip-v2", device: Optional[str] = None):
+    """Shared JinaRetriever for the quiz and recommendation systems."""
+    from quizAlgo.embedding.JinaRetriever import JinaRetriever
+
+    device = device or default_device()
+    return _registry.get(model_name, device, lambda: JinaRetriever(model_name, device=device))
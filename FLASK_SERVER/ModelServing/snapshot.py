@@ -0,0 +1,223 @@
+"""
+Fast-boot snapshot of the derived serving state.
+
+A snapshot is one versioned directory holding everything the server otherwise rebuilds
+on every boot, as flat files that are memory-mapped instead of parsed:
+
+    manifest.json                format version, source file fingerprints, counts
+    quiz_tour_ids.npy            int64 tour ids, one per embedding row
+    quiz_embeddings.npy          float32 stacked quiz embedding matrix
+    quiz_kernels/                float32 squared distances and base RBF kernels of the quiz DPP
+    tour_metadata_ids.npy        int64 tour ids of final_data_multi.json
+    tour_metadata_offsets.npy    int64 byte offsets (N + 1) into tour_metadata.npy
+    tour_metadata.npy            uint8 blob of compact per-tour JSON records
+    recommendation_index.ann     Annoy index (Annoy mmaps it on load)
+    faiss_index/                 FAISS image index and its columnar metadata
+
+Build or refresh it with:
+    python -m ModelServing.snapshot build
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / 'Data'
+DEFAULT_SNAPSHOT_DIR = DATA_DIR / 'serving_snapshot'
+FAISS_INDEX_DIR = BASE_DIR / 'Sketch2ImageRetriever' / 'faiss_index'
+
+SOURCES = {
+    'tour_data': DATA_DIR / 'final_data_multi.json',
+    'tour_embeddings': DATA_DIR / 'tour_embeddings.h5',
+    'recommendation_index': DATA_DIR / 'recommendation_index.ann',
+    'faiss_index': FAISS_INDEX_DIR,
+}
+
+
+def _fingerprint(path: Path) -> Dict[str, float]:
+    """Size and mtime of a file, or of all files in a directory"""
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    return {
+        'size': sum(p.stat().st_size for p in files),
+        'mtime': max((p.stat().st_mtime for p in files), default=0.0),
+    }
+
+
+class TourMetadataStore(Mapping):
+    """
+    Read-only tour_id -> tour dict mapping backed by a memory-mapped JSON blob.
+    Records are decoded only when accessed, so boot does not parse the tour data.
+    """
+    def __init__(self, tour_ids: np.ndarray, offsets: np.ndarray, blob: np.ndarray):
+        self._offsets = offsets
+        self._blob = blob
+        self._positions = {int(tour_id): i for i, tour_id in enumerate(tour_ids)}
+
+    def __getitem__(self, tour_id):
+        position = self._positions[tour_id]
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return json.loads(self._blob[start:end].tobytes())
+
+    def __contains__(self, tour_id):
+        return tour_id in self._positions
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+
+class ServingSnapshot:
+    def __init__(self, directory: Path, manifest: Dict):
+        self.directory = Path(directory)
+        self.manifest = manifest
+
+    def path(self, name: str) -> Path:
+        return self.directory / name
+
+    @property
+    def faiss_index_dir(self) -> Path:
+        return self.directory / 'faiss_index'
+
+    @property
+    def quiz_kernel_dir(self) -> Path:
+        return self.directory / 'quiz_kernels'
+
+    @property
+    def recommendation_index_path(self) -> Path:
+        return self.directory / 'recommendation_index.ann'
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(self.directory / name, mmap_mode='r')
+
+    def load_quiz_state(self):
+        """Returns (tour_ids, embedding_matrix, tour_metadata) without copying the arrays"""
+        tour_ids = self._load('quiz_tour_ids.npy')
+        embedding_matrix = self._load('quiz_embeddings.npy')
+        tour_metadata = TourMetadataStore(self._load('tour_metadata_ids.npy'),
+                                          self._load('tour_metadata_offsets.npy'),
+                                          self._load('tour_metadata.npy'))
+        return tour_ids, embedding_matrix, tour_metadata
+
+
+def load_snapshot(directory: Optional[Path] = None) -> Optional[ServingSnapshot]:
+    """
+    Open the snapshot, or return None when it is missing, was written by another
+    format version, or is older than one of the source files it was built from.
+    """
+    directory = Path(directory or os.environ.get('F2R_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR))
+    manifest_path = directory / 'manifest.json'
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        print(f"Ignoring snapshot {directory}: format version {manifest.get('format_version')} "
+              f"!= {SNAPSHOT_FORMAT_VERSION}")
+        return None
+    for name, recorded in manifest.get('sources', {}).items():
+        source = Path(recorded['path'])
+        # Deployments may ship the snapshot without its sources
+        if source.exists() and _fingerprint(source) != recorded['fingerprint']:
+            print(f"Ignoring snapshot {directory}: {source} changed since it was built")
+            return None
+    return ServingSnapshot(directory, manifest)
+
+
+def load_tour_data(snapshot: Optional[ServingSnapshot] = None):
+    """
+    Tour records, decoded lazily from the snapshot or parsed from final_data_multi.json;
+    None when neither is available
+    """
+    if snapshot is not None:
+        return snapshot.load_quiz_state()[2].values()
+    if not SOURCES['tour_data'].exists():
+        return None
+    with open(SOURCES['tour_data'], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_snapshot(output_dir: Optional[Path] = None) -> ServingSnapshot:
+    """Rebuild the snapshot from the source files and atomically replace the old one"""
+    from quizAlgo.dpp_utils import precompute_kernels
+    from quizAlgo.embedding.embedding_utils import TourEmbeddingHandler_Quiz
+    from Sketch2ImageRetriever.metadata_store import ColumnarMetadataStore, convert_pickle_metadata
+
+    output_dir = Path(output_dir or DEFAULT_SNAPSHOT_DIR)
+    staging_dir = output_dir.with_name(output_dir.name + '.tmp')
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    staging_dir.mkdir(parents=True)
+
+    # Quiz embeddings, stacked once
+    embeddings = TourEmbeddingHandler_Quiz(None).load_embeddings(str(SOURCES['tour_embeddings']))
+    np.save(staging_dir / 'quiz_tour_ids.npy', np.array(list(embeddings.keys()), dtype=np.int64))
+    np.save(staging_dir / 'quiz_embeddings.npy', np.stack(list(embeddings.values())).astype(np.float32))
+    if os.environ.get('F2R_QUIZ_KERNEL', 'exact') == 'exact':
+        # The low-rank kernel modes never use the dense N x N matrices
+        precompute_kernels(np.load(staging_dir / 'quiz_embeddings.npy', mmap_mode='r'), staging_dir / 'quiz_kernels')
+
+    # Tour metadata as compact JSON records with an offset table
+    with open(SOURCES['tour_data'], 'r', encoding='utf-8') as f:
+        tour_data = json.load(f)
+    records = [json.dumps(tour, separators=(',', ':')).encode('utf-8') for tour in tour_data]
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(record) for record in records])
+    np.save(staging_dir / 'tour_metadata_ids.npy', np.array([tour['tour_id'] for tour in tour_data], dtype=np.int64))
+    np.save(staging_dir / 'tour_metadata_offsets.npy', offsets)
+    np.save(staging_dir / 'tour_metadata.npy', np.frombuffer(b''.join(records), dtype=np.uint8))
+
+    # Index files are already in loadable binary form
+    shutil.copy2(SOURCES['recommendation_index'], staging_dir / 'recommendation_index.ann')
+    shutil.copytree(SOURCES['faiss_index'], staging_dir / 'faiss_index')
+    if not ColumnarMetadataStore.exists(staging_dir / 'faiss_index'):
+        convert_pickle_metadata(staging_dir / 'faiss_index')
+
+    manifest = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sources': {
+            name: {'path': str(path), 'fingerprint': _fingerprint(path)}
+            for name, path in SOURCES.items()
+        },
+        'counts': {
+            'quiz_tours': len(embeddings),
+            'tours': len(tour_data),
+        },
+    }
+    with open(staging_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    staging_dir.rename(output_dir)
+    print(f"Wrote serving snapshot v{SNAPSHOT_FORMAT_VERSION} to {output_dir}")
+    return ServingSnapshot(output_dir, manifest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fantasy2Reality serving snapshot")
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--dir', default=None, help="snapshot directory (default Data/serving_snapshot)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build_snapshot(args.dir)
+    else:
+        snapshot = load_snapshot(args.dir)
+        print("snapshot is usable" if snapshot else "no usable snapshot")
+
+
+if __name__ == '__main__':
+    main()
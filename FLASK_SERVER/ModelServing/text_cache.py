@@ -0,0 +1,164 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str, lowercase: bool = False) -> str:
+    """Cache key form of a text: surrounding / repeated whitespace removed"""
+    text = ' '.join(str(text).split())
+    return text.lower() if lowercase else text
+
+
+class TextFeatureCache:
+    """
+    Bounded LRU cache of text features, keyed by (model, variant, normalized text).
+
+    `variant` separates outputs of one model that differ by settings such as
+    output_dim. Optionally backed by a sqlite file, so warm entries survive restarts
+    and are shared by the processes on a host; memory misses fall through to it and
+    computed features are written to both tiers. The sqlite tier is best effort: a locked
+    or unusable file is logged and treated as a miss, and it is never read or written
+    while the in-memory LRU lock is held.
+    """
+    def __init__(self, capacity: int = 4096, db_path: Optional[str] = None):
+        self.capacity = capacity
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        self.db_path = db_path
+        self._db = None
+        # Serializes use of the shared sqlite connection, independently of self._lock
+        self._db_lock = threading.Lock()
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, timeout=1.0, check_same_thread=False)
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('CREATE TABLE IF NOT EXISTS text_features '
+                                 '(model TEXT, variant TEXT, text TEXT, dim INTEGER, data BLOB, '
+                                 'PRIMARY KEY (model, variant, text))')
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Text feature cache: sqlite tier {db_path} disabled: {e}")
+                self._db = None
+
+    def get_many(self, model: str, variant: str, texts: Sequence[str],
+                 compute: Callable[[List[str]], np.ndarray], lowercase: bool = False) -> np.ndarray:
+        """
+        (len(texts), dim) float32 features; the texts missing from both tiers are computed
+        with one `compute(list_of_texts)` call
+        """
+        keys = [(model, variant, normalize_text(text, lowercase)) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    continue
+                feature = self._entries.get(key)
+                if feature is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = feature
+
+        disk = self._read_disk([key for key in dict.fromkeys(keys) if key not in found])
+        found.update(disk)
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        with self._lock:
+            for key, feature in disk.items():
+                self._put(key, feature)
+            self._hits += sum(1 for key in keys if key in found)
+            self._disk_hits += sum(1 for key in keys if key in disk)
+            self._misses += sum(1 for key in keys if key not in found)
+
+        if missing:
+            # Texts are computed as given for the first occurrence of each key
+            first_text = {}
+            for key, text in zip(keys, texts):
+                first_text.setdefault(key, text)
+            computed = np.asarray(compute([first_text[key] for key in missing]), dtype=np.float32)
+            with self._lock:
+                for key, feature in zip(missing, computed):
+                    self._put(key, feature.copy())
+                    found[key] = feature
+            self._write_disk(list(zip(missing, computed)))
+
+        return np.stack([found[key] for key in keys])
+
+    def _put(self, key, feature):
+        self._entries[key] = feature
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, keys):
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        try:
+            with self._db_lock:
+                for key in keys:
+                    row = self._db.execute('SELECT data FROM text_features '
+                                           'WHERE model = ? AND variant = ? AND text = ?', key).fetchone()
+                    if row is not None:
+                        found[key] = np.frombuffer(row[0], dtype=np.float32).copy()
+        except sqlite3.Error as e:
+            logger.warning(f"Text feature cache: sqlite read failed, treating as a miss: {e}")
+        return found
+
+    def _write_disk(self, items):
+        if self._db is None or not items:
+            return
+        rows = [(*key, len(feature), np.asarray(feature, dtype=np.float32).tobytes()) for key, feature in items]
+        with self._db_lock:
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO text_features VALUES (?, ?, ?, ?, ?)', rows)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Text feature cache: sqlite write of {len(rows)} entries skipped: {e}")
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'capacity': self.capacity,
+                'size': len(self._entries),
+                'lookups': lookups,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+                'disk_path': self.db_path,
+            }
+
+
+_text_cache = None
+_text_cache_lock = threading.Lock()
+
+
+def get_text_cache() -> TextFeatureCache:
+    """
+    Process-wide text feature cache; TEXT_CACHE_SIZE sets its capacity (0 disables
+    caching) and TEXT_CACHE_DB the optional sqlite file of the persistent tier.
+    """
+    global _text_cache
+    with _text_cache_lock:
+        if _text_cache is None:
+            _text_cache = TextFeatureCache(capacity=int(os.environ.get('TEXT_CACHE_SIZE', 4096)),
+                                           db_path=os.environ.get('TEXT_CACHE_DB') or None)
+        return _text_cache
@@ -9,6 +9,8 @@ from tqdm import tqdm
 import logging
 import sys
 import traceback
+import json
+import os
 
 # Set up logging
 logging.basicConfig(
@@ -175,6 +177,25 @@ class ContentBasedTourRecommender:
             logging.error(traceback.format_exc())
             raise
         
+    def load_or_build_index(self, index_path: str, tour_data_path: str):
+        """Load the saved AnnoyIndex, or build it from the tour data and save it."""
+        if os.path.exists(index_path):
+            logging.info("Loading existing recommendation index...")
+            self.annoy_index.load(str(index_path))
+            return
+
+        if not os.path.exists(tour_data_path):
+            raise FileNotFoundError(f"Tour data file not found at {tour_data_path}")
+        with open(tour_data_path, 'r', encoding='utf-8') as f:
+            tour_data = json.load(f)
+        if not tour_data:
+            raise ValueError("Tour data is empty")
+
+        logging.info("Building new recommendation index...")
+        self.build_index(tour_data)
+        # Save the index for future use
+        self.annoy_index.save(str(index_path))
+
     def is_id_in_annoy_index(self, tour_id):
         try:
             # Attempt to get the vector for the given ID
@@ -0,0 +1,71 @@
+"""
+Compare the boot time of the derived serving state (everything except model weights)
+when rebuilt from the source files versus mapped from the serving snapshot.
+
+Run from the FLASK_SERVER directory after `python -m ModelServing.snapshot build`:
+    python ServerTesting/boot_benchmark.py
+"""
+import json
+import os
+import pickle
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import faiss
+from annoy import AnnoyIndex
+
+from Sketch2ImageRetriever.faiss_class import FaissMetadataIndex
+from ModelServing.snapshot import DATA_DIR, FAISS_INDEX_DIR, load_snapshot
+from quizAlgo.dpp_utils import DPPRecommender
+from quizAlgo.embedding.embedding_utils import TourEmbeddingHandler_Quiz
+
+EMBEDDING_DIM = 1024
+REPEATS = 3
+
+
+def boot_from_sources():
+    # Quiz and recommendation systems each parsed the tour data
+    for _ in range(2):
+        with open(DATA_DIR / 'final_data_multi.json', 'r', encoding='utf-8') as f:
+            tour_data = json.load(f)
+    embeddings = TourEmbeddingHandler_Quiz(None).load_embeddings(str(DATA_DIR / 'tour_embeddings.h5'))
+    DPPRecommender(embeddings, {tour['tour_id']: tour for tour in tour_data})
+
+    annoy_index = AnnoyIndex(2 * EMBEDDING_DIM, 'angular')
+    annoy_index.load(str(DATA_DIR / 'recommendation_index.ann'))
+    faiss.read_index(str(FAISS_INDEX_DIR / 'faiss.index'))
+    with open(FAISS_INDEX_DIR / 'metadata.pkl', 'rb') as f:
+        pickle.load(f)
+
+
+def boot_from_snapshot():
+    snapshot = load_snapshot()
+    tour_ids, embedding_matrix, tour_metadata = snapshot.load_quiz_state()
+    DPPRecommender.from_arrays(tour_ids, embedding_matrix, tour_metadata)
+
+    annoy_index = AnnoyIndex(2 * EMBEDDING_DIM, 'angular')
+    annoy_index.load(str(snapshot.recommendation_index_path))
+    FaissMetadataIndex.load(snapshot.faiss_index_dir, mmap=True)
+
+
+def time_boot(boot):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        boot()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    os.chdir(Path(__file__).resolve().parent.parent)
+    if load_snapshot() is None:
+        sys.exit("No usable snapshot; run `python -m ModelServing.snapshot build` first")
+
+    before = time_boot(boot_from_sources)
+    after = time_boot(boot_from_snapshot)
+    print(f"boot from sources : {before * 1000:.1f} ms")
+    print(f"boot from snapshot: {after * 1000:.1f} ms ({before / after:.1f}x faster)")
@@ -0,0 +1,75 @@
+"""
+Sketch-encode and text-encode latency of the TSBIR model on CPU.
+
+Loads the model the way initialize_model does on a CPU-only node (fp32 or bf16 weights,
+tuned thread pools) and reports p50/p95 latency per batch size. The trained checkpoint
+is used when present, otherwise randomly initialized weights (latency does not depend
+on them).
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/cpu_encode_benchmark.py --dtype fp32 bf16 --threads 4 --batch-sizes 1 8
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import torch
+from PIL import Image
+
+from Sketch2ImageRetriever.code.clip import CLIP, convert_weights
+from Sketch2ImageRetriever.initialize_model import (CPU_DTYPES, _load_tsbir_model, configure_cpu_threads,
+                                                    model_config_file, model_file)
+from Sketch2ImageRetriever.session import EncoderSession
+
+
+def load_cpu_model(dtype):
+    if model_file.exists():
+        return _load_tsbir_model('cpu', dtype)
+    with open(model_config_file, 'r') as f:
+        model = CLIP(**json.load(f)).eval()
+    if CPU_DTYPES[dtype] != torch.float32:
+        convert_weights(model, CPU_DTYPES[dtype])
+    return model
+
+
+def latency_ms(fn, iterations):
+    fn()  # warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.percentile(timings, [50, 95])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dtype', nargs='+', default=['fp32', 'bf16'], choices=sorted(CPU_DTYPES))
+    parser.add_argument('--threads', type=int, default=None, help="intra-op threads (default: all cores)")
+    parser.add_argument('--interop-threads', type=int, default=None)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    configure_cpu_threads(args.threads, args.interop_threads)
+    rng = np.random.default_rng(0)
+    sketches = [Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)) for _ in range(max(args.batch_sizes))]
+    texts = ["a waterfall in a pine forest", "snowy ridge above a lake", "old stone bridge over a river",
+             "coastal path with cliffs"] * max(args.batch_sizes)
+
+    for dtype in args.dtype:
+        session = EncoderSession(load_cpu_model(dtype))
+        for batch_size in args.batch_sizes:
+            sketch_p50, sketch_p95 = latency_ms(lambda: session.encode_sketch_batch(sketches[:batch_size]), args.iterations)
+            text_p50, text_p95 = latency_ms(lambda: session.encode_text_batch(texts[:batch_size]), args.iterations)
+            print(f"{dtype:<5} batch {batch_size:>3}   sketch p50 {sketch_p50:8.1f} ms  p95 {sketch_p95:8.1f} ms"
+                  f"   text p50 {text_p50:7.1f} ms  p95 {text_p95:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
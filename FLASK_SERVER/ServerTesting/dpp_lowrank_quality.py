@@ -0,0 +1,96 @@
+"""
+Quality and cost of the low-rank quiz DPP kernels ('rff', 'nystrom') against the exact
+RBF kernel.
+
+For each mode and feature dimension:
+  kernel error    relative Frobenius error of F F^T against exp(-gamma d^2) on a random
+                  block of tours
+  log det         mean log det of the sampled sets under the exact reweighted kernel L
+                  (higher is more diverse / higher quality; the exact sampler is the target)
+  min distance    mean smallest pairwise embedding distance inside a sampled set
+  startup, ms/req one-off factor cost and median per-request recommend() latency
+A uniform random k-subset is listed as the no-DPP baseline.
+
+Embeddings are the quiz tour embeddings of the serving snapshot when present, otherwise
+synthetic ones (see dpp_scaling_benchmark.py).
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/dpp_lowrank_quality.py --tours 2000 --dims 128 256 512 --samples 50
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from quizAlgo.dpp_utils import DPPRecommender, squared_distance_matrix
+from dpp_scaling_benchmark import load_embeddings
+
+GAMMA = 0.1
+
+
+def set_metrics(indices, kernel, squared_distances):
+    indices = np.asarray(indices)
+    sign, log_det = np.linalg.slogdet(kernel[np.ix_(indices, indices)])
+    pairwise = squared_distances[np.ix_(indices, indices)] + np.diag(np.full(len(indices), np.inf))
+    return (log_det if sign > 0 else -np.inf), float(np.sqrt(pairwise.min()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tours', type=int, default=2000)
+    parser.add_argument('--dims', type=int, nargs='+', default=[128, 256, 512])
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embedding_matrix = load_embeddings(args.tours, rng)
+    tour_ids = np.arange(args.tours)
+    metadata = {int(i): {} for i in tour_ids}
+    positive_ids, negative_ids = [int(i) for i in rng.choice(args.tours, 3, replace=False)][:2], [7]
+
+    # Exact reweighted kernel L used to score every sampler
+    squared_distances = squared_distance_matrix(embedding_matrix).astype(np.float64)
+    base_kernel = np.exp(-GAMMA * squared_distances)
+    block = rng.choice(args.tours, min(500, args.tours), replace=False)
+
+    configurations = [('exact', None)] + [(mode, dim) for mode in ('rff', 'nystrom') for dim in args.dims]
+    print(f"{args.tours} tours, k={args.k}, {args.samples} samples per configuration")
+    print(f"{'kernel':<14} {'kernel error':>12} {'log det':>9} {'min distance':>12} {'startup ms':>11} {'ms/req':>8}")
+    for mode, dim in configurations:
+        start = time.perf_counter()
+        recommender = DPPRecommender.from_arrays(tour_ids, embedding_matrix, metadata, kernel_mode=mode,
+                                                 feature_dim=dim or 512, kernel_energy=None)
+        startup = (time.perf_counter() - start) * 1000
+        if mode == 'exact':
+            weights = recommender.quality_weights(positive_ids, negative_ids)
+            kernel = np.sqrt(weights)[:, np.newaxis] * base_kernel * np.sqrt(weights)[np.newaxis, :]
+
+        factor = recommender.kernel_factor(GAMMA)[block].astype(np.float64)
+        target = base_kernel[np.ix_(block, block)]
+        kernel_error = np.linalg.norm(factor @ factor.T - target) / np.linalg.norm(target)
+
+        metrics, timings = [], []
+        for seed in range(args.samples):
+            start = time.perf_counter()
+            result = recommender.recommend(positive_ids, negative_ids, k=args.k, include_embeddings=False,
+                                           random_state=seed)
+            timings.append((time.perf_counter() - start) * 1000)
+            metrics.append(set_metrics([item['tour_id'] for item in result['recommendations']],
+                                       kernel, squared_distances))
+        log_det, min_distance = np.mean(metrics, axis=0)
+        label = mode if dim is None else f"{mode}-{dim}"
+        print(f"{label:<14} {kernel_error:>12.4f} {log_det:>9.2f} {min_distance:>12.3f} "
+              f"{startup:>11.1f} {np.median(timings):>8.1f}")
+
+    uniform = np.mean([set_metrics(rng.choice(args.tours, args.k, replace=False), kernel, squared_distances)
+                       for _ in range(args.samples)], axis=0)
+    print(f"{'uniform':<14} {'':>12} {uniform[0]:>9.2f} {uniform[1]:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
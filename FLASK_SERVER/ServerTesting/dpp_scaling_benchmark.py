@@ -0,0 +1,130 @@
+"""
+Per-request cost of the /quiz DPP over the number of tours N.
+
+"previous" is the old request path: reweight the N x N kernel, eigendecompose it to clip
+it to PSD, then run dppy's exact k-DPP sampler, which eigendecomposes it again (dppy is
+only timed when installed). "current" is DPPRecommender.recommend: the base kernel is
+factored once at startup (timed separately as the one-off cost) and each request samples
+in the rank-r dual space. The factor keeps the leading eigenvalues holding --energy of the
+kernel's trace, at most --max-rank of them (the serving default, 0 for no cap), so sampling
+follows the truncated kernel F F^T rather than K. The truncation is reported as:
+  trace kept      fraction of the kernel's trace the rank-r factor retains
+  log det error   max |.| and mean of log det(F_S F_S^T) - log det(K_S) over random
+                  k-subsets S (the reweighting D cancels out of the difference)
+"greedy MAP" is the deterministic mode (recommend(deterministic=True)) with its result
+cache cleared before every call.
+
+Embeddings are the quiz tour embeddings of the serving snapshot when present (subsampled
+to each N), otherwise synthetic clustered embeddings shaped like them (two unit-norm
+1024-d halves).
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/dpp_scaling_benchmark.py --sizes 500 1000 2000 4000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from ModelServing.snapshot import load_snapshot
+from quizAlgo.dpp_utils import DEFAULT_KERNEL_ENERGY, DEFAULT_KERNEL_MAX_RANK, DPPRecommender
+
+try:
+    from dppy.finite_dpps import FiniteDPP
+except ImportError:
+    FiniteDPP = None
+
+
+def synthetic_embeddings(n, rng, clusters=40, dim=1024):
+    halves = []
+    for _ in range(2):
+        centers = rng.normal(size=(clusters, dim))
+        half = centers[rng.integers(0, clusters, n)] + 0.8 * rng.normal(size=(n, dim))
+        halves.append(half / np.linalg.norm(half, axis=1, keepdims=True))
+    return np.hstack(halves).astype(np.float32)
+
+
+def load_embeddings(n, rng):
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        _, embedding_matrix, _ = snapshot.load_quiz_state()
+        if len(embedding_matrix) >= n:
+            return np.asarray(embedding_matrix[np.sort(rng.choice(len(embedding_matrix), n, replace=False))])
+    return synthetic_embeddings(n, rng)
+
+
+def previous_request(recommender, positive_ids, negative_ids, k):
+    kernel = recommender.compute_similarity_matrix(positive_ids, negative_ids)
+    if FiniteDPP is not None:
+        dpp = FiniteDPP(kernel_type='likelihood', L=kernel)
+        dpp.sample_exact_k_dpp(size=k)
+
+
+def truncation_error(kernel, factor, k, subsets, rng):
+    """Max |.| and mean of log det(F_S F_S^T) - log det(K_S) over random k-subsets S"""
+    errors = []
+    for _ in range(subsets):
+        rows = np.sort(rng.choice(len(factor), k, replace=False))
+        truncated = factor[rows].astype(np.float64)
+        _, truncated_log_det = np.linalg.slogdet(truncated @ truncated.T)
+        _, log_det = np.linalg.slogdet(np.asarray(kernel[np.ix_(rows, rows)], dtype=np.float64))
+        errors.append(truncated_log_det - log_det)
+    return np.abs(errors).max(), np.mean(errors)
+
+
+def median_ms(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--energy', type=float, default=DEFAULT_KERNEL_ENERGY)
+    parser.add_argument('--max-rank', type=int, default=DEFAULT_KERNEL_MAX_RANK or 0)
+    parser.add_argument('--subsets', type=int, default=200)
+    args = parser.parse_args()
+    args.max_rank = args.max_rank or None
+
+    rng = np.random.default_rng(0)
+    if FiniteDPP is None:
+        print("dppy is not installed: 'previous' times the kernel construction only")
+    print(f"energy {args.energy}, max rank {args.max_rank}, log det error over {args.subsets} {args.k}-subsets")
+    print(f"{'N':>6} {'rank':>5} {'trace kept':>10} {'log det err max':>15} {'mean':>7} {'startup ms':>11} "
+          f"{'previous ms':>12} {'current ms':>11} {'greedy MAP ms':>14}")
+    for n in args.sizes:
+        embedding_matrix = load_embeddings(n, rng)
+        tour_ids = np.arange(n)
+        start = time.perf_counter()
+        recommender = DPPRecommender.from_arrays(tour_ids, embedding_matrix, {int(i): {} for i in tour_ids},
+                                                 kernel_energy=args.energy, max_rank=args.max_rank)
+        startup = (time.perf_counter() - start) * 1000
+
+        positive_ids, negative_ids = [1, 2], [3]
+        previous = median_ms(lambda: previous_request(recommender, positive_ids, negative_ids, args.k),
+                             args.iterations)
+        current = median_ms(lambda: recommender.recommend(positive_ids, negative_ids, k=args.k,
+                                                          include_embeddings=False), args.iterations)
+        def greedy_map():
+            recommender._map_cache.clear()
+            recommender.recommend(positive_ids, negative_ids, k=args.k, include_embeddings=False, deterministic=True)
+        greedy = median_ms(greedy_map, args.iterations)
+        factor = recommender.kernel_factor(0.1)
+        trace_kept = float(np.square(factor, dtype=np.float64).sum()) / n  # the RBF diagonal is 1
+        max_error, mean_error = truncation_error(recommender.base_kernel(0.1), factor, args.k, args.subsets, rng)
+        print(f"{n:>6} {factor.shape[1]:>5} {trace_kept:>10.3f} {max_error:>15.3f} {mean_error:>7.3f} {startup:>11.1f} "
+              f"{previous:>12.1f} {current:>11.1f} {greedy:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
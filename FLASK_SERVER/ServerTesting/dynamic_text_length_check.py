@@ -0,0 +1,82 @@
+"""
+Check that trimmed (dynamic-length) text encoding matches the 77-token padded path, and
+time both.
+
+Captions are the image captions of the FAISS index metadata plus typical short queries; each
+batch is encoded with `encode_text(tokens)` and `encode_text(tokens, trim_padding=True)`.
+The trained checkpoint is used when present, otherwise randomly initialized weights.
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/dynamic_text_length_check.py --captions 500 --batch-size 1
+"""
+import argparse
+import json
+import pickle
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import torch
+
+from Sketch2ImageRetriever.code.clip import CLIP, tokenize
+from Sketch2ImageRetriever.metadata_store import ColumnarMetadataStore
+from Sketch2ImageRetriever.initialize_model import (FAISS_INDEX_PATH, _load_tsbir_model, model_config_file,
+                                                    model_file, serving_model_file)
+
+SHORT_QUERIES = ["mountain", "water body", "forest", "snowy peak", "old bridge", "lake with boats"]
+
+
+def load_model():
+    if model_file.exists() or serving_model_file.exists():
+        return _load_tsbir_model('cpu')
+    with open(model_config_file, 'r') as f:
+        return CLIP(**json.load(f)).eval()
+
+
+def load_captions(count):
+    if ColumnarMetadataStore.exists(FAISS_INDEX_PATH):
+        metadata = ColumnarMetadataStore.load(FAISS_INDEX_PATH)
+    else:
+        with open(FAISS_INDEX_PATH / 'metadata.pkl', 'rb') as f:
+            metadata = pickle.load(f)
+    rows = [metadata[int(i)] for i in np.random.default_rng(0).permutation(len(metadata))]
+    return SHORT_QUERIES + [row['caption'] for row in rows if row['caption']][:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captions', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = load_model()
+    captions = load_captions(args.captions)
+    batches = [tokenize(captions[i:i + args.batch_size]) for i in range(0, len(captions), args.batch_size)]
+    lengths = [int(tokens.argmax(dim=-1).max()) + 1 for tokens in batches]
+
+    max_diff = 0.0
+    timings = {'padded': 0.0, 'trimmed': 0.0}
+    with torch.no_grad():
+        for tokens in batches:
+            start = time.perf_counter()
+            padded = model.encode_text(tokens)
+            timings['padded'] += time.perf_counter() - start
+            start = time.perf_counter()
+            trimmed = model.encode_text(tokens, trim_padding=True)
+            timings['trimmed'] += time.perf_counter() - start
+            max_diff = max(max_diff, (padded.float() - trimmed.float()).abs().max().item())
+
+    print(f"{len(captions)} captions in {len(batches)} batches of {args.batch_size}; "
+          f"encoded length median {int(np.median(lengths))}, max {max(lengths)} of 77")
+    print(f"max |padded - trimmed| = {max_diff:.2e}")
+    for name, seconds in timings.items():
+        print(f"  {name:<8} {seconds * 1000 / len(batches):8.2f} ms/batch")
+    assert max_diff < 1e-3, "trimmed text encoding does not match the padded path"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Per-call overhead of the sketch/text query encoder before and after EncoderSession.
+
+"before" repeats the setup the old `get_feature` did on every request (model.cuda().eval(),
+rebuilding the preprocess transform, fresh zero tensors); "after" uses the session built
+once at load. Setup cost is timed on its own, then end-to-end sketch-only, text-only and
+sketch+text queries are timed both ways.
+
+The trained checkpoint is used when present, otherwise randomly initialized weights
+(the overhead does not depend on them).
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/encoder_session_benchmark.py --iterations 50
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import torch
+from PIL import Image
+
+from Sketch2ImageRetriever.code.clip import CLIP, convert_weights, tokenize, _transform
+from Sketch2ImageRetriever.initialize_model import model_config_file, model_file
+from Sketch2ImageRetriever.session import EncoderSession
+
+
+def load_model(device):
+    if device.type == 'cuda' and model_file.exists():
+        from Sketch2ImageRetriever.initialize_model import _load_tsbir_model
+        return _load_tsbir_model(device.index or 0)
+    with open(model_config_file, 'r') as f:
+        model = CLIP(**json.load(f)).eval().to(device)
+    if device.type == 'cuda':
+        convert_weights(model)
+    return model
+
+
+def legacy_setup(model, device):
+    """What the old get_feature did before any forward pass"""
+    model = model.to(device).eval()
+    transformer = _transform(model.visual2.input_resolution, is_train=False)
+    zeros = (torch.zeros((1, 512), device=device), torch.zeros((1, 512), device=device))
+    return model, transformer, zeros
+
+
+@torch.no_grad()
+def legacy_get_feature(model, device, sketch, text):
+    model, transformer, (zero_sketch, zero_text) = legacy_setup(model, device)
+    sketch_feature = zero_sketch
+    if sketch is not None:
+        sketch_feature = model.encode_sketch(transformer(sketch).unsqueeze(0).to(device))
+        sketch_feature = sketch_feature / sketch_feature.norm(dim=-1, keepdim=True)
+    text_feature = zero_text
+    if text:
+        text_feature = model.encode_text(tokenize([str(text)])[0].unsqueeze(0).to(device))
+        text_feature = text_feature / text_feature.norm(dim=-1, keepdim=True)
+    return model.feature_fuse(sketch_feature, text_feature)
+
+
+def time_ms(fn, iterations, device):
+    fn()  # warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    model = load_model(device)
+    session = EncoderSession(model)
+    sketch = Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8))
+    text = "a waterfall in a pine forest"
+
+    print(f"device={device}, {args.iterations} iterations, median ms")
+    setup_before = time_ms(lambda: legacy_setup(model, device), args.iterations, device)
+    print(f"  {'per-call setup':<14} before {setup_before:8.3f}   after {0.0:8.3f}")
+    for label, query_sketch, query_text in (('sketch', sketch, ''), ('text', None, text), ('sketch+text', sketch, text)):
+        before = time_ms(lambda: legacy_get_feature(model, device, query_sketch, query_text), args.iterations, device)
+        after = time_ms(lambda: session.get_feature(query_sketch, query_text), args.iterations, device)
+        print(f"  {label:<14} before {before:8.3f}   after {after:8.3f}   saved {before - after:7.3f}")
+
+
+if __name__ == '__main__':
+    main()
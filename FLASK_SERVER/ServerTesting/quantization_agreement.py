@@ -0,0 +1,87 @@
+"""
+Retrieval agreement and CPU latency of the int8 dynamic-quantized TSBIR model versus fp32.
+
+Queries are a held-out sample of image captions from the FAISS metadata, plus sketches
+from --sketch-dir (alone and paired with a caption). Both models encode every query,
+the served image index is searched with k=150 and overlap@150 (shared results / 150)
+is reported together with encode latency and serving-tower weight size.
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/quantization_agreement.py --queries 200 --sketch-dir ./sketches/
+"""
+import argparse
+import copy
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import torch
+from PIL import Image
+
+from Sketch2ImageRetriever.faiss_class import FaissMetadataIndex
+from Sketch2ImageRetriever.initialize_model import FAISS_INDEX_PATH, _load_tsbir_model, model_file
+from Sketch2ImageRetriever.quantization import quantize_dynamic_int8
+from Sketch2ImageRetriever.session import EncoderSession
+
+
+def serving_weight_mb(model):
+    """Bytes of the sketch / text towers as they would be saved"""
+    buffer = io.BytesIO()
+    torch.save({'visual2': model.visual2.state_dict(), 'transformer': model.transformer.state_dict()}, buffer)
+    return buffer.tell() / 2**20
+
+
+def load_queries(index, count, sketch_dir, seed):
+    rng = np.random.default_rng(seed)
+    captions = [row['caption'] for row in index.metadata_rows(rng.permutation(len(index.metadata)), ['caption'])
+                if row['caption']][:count]
+    queries = [(None, caption) for caption in captions]
+    if sketch_dir:
+        paths = sorted(p for p in Path(sketch_dir).iterdir() if p.suffix.lower() in ('.png', '.jpg', '.jpeg'))
+        for i, path in enumerate(paths):
+            sketch = Image.open(path).convert('RGB')
+            queries.append((sketch, ''))
+            queries.append((sketch, captions[i % len(captions)]))
+    return queries
+
+
+def encode_all(session, queries):
+    start = time.perf_counter()
+    features = torch.cat([session.get_feature(sketch, text) for sketch, text in queries])
+    return features.cpu().numpy(), (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', default=str(FAISS_INDEX_PATH))
+    parser.add_argument('--queries', type=int, default=200, help="held-out captions")
+    parser.add_argument('--sketch-dir', default=None)
+    parser.add_argument('--k', type=int, default=150)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not model_file.exists():
+        sys.exit(f"Checkpoint {model_file} not found; agreement needs the trained model")
+    fp32_model = _load_tsbir_model('cpu', 'fp32')
+    int8_model = quantize_dynamic_int8(copy.deepcopy(fp32_model))
+    index = FaissMetadataIndex.load(args.index, mmap=True)
+    queries = load_queries(index, args.queries, args.sketch_dir, args.seed)
+
+    fp32_features, fp32_ms = encode_all(EncoderSession(fp32_model), queries)
+    int8_features, int8_ms = encode_all(EncoderSession(int8_model), queries)
+    _, fp32_ids = index.index.search(fp32_features, args.k)
+    _, int8_ids = index.index.search(int8_features, args.k)
+    overlaps = np.array([len(np.intersect1d(a, b)) / args.k for a, b in zip(fp32_ids, int8_ids)])
+
+    print(f"{len(queries)} queries ({args.queries} captions, {len(queries) - args.queries} sketch queries)")
+    print(f"overlap@{args.k}: mean {overlaps.mean():.4f}  p10 {np.percentile(overlaps, 10):.4f}  min {overlaps.min():.4f}")
+    print(f"encode latency: fp32 {fp32_ms:.1f} ms/query, int8 {int8_ms:.1f} ms/query ({fp32_ms / int8_ms:.2f}x)")
+    print(f"serving tower weights: fp32 {serving_weight_mb(fp32_model):.1f} MB, int8 {serving_weight_mb(int8_model):.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
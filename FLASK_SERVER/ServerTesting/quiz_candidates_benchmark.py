@@ -0,0 +1,79 @@
+"""
+Latency against quiz diversity for the two-stage quiz (vector-index candidates, then the
+DPP on the M x M candidate kernel) versus the DPP over all tours.
+
+For every candidate count M and exploration share, `recommend` is run for a few seeds
+and each sampled quiz is scored on the full-corpus reweighted kernel L:
+  log det         log det(L_S): joint diversity and quality of the quiz
+  min distance    smallest pairwise embedding distance inside the quiz
+  relevance       mean full-corpus quality weight of the quiz tours (attraction / repulsion)
+ms/req is the median recommend() latency (the candidate index is built before timing).
+
+Embeddings are the quiz tour embeddings of the serving snapshot when present, otherwise
+synthetic ones (see dpp_scaling_benchmark.py).
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/quiz_candidates_benchmark.py --tours 4000 --candidates 100 200 400 800
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from quizAlgo.dpp_utils import DPPRecommender, squared_distance_matrix
+from dpp_scaling_benchmark import load_embeddings
+
+GAMMA = 0.1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tours', type=int, default=4000)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[100, 200, 400, 800])
+    parser.add_argument('--exploration', type=float, nargs='+', default=[0.0, 0.2, 0.5])
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embedding_matrix = load_embeddings(args.tours, rng)
+    tour_ids = np.arange(args.tours)
+    recommender = DPPRecommender.from_arrays(tour_ids, embedding_matrix, {int(i): {} for i in tour_ids})
+    recommender.vector_index  # built once, outside the timings
+
+    positive_ids, negative_ids = [int(i) for i in rng.choice(args.tours, 3, replace=False)][:2], [7]
+    squared_distances = squared_distance_matrix(embedding_matrix).astype(np.float64)
+    weights = recommender.quality_weights(positive_ids, negative_ids)
+    kernel = np.sqrt(weights)[:, np.newaxis] * np.exp(-GAMMA * squared_distances) * np.sqrt(weights)[np.newaxis, :]
+
+    def score(rows):
+        rows = np.asarray(rows)
+        sign, log_det = np.linalg.slogdet(kernel[np.ix_(rows, rows)])
+        pairwise = squared_distances[np.ix_(rows, rows)] + np.diag(np.full(len(rows), np.inf))
+        return (log_det if sign > 0 else -np.inf), np.sqrt(pairwise.min()), weights[rows].mean()
+
+    configurations = [(None, None)] + [(m, e) for m in args.candidates for e in args.exploration]
+    print(f"{args.tours} tours, k={args.k}, {args.samples} quizzes per configuration")
+    print(f"{'candidates':>10} {'exploration':>11} {'log det':>9} {'min distance':>12} {'relevance':>9} {'ms/req':>8}")
+    for candidates, exploration in configurations:
+        metrics, timings = [], []
+        for seed in range(args.samples):
+            start = time.perf_counter()
+            result = recommender.recommend(positive_ids, negative_ids, k=args.k, include_embeddings=False,
+                                           random_state=seed, candidates=candidates,
+                                           exploration=exploration if exploration is not None else 0.2)
+            timings.append((time.perf_counter() - start) * 1000)
+            metrics.append(score([recommender.row_of[item['tour_id']] for item in result['recommendations']]))
+        log_det, min_distance, relevance = np.mean(metrics, axis=0)
+        label = 'all' if candidates is None else str(candidates)
+        shown = '' if exploration is None else f"{exploration:.1f}"
+        print(f"{label:>10} {shown:>11} {log_det:>9.2f} {min_distance:>12.3f} {relevance:>9.3f} "
+              f"{np.median(timings):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
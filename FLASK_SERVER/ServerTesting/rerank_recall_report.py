@@ -0,0 +1,58 @@
+"""
+recall@k of a compressed Sketch2Image index, with and without exact float16 re-ranking,
+measured against the flat index currently served.
+
+Builds the compressed index from the vectors of the flat index, uses a held-out sample
+of (perturbed) image vectors as queries, and prints recall@k and query latency.
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/rerank_recall_report.py --index-type IVF1024,PQ32 --nprobe 32
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from Sketch2ImageRetriever.faiss_class import FaissMetadataIndex
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flat-index', default='./Sketch2ImageRetriever/faiss_index/')
+    parser.add_argument('--index-type', default='IVF1024,PQ32')
+    parser.add_argument('--nprobe', type=int, default=32)
+    parser.add_argument('--k', type=int, default=150)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.05)
+    args = parser.parse_args()
+
+    flat = FaissMetadataIndex.load(args.flat_index)
+    vectors = flat.index.reconstruct_n(0, flat.index.ntotal)
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    compressed = FaissMetadataIndex(dimension=flat.dimension, index_type=args.index_type,
+                                    use_gpu=False, store_full_vectors=True)
+    compressed.train(vectors)
+    compressed.add_embeddings(vectors, flat.metadata)
+
+    report = compressed.recall_report(queries, k=args.k, reference=flat, nprobe=args.nprobe)
+    print(f"{args.index_type}, nprobe={args.nprobe}, {len(vectors)} images, {args.queries} queries")
+    for factor, recall in report.items():
+        start = time.perf_counter()
+        for query in queries:
+            compressed.search(query, k=args.k, nprobe=args.nprobe, rerank_factor=factor)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        label = "no re-rank" if factor == 1 else f"re-rank x{factor}"
+        print(f"  {label:<12} recall@{args.k} = {recall:.4f}   {latency_ms:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
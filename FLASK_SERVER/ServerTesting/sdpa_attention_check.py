@@ -0,0 +1,112 @@
+"""
+Numerical equivalence and CPU latency of the fused scaled-dot-product attention path in
+the CLIP Transformer blocks versus the previous nn.MultiheadAttention path.
+
+The previous path (sequence-first layout, materialized 77x77 causal mask cast on every
+call) is re-implemented here on the same weights, so both paths run on the same model.
+The trained checkpoint is used when present, otherwise randomly initialized weights.
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/sdpa_attention_check.py --iterations 20 --batch-size 1
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import torch
+
+from Sketch2ImageRetriever.code.clip import CLIP, tokenize
+from Sketch2ImageRetriever.initialize_model import _load_tsbir_model, model_config_file, model_file, serving_model_file
+
+
+def causal_mask(length):
+    """The previous additive causal mask of the text transformer (-inf above the diagonal)"""
+    return torch.full((length, length), float("-inf")).triu_(1)
+
+
+def mha_transformer(transformer, x, attn_mask=None):
+    """Previous Transformer.forward: x is [length, batch, width]"""
+    for block in transformer.resblocks:
+        mask = attn_mask.to(dtype=x.dtype, device=x.device) if attn_mask is not None else None
+        x = x + block.attn(block.ln_1(x), block.ln_1(x), block.ln_1(x), need_weights=False, attn_mask=mask)[0]
+        x = x + block.mlp(block.ln_2(x))
+    return x
+
+
+@torch.no_grad()
+def mha_encode_text(model, text):
+    x = model.token_embedding(text).type(model.dtype)
+    x = x + model.positional_embedding.type(model.dtype)
+    x = x.permute(1, 0, 2)  # NLD -> LND
+    x = mha_transformer(model.transformer, x, causal_mask(model.context_length))
+    x = x.permute(1, 0, 2)  # LND -> NLD
+    x = model.ln_final(x).type(model.dtype)
+    return x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ model.text_projection
+
+
+@torch.no_grad()
+def mha_encode_sketch(model, image):
+    visual = model.visual2
+    x = visual.conv1(image.type(model.dtype))
+    x = x.reshape(x.shape[0], x.shape[1], -1).permute(0, 2, 1)
+    x = torch.cat([visual.class_embedding.to(x.dtype) + torch.zeros(x.shape[0], 1, x.shape[-1], dtype=x.dtype), x], dim=1)
+    x = visual.ln_pre(x + visual.positional_embedding.to(x.dtype))
+    x = mha_transformer(visual.transformer, x.permute(1, 0, 2)).permute(1, 0, 2)
+    return visual.ln_post(x[:, 0, :]) @ visual.proj
+
+
+def load_model():
+    if model_file.exists() or serving_model_file.exists():
+        return _load_tsbir_model('cpu')
+    with open(model_config_file, 'r') as f:
+        return CLIP(**json.load(f)).eval()
+
+
+def latency_ms(fn, iterations):
+    fn()  # warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+    model = load_model()
+    text = tokenize(["mountain", "water body", "a wooden bridge over a mountain stream", "castle ruins"]
+                    * args.batch_size)[:args.batch_size]
+    images = torch.randn(args.batch_size, 3, model.visual2.input_resolution, model.visual2.input_resolution)
+
+    with torch.no_grad():
+        text_diff = (model.encode_text(text) - mha_encode_text(model, text)).abs().max().item()
+        sketch_diff = (model.encode_sketch(images) - mha_encode_sketch(model, images)).abs().max().item()
+    print(f"max |fused - MHA|: encode_text {text_diff:.2e}, encode_sketch {sketch_diff:.2e}")
+    assert text_diff < 1e-3 and sketch_diff < 1e-3, "fused attention does not match the MHA path"
+
+    print(f"CPU latency, batch {args.batch_size}, {torch.get_num_threads()} threads, median ms")
+    for label, fused, reference in (
+            ('encode_text', lambda: model.encode_text(text), lambda: mha_encode_text(model, text)),
+            ('encode_sketch', lambda: model.encode_sketch(images), lambda: mha_encode_sketch(model, images))):
+        with torch.no_grad():
+            before = latency_ms(reference, args.iterations)
+            after = latency_ms(fused, args.iterations)
+        print(f"  {label:<14} MHA {before:8.2f}   fused SDPA {after:8.2f}   ({before / after:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
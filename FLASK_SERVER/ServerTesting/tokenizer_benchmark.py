@@ -0,0 +1,153 @@
+"""
+Import time, load time and throughput of the CLIP BPE tokenizer.
+
+The previous tokenizer (gunzip + parse of the merge list in __init__, ftfy on every
+text, min()-over-pairs merge loop, unbounded cache) is re-implemented here as the
+reference; the current one loads the precompiled binary table and merges with a priority
+queue. Both must produce identical tokens. Throughput is measured with a cold word cache (every word runs BPE)
+and a warm one, over the FAISS index captions plus typical short queries.
+
+Run from the FLASK_SERVER directory:
+    python ServerTesting/tokenizer_benchmark.py --captions 5000
+"""
+import argparse
+import gzip
+import html
+import pickle
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ftfy
+import numpy as np
+import regex as re
+
+from Sketch2ImageRetriever.code.clip.tokenizer import (SimpleTokenizer, bytes_to_unicode, default_bpe, get_pairs,
+                                                       whitespace_clean)
+from Sketch2ImageRetriever.metadata_store import ColumnarMetadataStore
+from Sketch2ImageRetriever.initialize_model import FAISS_INDEX_PATH
+
+SHORT_QUERIES = ["mountain", "forest trail", "beach view", "snowy peak", "old bridge", "lake with boats"]
+
+
+class LegacyTokenizer:
+    """The previous SimpleTokenizer encode path"""
+    def __init__(self, bpe_path=default_bpe()):
+        self.byte_encoder = bytes_to_unicode()
+        merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
+        merges = [tuple(merge.split()) for merge in merges[1:49152-256-2+1]]
+        vocab = list(self.byte_encoder.values())
+        vocab = vocab + [v+'</w>' for v in vocab] + [''.join(merge) for merge in merges]
+        special_tokens = ['<start_of_text>', '<end_of_text>']
+        self.encoder = dict(zip(vocab + special_tokens, range(len(vocab) + 2)))
+        self.bpe_ranks = dict(zip(merges, range(len(merges))))
+        self.cache = {t: t for t in special_tokens}
+        self.pat = re.compile("|".join(special_tokens) +
+                              r"""|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""", re.IGNORECASE)
+
+    def bpe(self, token):
+        if token in self.cache:
+            return self.cache[token]
+        word = tuple(token[:-1]) + (token[-1] + '</w>',)
+        pairs = get_pairs(word)
+        if not pairs:
+            return token+'</w>'
+        while True:
+            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float('inf')))
+            if bigram not in self.bpe_ranks:
+                break
+            first, second = bigram
+            new_word, i = [], 0
+            while i < len(word):
+                try:
+                    j = word.index(first, i)
+                except ValueError:
+                    new_word.extend(word[i:])
+                    break
+                new_word.extend(word[i:j])
+                i = j
+                if word[i] == first and i < len(word)-1 and word[i+1] == second:
+                    new_word.append(first+second)
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            word = tuple(new_word)
+            if len(word) == 1:
+                break
+            pairs = get_pairs(word)
+        word = ' '.join(word)
+        self.cache[token] = word
+        return word
+
+    def encode(self, text):
+        bpe_tokens = []
+        text = html.unescape(html.unescape(ftfy.fix_text(text))).strip()
+        text = whitespace_clean(text).lower()
+        for token in re.findall(self.pat, text):
+            token = ''.join(self.byte_encoder[b] for b in token.encode('utf-8'))
+            bpe_tokens.extend(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(' '))
+        return bpe_tokens
+
+
+def load_captions(count):
+    if ColumnarMetadataStore.exists(FAISS_INDEX_PATH):
+        metadata = ColumnarMetadataStore.load(FAISS_INDEX_PATH)
+    else:
+        with open(FAISS_INDEX_PATH / 'metadata.pkl', 'rb') as f:
+            metadata = pickle.load(f)
+    rows = [metadata[int(i)] for i in np.random.default_rng(0).permutation(len(metadata))]
+    return SHORT_QUERIES * 50 + [row['caption'] for row in rows if row['caption']][:count]
+
+
+def import_time():
+    """Seconds to import the clip package in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import Sketch2ImageRetriever.code.clip; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=Path(__file__).resolve().parent.parent)
+    return float(output.stdout.strip())
+
+
+def throughput(encode, texts, reset_cache):
+    reset_cache()
+    start = time.perf_counter()
+    tokens = sum(len(encode(text)) for text in texts)
+    cold = tokens / (time.perf_counter() - start)
+    start = time.perf_counter()
+    sum(len(encode(text)) for text in texts)
+    warm = tokens / (time.perf_counter() - start)
+    return cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captions', type=int, default=5000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    legacy = LegacyTokenizer()
+    legacy_load = time.perf_counter() - start
+    start = time.perf_counter()
+    tokenizer = SimpleTokenizer()
+    load = time.perf_counter() - start
+
+    texts = load_captions(args.captions)
+    mismatches = sum(legacy.encode(text) != tokenizer.encode(text) for text in texts)
+    print(f"{len(texts)} texts, {mismatches} token mismatches")
+    assert mismatches == 0, "tokenizer output differs from the previous tokenizer"
+
+    print(f"import Sketch2ImageRetriever.code.clip: {import_time() * 1000:.1f} ms (tokenizer loads lazily)")
+    print(f"tokenizer load: previous {legacy_load * 1000:.1f} ms   precompiled {load * 1000:.1f} ms")
+    legacy_cold, legacy_warm = throughput(
+        legacy.encode, texts, lambda: setattr(legacy, 'cache', {t: t for t in ['<start_of_text>', '<end_of_text>']}))
+    cold, warm = throughput(tokenizer.encode, texts, tokenizer.cache.clear)
+    print("tokens/sec       previous    current")
+    print(f"  cold cache  {legacy_cold:10.0f} {cold:10.0f}")
+    print(f"  warm cache  {legacy_warm:10.0f} {warm:10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 from .query_features import get_feature
 from .initialize_model import initialize_model,process_sketch
+from .batching import FeatureBatcher
+from .session import EncoderSession, session_for
 
-__all__ = ['initialize_model', 'process_sketch', 'get_feature']
+__all__ = ['initialize_model', 'process_sketch', 'get_feature', 'FeatureBatcher', 'EncoderSession', 'session_for']
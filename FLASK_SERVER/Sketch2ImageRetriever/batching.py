@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from collections import Counter, deque
+from typing import List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .session import session_for
+
+
+class _PendingQuery:
+    __slots__ = ('sketch', 'text', 'enqueued', 'done', 'feature', 'error')
+
+    def __init__(self, sketch: Optional[Image.Image], text: Optional[str]):
+        self.sketch = sketch
+        self.text = text
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.feature = None
+        self.error = None
+
+
+class FeatureBatcher:
+    """
+    Dynamic micro-batching in front of `get_feature`.
+
+    Concurrent callers enqueue their (sketch, caption) query; a single scheduler thread
+    collects the queries that arrive within `window_ms` of the first one (up to
+    `max_batch_size`), runs one batched `encode_sketch` (visual2) forward and one batched
+    `encode_text` forward, fuses the features and hands each caller its own row.
+    """
+    def __init__(self, model, max_batch_size: int = 16, window_ms: float = 5.0, metrics_window: int = 10000):
+        self.model = model
+        self.session = session_for(model)
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_waits = deque(maxlen=metrics_window)
+        self._forward_times = deque(maxlen=metrics_window)
+        self._requests = 0
+
+        self._thread = threading.Thread(target=self._run, name='sketch-feature-batcher', daemon=True)
+        self._thread.start()
+
+    def get_feature(self, query_sketch: Optional[Image.Image] = None, query_text: Optional[str] = None) -> torch.Tensor:
+        """Same contract as `get_feature(model, ...)`: returns a (1, embed_dim) fused feature"""
+        pending = _PendingQuery(query_sketch, query_text)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.feature
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch: List[_PendingQuery]):
+        start = time.perf_counter()
+        try:
+            fused = self._encode(batch)
+            for i, pending in enumerate(batch):
+                pending.feature = fused[i:i + 1]
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        finally:
+            end = time.perf_counter()
+            with self._metrics_lock:
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._queue_waits.extend(start - pending.enqueued for pending in batch)
+                self._forward_times.append(end - start)
+            for pending in batch:
+                pending.done.set()
+
+    def _encode(self, batch: List[_PendingQuery]) -> torch.Tensor:
+        fused = self.session.encode_batch([pending.sketch for pending in batch],
+                                          [pending.text for pending in batch])
+        return fused.cpu()
+
+    def metrics(self) -> dict:
+        """Batch-size distribution plus queue-wait and forward-time percentiles (ms)"""
+        with self._metrics_lock:
+            batches = sum(self._batch_sizes.values())
+            waits = np.array(self._queue_waits) * 1000.0
+            forwards = np.array(self._forward_times) * 1000.0
+            histogram = dict(sorted(self._batch_sizes.items()))
+            requests = self._requests
+
+        def percentiles(values):
+            if len(values) == 0:
+                return None
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3)}
+
+        return {
+            'window_ms': self.window * 1000.0,
+            'max_batch_size': self.max_batch_size,
+            'requests': requests,
+            'batches': batches,
+            'mean_batch_size': round(requests / batches, 3) if batches else None,
+            'batch_size_histogram': {str(size): count for size, count in histogram.items()},
+            'queue_wait_ms': percentiles(waits),
+            'forward_ms': percentiles(forwards),
+            'queue_depth': self._queue.qsize(),
+        }
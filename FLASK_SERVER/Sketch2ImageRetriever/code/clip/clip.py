@@ -2,6 +2,7 @@
 
 import hashlib
 import os
+import threading
 import urllib
 import warnings
 from typing import Union, List
@@ -15,7 +16,18 @@ from .model import build_model
 from .tokenizer import SimpleTokenizer as _Tokenizer
 
 __all__ = ["available_models", "load", "tokenize"]
-_tokenizer = _Tokenizer()
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> _Tokenizer:
+    """The shared tokenizer, loaded on first use rather than at import"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = _Tokenizer()
+    return _tokenizer
 
 _MODELS = {
     "RN50": "https://openaipublic.azureedge.net/clip/models/afeb0e10f9e5a86da6080e35cf09123aca3b358a0c3e3b6c78a7b63bc04b6762/RN50.pt",
@@ -219,9 +231,10 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 77) -> torch.Lo
     if isinstance(texts, str):
         texts = [texts]
 
-    sot_token = _tokenizer.encoder["<start_of_text>"]
-    eot_token = _tokenizer.encoder["<end_of_text>"]
-    all_tokens = [[sot_token] + _tokenizer.encode(text) + [eot_token] for text in texts]
+    tokenizer = get_tokenizer()
+    sot_token = tokenizer.encoder["<start_of_text>"]
+    eot_token = tokenizer.encoder["<end_of_text>"]
+    all_tokens = [[sot_token] + tokens + [eot_token] for tokens in tokenizer.encode_batch(texts)]
     result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
 
     for i, tokens in enumerate(all_tokens):
@@ -167,7 +167,7 @@ class QuickGELU(nn.Module):
 
 
 class ResidualAttentionBlock(nn.Module):
-    def __init__(self, d_model: int, n_head: int, attn_mask: torch.Tensor = None):
+    def __init__(self, d_model: int, n_head: int, attn_mask: torch.Tensor = None, is_causal: bool = False):
         super().__init__()
 
         self.attn = nn.MultiheadAttention(d_model, n_head)
@@ -179,10 +179,26 @@ class ResidualAttentionBlock(nn.Module):
         ]))
         self.ln_2 = LayerNorm(d_model)
         self.attn_mask = attn_mask
+        # Causal blocks (the text transformer) use the fused kernel's flag instead of a mask
+        self.is_causal = is_causal
 
     def attention(self, x: torch.Tensor):
-        self.attn_mask = self.attn_mask.to(dtype=x.dtype, device=x.device) if self.attn_mask is not None else None
-        return self.attn(x, x, x, need_weights=False, attn_mask=self.attn_mask)[0]
+        # x: [batch, length, width]. self.attn only holds the projection weights (the
+        # checkpoint layout); attention itself runs in the fused SDPA kernel
+        batch, length, width = x.shape
+        heads = self.attn.num_heads
+        in_proj = getattr(self.attn, 'in_proj', None)  # set by Sketch2ImageRetriever.quantization
+        if in_proj is not None:
+            qkv = in_proj(x)
+        else:
+            qkv = F.linear(x, self.attn.in_proj_weight, self.attn.in_proj_bias)
+        q, k, v = qkv.view(batch, length, 3, heads, width // heads).permute(2, 0, 3, 1, 4)
+
+        attn_mask = None
+        if self.attn_mask is not None and not self.is_causal:
+            attn_mask = self.attn_mask[:length, :length].to(dtype=x.dtype, device=x.device)
+        x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, is_causal=self.is_causal)
+        return self.attn.out_proj(x.transpose(1, 2).reshape(batch, length, width))
 
     def forward(self, x: torch.Tensor):
         x = x + self.attention(self.ln_1(x))
@@ -191,13 +207,14 @@ class ResidualAttentionBlock(nn.Module):
 
 
 class Transformer(nn.Module):
-    def __init__(self, width: int, layers: int, heads: int, attn_mask: torch.Tensor = None):
+    def __init__(self, width: int, layers: int, heads: int, attn_mask: torch.Tensor = None, is_causal: bool = False):
         super().__init__()
         self.width = width
         self.layers = layers
-        self.resblocks = nn.Sequential(*[ResidualAttentionBlock(width, heads, attn_mask) for _ in range(layers)])
+        self.resblocks = nn.Sequential(*[ResidualAttentionBlock(width, heads, attn_mask, is_causal) for _ in range(layers)])
 
     def forward(self, x: torch.Tensor):
+        # x: [batch, length, width]
         return self.resblocks(x)
 
 
@@ -226,9 +243,7 @@ class VisualTransformer(nn.Module):
         x = x + self.positional_embedding.to(x.dtype)
         x = self.ln_pre(x)
 
-        x = x.permute(1, 0, 2)  # NLD -> LND
         x = self.transformer(x)
-        x = x.permute(1, 0, 2)  # LND -> NLD
 
         x = self.ln_post(x[:, 0, :])
 
@@ -254,7 +269,8 @@ class CLIP(nn.Module):
                  
                  weight_sharing: bool = False,
                  feature_fusion: str = 'avg',
-                 num_class: int = 90
+                 num_class: int = 90,
+                 sketch_text_only: bool = False
                  ):
         super().__init__()
         #set default to weight sharing
@@ -267,17 +283,7 @@ class CLIP(nn.Module):
 
         if isinstance(vision_layers, (tuple, list)):
             vision_heads = vision_width * 32 // 64
-            self.visual = ModifiedResNet(
-                layers=vision_layers,
-                output_dim=embed_dim,
-                heads=vision_heads,
-                input_resolution=image_resolution,
-                width=vision_width
-            )
-            if weight_sharing:
-                self.visual2 = self.visual
-            else:
-                self.visual2= ModifiedResNet(
+            build_tower = lambda: ModifiedResNet(
                 layers=vision_layers,
                 output_dim=embed_dim,
                 heads=vision_heads,
@@ -286,18 +292,7 @@ class CLIP(nn.Module):
             )
         else:
             vision_heads = vision_width // 64
-            self.visual = VisualTransformer(
-                input_resolution=image_resolution,
-                patch_size=vision_patch_size,
-                width=vision_width,
-                layers=vision_layers,
-                heads=vision_heads,
-                output_dim=embed_dim
-            )
-            if weight_sharing:
-                self.visual2 = self.visual
-            else:
-                self.visual2 = VisualTransformer(
+            build_tower = lambda: VisualTransformer(
                 input_resolution=image_resolution,
                 patch_size=vision_patch_size,
                 width=vision_width,
@@ -305,12 +300,18 @@ class CLIP(nn.Module):
                 heads=vision_heads,
                 output_dim=embed_dim
             )
+        # Serving only encodes sketches and text: sketch_text_only skips the photo tower
+        self.visual = None if sketch_text_only and not weight_sharing else build_tower()
+        if weight_sharing:
+            self.visual2 = self.visual
+        else:
+            self.visual2 = build_tower()
         
         self.transformer = Transformer(
             width=transformer_width,
             layers=transformer_layers,
             heads=transformer_heads,
-            attn_mask=self.build_attention_mask()
+            is_causal=True
         )
 
         self.vocab_size = vocab_size
@@ -367,36 +368,35 @@ class CLIP(nn.Module):
         if self.text_projection is not None:
             nn.init.normal_(self.text_projection, std=self.transformer.width ** -0.5)
 
-    def build_attention_mask(self):
-        # lazily create causal attention mask, with full attention between the vision tokens
-        # pytorch uses additive attention mask; fill with -inf
-        mask = torch.empty(self.context_length, self.context_length)
-        mask.fill_(float("-inf"))
-        mask.triu_(1)  # zero out the lower diagonal
-        return mask
-
     @property
     def dtype(self):
-        return self.visual.conv1.weight.dtype
+        return self.visual2.conv1.weight.dtype
     def decode(self,caption, encode):
         return self.decoder(caption,context=encode)
     def encode_image(self, image):
+        if self.visual is None:
+            raise RuntimeError("This model was built with sketch_text_only=True and has no photo tower")
         return self.visual(image.type(self.dtype))
     def encode_sketch(self, image):
         return self.visual2(image.type(self.dtype))
 
-    def encode_text(self, text):
+    def encode_text(self, text, trim_padding: bool = False):
+        # eot_token is the highest number in each sequence
+        eot = text.argmax(dim=-1)
+        if trim_padding:
+            # Attention is causal, so positions after the last EOT never reach a selected
+            # feature: drop them (and the matching positional embeddings)
+            text = text[:, :int(eot.max()) + 1]
+
         x = self.token_embedding(text).type(self.dtype)  # [batch_size, n_ctx, d_model]
 
-        x = x + self.positional_embedding.type(self.dtype)
-        x = x.permute(1, 0, 2)  # NLD -> LND
+        x = x + self.positional_embedding[:text.shape[1]].type(self.dtype)
         x = self.transformer(x)
-        x = x.permute(1, 0, 2)  # LND -> NLD
         x = self.ln_final(x).type(self.dtype)
 
         # x.shape = [batch_size, n_ctx, transformer.width]
-        # take features from the eot embedding (eot_token is the highest number in each sequence)
-        x = x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ self.text_projection
+        # take features from the eot embedding
+        x = x[torch.arange(x.shape[0]), eot] @ self.text_projection
 
         return x
     def freeze_nonfc(self):
@@ -435,26 +435,26 @@ class CLIP(nn.Module):
             raise Exception(f'Mode {self.feature_fusion} not yet supported')
         return fused_features
     
-def convert_weights(model: nn.Module):
-    """Convert applicable model parameters to fp16"""
+def convert_weights(model: nn.Module, dtype: torch.dtype = torch.float16):
+    """Convert applicable model parameters to fp16 (or `dtype`, e.g. bf16 on CPU)"""
 
     def _convert_weights_to_fp16(l):
         if isinstance(l, (nn.Conv1d, nn.Conv2d, nn.Linear)):
-            l.weight.data = l.weight.data.half()
+            l.weight.data = l.weight.data.to(dtype)
             if l.bias is not None:
-                l.bias.data = l.bias.data.half()
+                l.bias.data = l.bias.data.to(dtype)
 
         if isinstance(l, nn.MultiheadAttention):
             for attr in [*[f"{s}_proj_weight" for s in ["in", "q", "k", "v"]], "in_proj_bias", "bias_k", "bias_v"]:
                 tensor = getattr(l, attr)
                 if tensor is not None:
-                    tensor.data = tensor.data.half()
+                    tensor.data = tensor.data.to(dtype)
 
         for name in ["text_projection", "proj"]:
             if hasattr(l, name):
                 attr = getattr(l, name)
                 if attr is not None:
-                    attr.data = attr.data.half()
+                    attr.data = attr.data.to(dtype)
 
     model.apply(_convert_weights_to_fp16)
 
@@ -1,9 +1,15 @@
 import gzip
+import hashlib
+import heapq
 import html
 import os
+import tempfile
+import threading
+from collections import OrderedDict
 from functools import lru_cache
 
 import ftfy
+import numpy as np
 import regex as re
 
 
@@ -12,6 +18,58 @@ def default_bpe():
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), "bpe_simple_vocab_16e6.txt.gz")
 
 
+def compiled_bpe_path(bpe_path: str) -> str:
+    """
+    Where the binary form of `bpe_path` is cached: CLIP_BPE_CACHE_DIR, else the user cache
+    directory. The name carries a digest of the source file, so edits invalidate it.
+    """
+    cache_dir = os.environ.get('CLIP_BPE_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'fantasy2reality')
+    with open(bpe_path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(bpe_path).split('.')[0]}-{digest}.npz")
+
+
+def compile_bpe(bpe_path: str, output_path: str):
+    """
+    Parse the gzipped merge list once and save the vocabulary and merge table in binary
+    form: `vocab` is the utf-8 newline-joined vocabulary (without special tokens) and
+    `merges` holds one (first id, second id, merged id) row per merge, in rank order.
+    """
+    merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
+    merges = merges[1:49152-256-2+1]
+    merges = [tuple(merge.split()) for merge in merges]
+    vocab = list(bytes_to_unicode().values())
+    vocab = vocab + [v+'</w>' for v in vocab]
+    for merge in merges:
+        vocab.append(''.join(merge))
+    encoder = dict(zip(vocab, range(len(vocab))))
+    # Same rank per pair as dict(zip(merges, ranks)) would keep
+    ranks = dict(zip(merges, range(len(merges))))
+    table = np.array([(encoder[first], encoder[second], encoder[first + second])
+                      for first, second in sorted(ranks, key=ranks.get)], dtype=np.int32)
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or '.', suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, vocab=np.frombuffer('\n'.join(vocab).encode('utf-8'), dtype=np.uint8), merges=table)
+    os.replace(tmp_path, output_path)
+
+
+def load_compiled_bpe(bpe_path: str):
+    """(vocab, merges) of `bpe_path`, compiling and caching the binary form on first use"""
+    path = compiled_bpe_path(bpe_path)
+    if not os.path.exists(path):
+        try:
+            compile_bpe(bpe_path, path)
+        except OSError:
+            # Read-only cache location: compile into a per-process temporary file instead
+            path = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+            compile_bpe(bpe_path, path)
+    with np.load(path) as data:
+        return data['vocab'].tobytes().decode('utf-8').split('\n'), data['merges']
+
+
 @lru_cache()
 def bytes_to_unicode():
     """
@@ -48,8 +106,10 @@ def get_pairs(word):
 
 
 def basic_clean(text):
-    text = ftfy.fix_text(text)
-    text = html.unescape(html.unescape(text))
+    # ftfy leaves printable ASCII without HTML entities unchanged, so it is skipped there
+    if not (text.isascii() and text.isprintable() and '&' not in text):
+        text = ftfy.fix_text(text)
+        text = html.unescape(html.unescape(text))
     return text.strip()
 
 
@@ -60,16 +120,17 @@ def whitespace_clean(text):
 
 
 class SimpleTokenizer(object):
-    def __init__(self, bpe_path: str = default_bpe(), special_tokens=None):
+    """
+    CLIP byte-level BPE tokenizer.
+
+    The vocabulary and merge ranks are loaded from a precompiled binary table (see
+    `compile_bpe`), words are merged in symbol-id space with a priority queue, and
+    the per-word cache is a bounded LRU.
+    """
+    def __init__(self, bpe_path: str = default_bpe(), special_tokens=None, cache_size: int = 50000):
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
-        merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
-        merges = merges[1:49152-256-2+1]
-        merges = [tuple(merge.split()) for merge in merges]
-        vocab = list(bytes_to_unicode().values())
-        vocab = vocab + [v+'</w>' for v in vocab]
-        for merge in merges:
-            vocab.append(''.join(merge))
+        vocab, merges = load_compiled_bpe(bpe_path)
         if not special_tokens:
             special_tokens = ['<start_of_text>', '<end_of_text>']
         else:
@@ -77,64 +138,115 @@ class SimpleTokenizer(object):
         vocab.extend(special_tokens)
         self.encoder = dict(zip(vocab, range(len(vocab))))
         self.decoder = {v: k for k, v in self.encoder.items()}
-        self.bpe_ranks = dict(zip(merges, range(len(merges))))
-        self.cache = {t:t for t in special_tokens}
+
+        # Pair (first id, second id) packed into one int -> (rank, merged id)
+        pair_keys = (merges[:, 0].astype(np.int64) << 32 | merges[:, 1]).tolist()
+        self._merge_ranks = dict(zip(pair_keys, range(len(merges))))
+        self._merged_ids = merges[:, 2].tolist()
+        self._merges = merges
+        # Symbol ids of each byte inside a word and at its end
+        self._byte_ids = [self.encoder[self.byte_encoder[b]] for b in range(256)]
+        self._end_byte_ids = [self.encoder[self.byte_encoder[b] + '</w>'] for b in range(256)]
+
+        self.cache_size = cache_size
+        self._special_cache = {t: (self.encoder[t],) for t in special_tokens}
+        self.cache = OrderedDict()
+        self._cache_lock = threading.Lock()
         special = "|".join(special_tokens)
         self.pat = re.compile(special + r"""|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""", re.IGNORECASE)
 
         self.vocab_size = len(self.encoder)
         self.all_special_ids = [self.encoder[t] for t in special_tokens]
 
+    @property
+    def bpe_ranks(self):
+        """Merge ranks keyed by the (first, second) symbol strings"""
+        return {(self.decoder[first], self.decoder[second]): rank
+                for rank, (first, second, _) in enumerate(self._merges.tolist())}
+
+    def _bpe_ids(self, token):
+        """BPE symbol ids of one pre-tokenized word"""
+        data = token.encode('utf-8')
+        symbols = [self._byte_ids[b] for b in data[:-1]]
+        symbols.append(self._end_byte_ids[data[-1]])
+        n = len(symbols)
+        if n == 1:
+            return tuple(symbols)
+
+        ranks = self._merge_ranks
+        # Doubly linked list over the symbols; merged-away symbols become None
+        next_index = list(range(1, n + 1))
+        prev_index = list(range(-1, n - 1))
+        heap = []
+        for i in range(n - 1):
+            rank = ranks.get(symbols[i] << 32 | symbols[i + 1])
+            if rank is not None:
+                heap.append((rank, i))
+        heapq.heapify(heap)
+
+        # Lowest rank first, leftmost first among equal ranks: the same result as
+        # repeatedly merging every occurrence of the best pair
+        while heap:
+            rank, i = heapq.heappop(heap)
+            j = next_index[i]
+            if symbols[i] is None or j >= n or ranks.get(symbols[i] << 32 | symbols[j]) != rank:
+                continue
+            symbols[i] = self._merged_ids[rank]
+            symbols[j] = None
+            next_index[i] = next_index[j]
+            if next_index[j] < n:
+                prev_index[next_index[j]] = i
+            if prev_index[i] >= 0:
+                left = prev_index[i]
+                left_rank = ranks.get(symbols[left] << 32 | symbols[i])
+                if left_rank is not None:
+                    heapq.heappush(heap, (left_rank, left))
+            if next_index[i] < n:
+                right_rank = ranks.get(symbols[i] << 32 | symbols[next_index[i]])
+                if right_rank is not None:
+                    heapq.heappush(heap, (right_rank, i))
+        return tuple(symbol for symbol in symbols if symbol is not None)
+
+    def bpe_ids(self, token):
+        """Cached `_bpe_ids`"""
+        ids = self._special_cache.get(token)
+        if ids is not None:
+            return ids
+        with self._cache_lock:
+            ids = self.cache.get(token)
+            if ids is not None:
+                self.cache.move_to_end(token)
+                return ids
+        ids = self._bpe_ids(token)
+        with self._cache_lock:
+            self.cache[token] = ids
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return ids
+
     def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token[:-1]) + ( token[-1] + '</w>',)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token+'</w>'
-
-        while True:
-            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                    new_word.append(first+second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
-        self.cache[token] = word
-        return word
+        """BPE symbols of a byte-encoded word, space separated"""
+        if token in self._special_cache:
+            return token
+        text = bytearray([self.byte_decoder[c] for c in token]).decode('utf-8', errors="replace")
+        return ' '.join(self.decoder[i] for i in self.bpe_ids(text))
 
     def encode(self, text):
         bpe_tokens = []
         text = whitespace_clean(basic_clean(text)).lower()
         for token in re.findall(self.pat, text):
-            token = ''.join(self.byte_encoder[b] for b in token.encode('utf-8'))
-            bpe_tokens.extend(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(' '))
+            bpe_tokens.extend(self.bpe_ids(token))
         return bpe_tokens
 
+    def encode_batch(self, texts):
+        """`encode` of each text; repeated texts are encoded once"""
+        encoded = {}
+        for text in texts:
+            if text not in encoded:
+                encoded[text] = self.encode(text)
+        return [list(encoded[text]) for text in texts]
+
     def decode(self, tokens):
         text = ''.join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode('utf-8', errors="replace").replace('</w>', ' ')
-        return text
\ No newline at end of file
+        return text
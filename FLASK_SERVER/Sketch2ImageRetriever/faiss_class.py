@@ -3,58 +3,206 @@ import numpy as np
 from pathlib import Path
 import json
 import pickle
+import threading
+from tqdm import tqdm
+from .metadata_store import ColumnarMetadataStore, save_array, write_atomic
+
+# Shorthands for common index factory strings; any faiss.index_factory string also works
+INDEX_TYPES = {
+    'flat': 'Flat',
+    'ivf_flat': 'IVF1024,Flat',
+    'ivf_pq': 'IVF1024,PQ64',
+    'hnsw_flat': 'HNSW32,Flat',
+    'opq_pq': 'OPQ64,IVF1024,PQ64',
+}
+# Largest k a GPU index can search for
+GPU_MAX_K = 2048
 
 class FaissMetadataIndex:
     """
     Enhanced FAISS index that stores both embeddings and complete image metadata.
     Supports efficient similarity search while maintaining all associated image information.
+    
+    `index_type` selects the FAISS index: 'Flat' (exact inner product, the default), or an
+    approximate index such as 'IVF1024,Flat', 'IVF1024,PQ64', 'HNSW32,Flat' or
+    'OPQ64,IVF1024,PQ64' (see INDEX_TYPES). Approximate indexes other than HNSW must be
+    trained on a sample with `train` before embeddings are added.
+    
+    With `store_full_vectors=True` a float16 copy of every embedding is saved next to the
+    index (memory-mapped on load) and `search(..., rerank_factor=r)` re-scores the
+    k * r candidates of a compressed (PQ/SQ) index exactly against it.
     """
-    def __init__(self, dimension=512):
+    def __init__(self, dimension=512, index_type='Flat', index=None, use_gpu=True, store_full_vectors=False):
         # Initialize FAISS index for embeddings
         self.dimension = dimension
-        self.index = faiss.IndexFlatIP(dimension)
+        self.index_type = INDEX_TYPES.get(index_type, index_type)
+        # Query-time defaults for nprobe / efSearch, persisted with the index
+        self.default_search_params = {}
+        self._search_lock = threading.Lock()
+        
+        if index is None:
+            if self.index_type == 'Flat':
+                index = faiss.IndexFlatIP(dimension)
+            else:
+                index = faiss.index_factory(dimension, self.index_type, faiss.METRIC_INNER_PRODUCT)
+        self.index = index
+        self.on_gpu = False
+        
+        # float16 full-precision vectors for exact re-ranking
+        self.store_full_vectors = store_full_vectors
+        self.full_vectors = None
+        self._pending_full_vectors = []
         
         # Store for image metadata
         self.metadata = []
+        # Row bitmaps per tour attribute value, for filtered search (see set_tour_attributes)
+        self.attribute_bitmaps = {}
         
         # Enable GPU if available
-        if faiss.get_num_gpus() > 0:
-            print("Using GPU for FAISS")
+        if use_gpu and faiss.get_num_gpus() > 0:
+            self._move_to_gpu()
+    
+    def _move_to_gpu(self):
+        try:
             self.index = faiss.index_cpu_to_gpu(
                 faiss.StandardGpuResources(), 0, self.index)
+            self.on_gpu = True
+            print("Using GPU for FAISS")
+        except RuntimeError as e:
+            # e.g. HNSW has no GPU implementation
+            print(f"Keeping {self.index_type} FAISS index on CPU: {str(e)}")
+    
+    @property
+    def is_trained(self):
+        return self.index.is_trained
     
-    def add_embeddings(self, embeddings, metadata_list):
+    def train(self, embeddings, sample_size=200000, seed=0):
         """
-        Add embeddings and their complete metadata to the index individually
+        Train the index (IVF centroids, PQ/OPQ codebooks) on a random sample of embeddings.
+        The trained state is stored in the index file by `save`.
+        """
+        embeddings = self._as_matrix(embeddings)
+        if len(embeddings) > sample_size:
+            rows = np.random.default_rng(seed).choice(len(embeddings), sample_size, replace=False)
+            embeddings = embeddings[np.sort(rows)]
+        print(f"Training {self.index_type} index on {len(embeddings)} embeddings")
+        self.index.train(embeddings)
+    
+    def set_default_search_params(self, nprobe=None, efSearch=None, rerank_factor=None):
+        """Defaults used by `search` when a request does not set nprobe / efSearch / rerank_factor"""
+        if nprobe is not None:
+            self.default_search_params['nprobe'] = int(nprobe)
+        if efSearch is not None:
+            self.default_search_params['efSearch'] = int(efSearch)
+        if rerank_factor is not None:
+            self.default_search_params['rerank_factor'] = int(rerank_factor)
+    
+    def add_embeddings(self, embeddings, metadata_list, chunk_size=65536):
+        """
+        Add embeddings and their complete metadata to the index in bulk
         
         Args:
-            embeddings: numpy array of embeddings
+            embeddings: numpy array of embeddings (n, dimension)
             metadata_list: list of dictionaries containing image metadata
+            chunk_size: rows handed to FAISS per `index.add` call
         """
-        # Ensure embeddings are numpy array with float32 type
-        embeddings = np.array(embeddings).astype('float32')
+        embeddings = self._as_matrix(embeddings)
+        self._check_trained()
         
         # Verify matching lengths
         if len(embeddings) != len(metadata_list):
             raise ValueError(f"Number of embeddings ({len(embeddings)}) must match number of metadata entries ({len(metadata_list)})")
         
-        # Add embeddings and metadata individually
-        for i, (embedding, metadata) in enumerate(zip(embeddings, metadata_list)):
-            # Reshape single embedding to 2D array as required by FAISS
-            embedding_2d = embedding.reshape(1, -1)
-            
-            # Add single embedding to FAISS index
-            self.index.add(embedding_2d)
-            
-            # Add corresponding metadata
-            self.metadata.append(metadata)
+        for start in range(0, len(embeddings), chunk_size):
+            self._add_block(embeddings[start:start + chunk_size])
+        self.metadata.extend(metadata_list)
         
         print(f"Added {len(metadata_list)} items. Total items: {len(self.metadata)}")
     
-    def search(self, query_embedding, k=10):
+    def add_embeddings_stream(self, chunks, chunk_size=65536, total=None):
+        """
+        Add embeddings from an iterator without materializing the whole corpus
+        
+        Args:
+            chunks: iterable of (embeddings, metadata_list) pairs of any size
+            chunk_size: small chunks are buffered and added in blocks of this many
+                rows; peak extra memory is about chunk_size * dimension * 4 bytes
+                plus the largest incoming chunk
+            total: expected number of embeddings, for the progress bar
+        """
+        self._check_trained()
+        buffered_embeddings, buffered_metadata = [], []
+        buffered_rows = 0
+        added = 0
+        
+        def flush():
+            nonlocal buffered_embeddings, buffered_metadata, buffered_rows, added
+            if not buffered_rows:
+                return
+            block = buffered_embeddings[0] if len(buffered_embeddings) == 1 else np.concatenate(buffered_embeddings)
+            self._add_block(block)
+            self.metadata.extend(buffered_metadata)
+            progress.update(buffered_rows)
+            added += buffered_rows
+            buffered_embeddings, buffered_metadata, buffered_rows = [], [], 0
+        
+        with tqdm(total=total, desc="Adding embeddings", unit="vec") as progress:
+            for embeddings, metadata_list in chunks:
+                embeddings = self._as_matrix(embeddings)
+                if len(embeddings) != len(metadata_list):
+                    raise ValueError(f"Chunk has {len(embeddings)} embeddings but {len(metadata_list)} metadata entries")
+                
+                for start in range(0, len(embeddings), chunk_size):
+                    block = embeddings[start:start + chunk_size]
+                    buffered_embeddings.append(block)
+                    buffered_metadata.extend(metadata_list[start:start + chunk_size])
+                    buffered_rows += len(block)
+                    if buffered_rows >= chunk_size:
+                        flush()
+            flush()
+        
+        print(f"Added {added} items. Total items: {len(self.metadata)}")
+    
+    def _add_block(self, block):
+        self.index.add(block)
+        if self.store_full_vectors:
+            self._pending_full_vectors.append(block.astype(np.float16))
+    
+    def _full_vector_matrix(self):
+        """All stored float16 vectors, folding in rows added since the last call"""
+        with self._search_lock:
+            if self._pending_full_vectors:
+                parts = ([self.full_vectors] if self.full_vectors is not None else []) + self._pending_full_vectors
+                self.full_vectors = np.concatenate(parts)
+                self._pending_full_vectors = []
+            return self.full_vectors
+    
+    def _check_trained(self):
+        if not self.index.is_trained:
+            raise RuntimeError(f"{self.index_type} index must be trained before adding embeddings; call train() first")
+    
+    def _as_matrix(self, embeddings):
+        """Contiguous float32 (n, dimension) array as required by FAISS"""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Embeddings have dimension {embeddings.shape[1]}, index expects {self.dimension}")
+        return embeddings
+    
+    def search(self, query_embedding, k=10, nprobe=None, efSearch=None, rerank_factor=None, fields=None,
+               filters=None):
         """
         Search for similar images and return their complete metadata
         
+        Args:
+            nprobe: IVF lists to scan for this query (IVF index types)
+            efSearch: HNSW candidate list size for this query (HNSW index types)
+            rerank_factor: fetch k * rerank_factor candidates from the index and re-score
+                them exactly against the stored float16 vectors
+            fields: metadata fields to return (default: all of them)
+            filters: restrict the search to matching images, see `compile_filters`
+        
         Returns:
             List of tuples: (metadata_dict, similarity_score)
         """
@@ -62,53 +210,484 @@ class FaissMetadataIndex:
         if len(query_embedding.shape) == 1:
             query_embedding = query_embedding.reshape(1, -1)
             
-        distances, indices = self.index.search(query_embedding, k)
+        bitmap = self.compile_filters(filters)
+        distances, indices = self._search_ranked(query_embedding, k, nprobe, efSearch, rerank_factor, bitmap)
         
-        # Return complete metadata for each match
-        results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx < len(self.metadata):  # Ensure valid index
-                results.append({
-                    'metadata': self.metadata[idx],
-                    'similarity': float(dist)
-                })
+        # Ensure valid index (-1 pads short IVF/HNSW results)
+        valid = (indices[0] >= 0) & (indices[0] < len(self.metadata))
+        rows = self.metadata_rows(indices[0][valid], fields)
         
+        # Return metadata for each match
+        return [
+            {'metadata': metadata, 'similarity': float(dist)}
+            for metadata, dist in zip(rows, distances[0][valid])
+        ]
+    
+    def metadata_rows(self, indices, fields=None):
+        """Metadata dicts for the given rows, materializing only `fields` when set"""
+        if isinstance(self.metadata, ColumnarMetadataStore):
+            return self.metadata.rows(indices, fields) if fields else [self.metadata[i] for i in indices]
+        if fields:
+            return [{field: self.metadata[i].get(field) for field in fields} for i in indices]
+        return [self.metadata[i] for i in indices]
+
+    def tour_id_array(self):
+        """int64 tour id of every indexed image (-1 where unknown)"""
+        if isinstance(self.metadata, ColumnarMetadataStore):
+            return self.metadata.tour_ids
+        cached = getattr(self, '_tour_ids', None)
+        if cached is None or len(cached) != len(self.metadata):
+            cached = np.array([m.get('tour_id', -1) for m in self.metadata], dtype=np.int64)
+            self._tour_ids = cached
+        return cached
+
+    def search_grouped(self, query_embedding, n_tours=20, aggregate='max', top_m=3, images_per_tour=3,
+                       fetch_k=None, max_fetch=4096, nprobe=None, efSearch=None, rerank_factor=None,
+                       fields=None, filters=None):
+        """
+        Search for similar images and return one ranked entry per tour
+
+        Over-fetches image hits, doubling k until the hits cover `n_tours` distinct tours
+        (or `max_fetch`, the whole index or the GPU top-k limit is reached), then scores
+        every tour from its hits.
+
+        Args:
+            n_tours: number of tours to return
+            aggregate: tour score from its image scores: 'max', 'mean' or 'top_m'
+                (mean of the tour's `top_m` best images)
+            images_per_tour: best images returned with each tour
+            fetch_k: initial number of image hits (default 4 * n_tours)
+            filters: restrict the search to matching images, see `compile_filters`
+
+        Returns:
+            List of dicts: {'tour_id', 'score', 'num_hits', 'images': [{'metadata', 'similarity'}]}
+        """
+        if aggregate not in ('max', 'mean', 'top_m'):
+            raise ValueError(f"Unknown aggregate {aggregate!r}; expected 'max', 'mean' or 'top_m'")
+        query_embedding = np.array(query_embedding).astype('float32')
+        if len(query_embedding.shape) == 1:
+            query_embedding = query_embedding.reshape(1, -1)
+
+        tour_ids = self.tour_id_array()
+        bitmap = self.compile_filters(filters)
+        # GPU indexes cannot search for more than GPU_MAX_K hits
+        limit = min(max_fetch, self._fetch_limit())
+        k = min(fetch_k or 4 * n_tours, limit)
+        while True:
+            distances, indices = self._search_ranked(query_embedding, k, nprobe, efSearch, rerank_factor, bitmap)
+            valid = (indices[0] >= 0) & (indices[0] < len(tour_ids))
+            ids, scores = indices[0][valid], distances[0][valid]
+            hit_tours = tour_ids[ids]
+            if k >= limit or len(np.unique(hit_tours)) >= n_tours:
+                break
+            k = min(2 * k, limit)
+        if not len(ids):
+            return []
+
+        # Group hits by tour; hits arrive best first, so a stable sort keeps each
+        # group's images in descending score order
+        tours, group, counts = np.unique(hit_tours, return_inverse=True, return_counts=True)
+        order = np.argsort(group, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sorted_scores = scores[order]
+
+        if aggregate == 'max':
+            tour_scores = sorted_scores[starts]
+        elif aggregate == 'mean':
+            tour_scores = np.add.reduceat(sorted_scores, starts) / counts
+        else:
+            rank = np.arange(len(order)) - np.repeat(starts, counts)
+            top = rank < top_m
+            tour_scores = (np.bincount(group[order][top], weights=sorted_scores[top], minlength=len(tours))
+                           / np.minimum(counts, top_m))
+
+        best = np.argsort(-tour_scores, kind='stable')[:n_tours]
+        shown = np.minimum(counts[best], images_per_tour)
+        image_positions = np.concatenate([order[starts[g]:starts[g] + n] for g, n in zip(best, shown)])
+        rows = self.metadata_rows(ids[image_positions], fields)
+
+        results = []
+        offset = 0
+        for g, n in zip(best, shown):
+            results.append({
+                'tour_id': int(tours[g]),
+                'score': float(tour_scores[g]),
+                'num_hits': int(counts[g]),
+                'images': [
+                    {'metadata': metadata, 'similarity': float(score)}
+                    for metadata, score in zip(rows[offset:offset + n], scores[image_positions[offset:offset + n]])
+                ]
+            })
+            offset += n
         return results
+
+    def _search_ranked(self, queries, k, nprobe=None, efSearch=None, rerank_factor=None, bitmap=None):
+        """index.search, followed by exact float16 re-ranking when it is enabled"""
+        if rerank_factor is None:
+            rerank_factor = self.default_search_params.get('rerank_factor')
+        full_vectors = self._full_vector_matrix() if rerank_factor else None
+        if full_vectors is None or rerank_factor <= 1:
+            return self._search_index(queries, k, nprobe, efSearch, bitmap)
+        
+        # Capped by the index size (and the GPU top-k limit), however large the factor
+        fetch = min(k * int(rerank_factor), self._fetch_limit())
+        _, candidates = self._search_index(queries, fetch, nprobe, efSearch, bitmap)
+        distances = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            # Sorted ids read the memory-mapped matrix front to back
+            ids = np.sort(ids[ids >= 0])
+            scores = full_vectors[ids].astype(np.float32) @ query
+            top = np.argsort(-scores)[:k]
+            distances[row, :len(top)] = scores[top]
+            indices[row, :len(top)] = ids[top]
+        return distances, indices
+    
+    def _fetch_limit(self):
+        """Most hits one index.search may return: the index size, at most GPU_MAX_K on the GPU"""
+        return min(self.index.ntotal, GPU_MAX_K) if self.on_gpu else self.index.ntotal
+    
+    def exact_search(self, queries, k, block_size=65536):
+        """Brute-force top-k over the stored float16 vectors, in row blocks"""
+        full_vectors = self._full_vector_matrix()
+        if full_vectors is None:
+            raise RuntimeError("exact_search needs an index built with store_full_vectors=True")
+        queries = self._as_matrix(queries)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(full_vectors), block_size):
+            block_scores = queries @ full_vectors[start:start + block_size].astype(np.float32).T
+            block_ids = np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)
+            scores = np.concatenate([best_scores, block_scores], axis=1)
+            ids = np.concatenate([best_ids, block_ids], axis=1)
+            keep = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_ids = np.take_along_axis(ids, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+    
+    def recall_report(self, queries, k=150, reference=None, rerank_factors=(None, 2, 4, 8), **search_kwargs):
+        """
+        recall@k of this index against exact search, with and without re-ranking
+        
+        Args:
+            queries: (n, dimension) held-out query embeddings
+            reference: a flat FaissMetadataIndex over the same images; defaults to a
+                brute-force scan of the stored float16 vectors
+        
+        Returns:
+            {rerank_factor: mean recall@k}
+        """
+        queries = self._as_matrix(queries)
+        if reference is not None:
+            _, exact_ids = reference.index.search(queries, k)
+        else:
+            _, exact_ids = self.exact_search(queries, k)
+        
+        report = {}
+        for factor in rerank_factors:
+            _, ids = self._search_ranked(queries, k, rerank_factor=factor or 1, **search_kwargs)
+            hits = [len(np.intersect1d(found[found >= 0], exact[exact >= 0])) for found, exact in zip(ids, exact_ids)]
+            report[factor or 1] = float(np.mean(hits)) / k
+        return report
+    
+    def _search_index(self, queries, k, nprobe=None, efSearch=None, bitmap=None):
+        """Run index.search with per-request nprobe / efSearch, restricted to `bitmap` rows"""
+        nprobe = nprobe if nprobe is not None else self.default_search_params.get('nprobe')
+        efSearch = efSearch if efSearch is not None else self.default_search_params.get('efSearch')
+        if nprobe is None and efSearch is None and bitmap is None:
+            if self.on_gpu:
+                # Never search while another request has a different nprobe set
+                with self._search_lock:
+                    return self.index.search(queries, k)
+            return self.index.search(queries, k)
+        
+        if self.on_gpu:
+            # GPU indexes take no SearchParameters; set the knob for the duration of the
+            # call and restore it, so it never leaks into other requests
+            with self._search_lock:
+                space = faiss.GpuParameterSpace()
+                previous = self._gpu_nprobe() if nprobe is not None else None
+                try:
+                    if nprobe is not None:
+                        space.set_index_parameter(self.index, 'nprobe', int(nprobe))
+                    if bitmap is not None:
+                        return self._search_post_filtered(queries, k, bitmap)
+                    return self.index.search(queries, k)
+                finally:
+                    if previous is not None:
+                        space.set_index_parameter(self.index, 'nprobe', previous)
+        
+        params, keep_alive = self._search_parameters(nprobe, efSearch, bitmap)
+        if params is None:
+            return self.index.search(queries, k)
+        return self.index.search(queries, k, params=params)
+    
+    def _gpu_nprobe(self):
+        """Current nprobe of the GPU index, or None when it has none"""
+        index = faiss.downcast_index(self.index)
+        if hasattr(index, 'nprobe'):
+            return int(index.nprobe)
+        if hasattr(index, 'getNumProbes'):
+            return int(index.getNumProbes())
+        return None
+    
+    def _search_post_filtered(self, queries, k, bitmap):
+        """
+        Filtered search for GPU indexes, which take no ID selector: over-fetch in proportion
+        to the fraction of rows the filter keeps (capped by the GPU top-k limit), then filter
+        """
+        selected = int(np.unpackbits(bitmap, bitorder='little').sum())
+        if selected == 0:
+            return (np.full((len(queries), k), -np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+        fetch = min(self.index.ntotal, GPU_MAX_K, max(k, -(-k * self.index.ntotal // selected) * 2))
+        distances, indices = self.index.search(queries, fetch)
+        
+        safe = np.where(indices >= 0, indices, 0)
+        keep = (indices >= 0) & ((bitmap[safe >> 3] >> (safe & 7)) & 1).astype(bool)
+        # Stable sort moves kept hits to the front in their original (ranked) order
+        order = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+        distances = np.where(np.take_along_axis(keep, order, axis=1), np.take_along_axis(distances, order, axis=1), -np.inf)
+        indices = np.where(np.take_along_axis(keep, order, axis=1), np.take_along_axis(indices, order, axis=1), -1)
+        return distances.astype(np.float32), indices
+    
+    def _search_parameters(self, nprobe, efSearch, bitmap=None):
+        """
+        SearchParameters for the CPU index, or (None, None) when the knobs do not apply.
+        The second value keeps nested SWIG parameter objects alive during the search.
+        """
+        index = faiss.downcast_index(self.index)
+        pre_transform = isinstance(index, faiss.IndexPreTransform)
+        inner = faiss.downcast_index(index.index) if pre_transform else index
+        
+        if isinstance(inner, faiss.IndexHNSW) and (efSearch is not None or bitmap is not None):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = int(efSearch if efSearch is not None else inner.hnsw.efSearch)
+        elif isinstance(inner, faiss.IndexIVF) and (nprobe is not None or bitmap is not None):
+            params = faiss.SearchParametersIVF()
+            params.nprobe = int(nprobe if nprobe is not None else inner.nprobe)
+        elif bitmap is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None, None
+        
+        keep_alive = [params]
+        if bitmap is not None:
+            # Filtering happens inside the scan: rows outside the bitmap are never scored
+            selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            params.sel = selector
+            keep_alive += [selector, bitmap]
+        
+        if not pre_transform:
+            return params, keep_alive
+        outer = faiss.SearchParametersPreTransform()
+        outer.index_params = params
+        return outer, keep_alive
+    
+    def set_tour_attributes(self, tours):
+        """
+        Precompute one row bitmap per tour difficulty and per tag, for `filters`
+        
+        Args:
+            tours: iterable of tour dicts (tour_id, difficulty, tags) from the tour data
+        """
+        difficulty_tours, tag_tours = {}, {}
+        for tour in tours:
+            tour_id = tour.get('tour_id')
+            if tour_id is None:
+                continue
+            # Values are matched as normalized strings, as compile_filters does
+            difficulty = tour.get('difficulty')
+            difficulty = 'unrated' if difficulty is None or difficulty == '' else str(difficulty).strip().lower()
+            difficulty_tours.setdefault(difficulty, []).append(tour_id)
+            tags = tour.get('tags') or []
+            for tag in [tags] if isinstance(tags, str) else tags:
+                if tag is not None:
+                    tag_tours.setdefault(str(tag).strip().lower(), []).append(tour_id)
+        
+        tour_ids = self.tour_id_array()
+        self.attribute_bitmaps = {
+            name: {value: self._pack_rows(np.isin(tour_ids, ids)) for value, ids in values.items()}
+            for name, values in (('difficulty', difficulty_tours), ('tags', tag_tours))
+        }
+        print(f"Built filter bitmaps for {len(difficulty_tours)} difficulties and {len(tag_tours)} tags")
+    
+    @staticmethod
+    def _pack_rows(mask):
+        """Boolean row mask -> bitmap in the bit order of faiss.IDSelectorBitmap"""
+        return np.packbits(mask, bitorder='little')
+    
+    def _date_array(self):
+        """Image dates as int64 days since the epoch (int64 min where missing)"""
+        if isinstance(self.metadata, ColumnarMetadataStore):
+            dates = self.metadata.dates
+            if self.metadata.date_unit == 'D':
+                return dates
+            missing = dates == np.iinfo(np.int64).min
+            return np.where(missing, dates, dates.astype(f'datetime64[{self.metadata.date_unit}]')
+                            .astype('datetime64[D]').astype(np.int64))
+        cached = getattr(self, '_dates', None)
+        if cached is None or len(cached) != len(self.metadata):
+            cached = np.array([np.datetime64(str(m['date_created'])[:10], 'D').astype(np.int64)
+                               if m.get('date_created') else np.iinfo(np.int64).min
+                               for m in self.metadata], dtype=np.int64)
+            self._dates = cached
+        return cached
+    
+    def compile_filters(self, filters):
+        """
+        Compile attribute filters into a row bitmap for faiss.IDSelectorBitmap
+        
+        Args:
+            filters: dict with any of
+                tour_ids: only images of these tours
+                date_from / date_to: inclusive 'YYYY-MM-DD' bounds on date_created
+                difficulty: a difficulty or list of difficulties (needs `set_tour_attributes`)
+                tags: images of tours with any of these tags (needs `set_tour_attributes`)
+            All given conditions must hold.
+        
+        Returns:
+            Packed uint8 bitmap over the index rows, or None when there is nothing to filter
+        """
+        if not filters:
+            return None
+        unknown = set(filters) - {'tour_ids', 'date_from', 'date_to', 'difficulty', 'tags'}
+        if unknown:
+            raise ValueError(f"Unknown search filters: {sorted(unknown)}")
+        
+        bitmaps = []
+        if filters.get('tour_ids') is not None:
+            bitmaps.append(self._pack_rows(np.isin(self.tour_id_array(), np.asarray(filters['tour_ids'], dtype=np.int64))))
+        
+        if filters.get('date_from') or filters.get('date_to'):
+            dates = self._date_array()
+            mask = dates != np.iinfo(np.int64).min
+            if filters.get('date_from'):
+                mask &= dates >= np.datetime64(filters['date_from'], 'D').astype(np.int64)
+            if filters.get('date_to'):
+                mask &= dates <= np.datetime64(filters['date_to'], 'D').astype(np.int64)
+            bitmaps.append(self._pack_rows(mask))
+        
+        for name in ('difficulty', 'tags'):
+            values = filters.get(name)
+            if not values:
+                continue
+            if not self.attribute_bitmaps:
+                raise ValueError(f"Filtering by {name} needs tour attributes; call set_tour_attributes first")
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            # Any of the values matches; values no tour has match nothing
+            combined = np.zeros((len(self.metadata) + 7) // 8, dtype=np.uint8)
+            for value in values:
+                value_bitmap = self.attribute_bitmaps[name].get(str(value).strip().lower())
+                if value_bitmap is not None:
+                    combined |= value_bitmap
+            bitmaps.append(combined)
+        
+        if not bitmaps:
+            return None
+        bitmap = bitmaps[0].copy()
+        for other in bitmaps[1:]:
+            bitmap &= other
+        return bitmap
     
     def save(self, save_dir):
-        """Save both the FAISS index and metadata"""
+        """
+        Save both the FAISS index and metadata. Every file is written under a temporary
+        name and renamed into place, so saving into the directory the index was
+        memory-mapped from never truncates a mapped file.
+        """
         save_dir = Path(save_dir)
         save_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save FAISS index
-        if faiss.get_num_gpus() > 0:
+        # Save FAISS index (including its trained state)
+        if self.on_gpu:
             index_cpu = faiss.index_gpu_to_cpu(self.index)
         else:
             index_cpu = self.index
-        faiss.write_index(index_cpu, str(save_dir / 'faiss.index'))
+        write_atomic(save_dir / 'faiss.index', lambda temp_path: faiss.write_index(index_cpu, str(temp_path)))
+        
+        # Save float16 vectors for re-ranking
+        full_vectors = self._full_vector_matrix()
+        if full_vectors is not None:
+            save_array(save_dir / 'vectors_fp16.npy', np.asarray(full_vectors, dtype=np.float16))
         
-        # Save metadata using pickle for complex data structures
-        with open(save_dir / 'metadata.pkl', 'wb') as f:
-            pickle.dump(self.metadata, f)
+        # Record the index layout so load can validate it
+        info = {
+            'dimension': self.dimension,
+            'index_type': self.index_type,
+            'default_search_params': self.default_search_params,
+            'full_vectors': full_vectors is not None,
+            'ntotal': int(index_cpu.ntotal)
+        }
+        write_atomic(save_dir / 'index_info.json', lambda temp_path: temp_path.write_text(json.dumps(info)))
+        
+        # Save metadata as memory-mappable columns
+        store = self.metadata
+        if not isinstance(store, ColumnarMetadataStore):
+            store = ColumnarMetadataStore.from_records(store)
+        store.save(save_dir)
             
         print(f"Saved index and metadata for {len(self.metadata)} items to {save_dir}")
     
     @classmethod
-    def load(cls, save_dir):
-        """Load saved index and metadata"""
+    def load(cls, save_dir, dimension=None, mmap=False):
+        """
+        Load saved index and metadata
+        
+        Args:
+            save_dir: directory written by `save`
+            dimension: expected embedding dimension; a mismatch raises ValueError
+            mmap: memory-map the index file read-only instead of reading it into the
+                heap, so every process on the host shares one copy in the page cache.
+                A memory-mapped index stays on the CPU and cannot be added to.
+        """
         save_dir = Path(save_dir)
-        instance = cls()
+        index_path = str(save_dir / 'faiss.index')
         
         # Load FAISS index
-        print("---"*10,str(save_dir / 'faiss.index'))
-        instance.index = faiss.read_index(str(save_dir / 'faiss.index'))
-        if faiss.get_num_gpus() > 0:
-            instance.index = faiss.index_cpu_to_gpu(
-                faiss.StandardGpuResources(), 0, instance.index)
-        
-        # Load metadata
-        with open(save_dir / 'metadata.pkl', 'rb') as f:
-            instance.metadata = pickle.load(f)
+        print("---"*10, index_path)
+        if mmap:
+            # IO_FLAG_MMAP_IFC maps flat code arrays (faiss >= 1.8); older releases
+            # only map inverted lists and read flat codes into memory
+            io_flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            index = faiss.read_index(index_path, io_flags)
+        else:
+            index = faiss.read_index(index_path)
+        
+        # Validate the dimension against the saved info and the caller's expectation.
+        # Indexes saved before index_info.json existed are flat inner-product indexes.
+        info = {'dimension': index.d, 'index_type': 'Flat'}
+        info_path = save_dir / 'index_info.json'
+        if info_path.exists():
+            with open(info_path, 'r') as f:
+                info.update(json.load(f))
+            if info['dimension'] != index.d:
+                raise ValueError(f"Index at {save_dir} has dimension {index.d} but index_info.json records {info['dimension']}")
+        if dimension is not None and dimension != index.d:
+            raise ValueError(f"Index at {save_dir} has dimension {index.d}, expected {dimension}")
+        
+        instance = cls(dimension=index.d, index_type=info['index_type'], index=index, use_gpu=not mmap)
+        instance.default_search_params = info.get('default_search_params', {})
+        
+        # Memory-map the float16 re-ranking vectors, if the index was saved with them
+        vectors_path = save_dir / 'vectors_fp16.npy'
+        if vectors_path.exists():
+            full_vectors = np.load(vectors_path, mmap_mode='r')
+            if len(full_vectors) == index.ntotal:
+                instance.store_full_vectors = True
+                instance.full_vectors = full_vectors
+            else:
+                # A stale file would re-rank against the wrong rows
+                print(f"Ignoring {vectors_path}: {len(full_vectors)} rows for an index of {index.ntotal}; "
+                      f"re-ranking disabled")
+        
+        # Load metadata: memory-mapped columns, or the pickled list of older indexes
+        if ColumnarMetadataStore.exists(save_dir):
+            instance.metadata = ColumnarMetadataStore.load(save_dir)
+        else:
+            with open(save_dir / 'metadata.pkl', 'rb') as f:
+                instance.metadata = pickle.load(f)
             
         print(f"Loaded index and metadata for {len(instance.metadata)} items from {save_dir}")
-        return instance
\ No newline at end of file
+        return instance
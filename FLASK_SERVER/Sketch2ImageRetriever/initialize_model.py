@@ -5,20 +5,36 @@ from PIL import Image
 import io
 from pathlib import Path
 import sys
+import os
 import json
 from .code.clip.model import convert_weights, CLIP
-from .code.clip.clip import _transform
 from .faiss_class import FaissMetadataIndex
+from .session import session_for
+from .quantization import quantize_dynamic_int8
+from .serving_checkpoint import build_serving_model
+from ModelServing import get_registry, default_device
 
 # Global variables for model and index
 model = None
 faiss_index = None
 transformer = None
+encoder_session = None
 # Path setup
 
 FAISS_INDEX_PATH = Path('./Sketch2ImageRetriever/faiss_index/')
 model_config_file =Path('./Sketch2ImageRetriever/code/training/model_configs/ViT-B-16.json')
 model_file = Path('./Sketch2ImageRetriever/model/tsbir_model_final.pt')
+# Sketch/text-only export of model_file (python -m Sketch2ImageRetriever.serving_checkpoint)
+serving_model_file = Path('./Sketch2ImageRetriever/model/tsbir_serving.pt')
+# Memory-map the FAISS index so processes on one host share it through the page cache
+FAISS_MMAP = os.environ.get('FAISS_MMAP', '0') == '1'
+# Device for the TSBIR model ('cuda', 'cuda:1', 'cpu'); defaults to the GPU when there is one
+SKETCH_DEVICE = os.environ.get('SKETCH_DEVICE')
+# Weight dtype on CPU: 'fp32' or 'bf16' (GPU weights are always fp16)
+SKETCH_CPU_DTYPE = os.environ.get('SKETCH_CPU_DTYPE', 'fp32')
+CPU_DTYPES = {'fp32': torch.float32, 'bf16': torch.bfloat16}
+# SKETCH_QUANTIZE=int8 serves the sketch / text towers int8 dynamic-quantized on CPU
+SKETCH_QUANTIZE = os.environ.get('SKETCH_QUANTIZE')
 
 
 def process_sketch(sketch_base64):
@@ -29,36 +45,89 @@ def process_sketch(sketch_base64):
         sketch = sketch.convert('RGB')
     return sketch
 
-def initialize_model():
-    """Initialize the model and FAISS index"""
-    global model, faiss_index, transformer    
-    
-    # Initialize model
-    gpu = 0
-    torch.cuda.set_device(gpu)
-    
-    with open(model_config_file, 'r') as f:
-        model_info = json.load(f)
+def configure_cpu_threads(intra_op=None, inter_op=None):
+    """
+    Set torch's intra-op / inter-op thread pools for CPU inference. By default the cores
+    are split evenly between the processes that run models (F2R_MODEL_PROCESSES, set by
+    gunicorn.conf.py when every worker loads its own models); SKETCH_CPU_THREADS and
+    SKETCH_INTEROP_THREADS override the split.
+    """
+    processes = max(1, int(os.environ.get('F2R_MODEL_PROCESSES', 1)))
+    intra_op = intra_op or int(os.environ.get('SKETCH_CPU_THREADS', 0)) or max(1, (os.cpu_count() or 1) // processes)
+    inter_op = inter_op or int(os.environ.get('SKETCH_INTEROP_THREADS', 1))
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # Only settable before the first parallel work in the process
+        print(f"Keeping {torch.get_num_interop_threads()} inter-op threads")
+    print(f"CPU inference threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+def _load_tsbir_model(device="cuda:0", cpu_dtype='fp32', quantize=None):
+    """
+    Build the TSBIR CLIP model from the config and checkpoint on `device`.
+    Weights are converted to fp16 on the GPU and kept in fp32 (or bf16) on the CPU;
+    `quantize='int8'` quantizes the CPU serving towers instead (see quantization.py).
+    """
+    device = torch.device(device)
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
     
-    model = CLIP(**model_info)
-    loc = f"cuda:{gpu}"
-    checkpoint = torch.load(model_file, map_location=loc)
-    sd = checkpoint["state_dict"]
+    if serving_model_file.exists():
+        # Only the sketch and text branches are built and loaded
+        tsbir_model = build_serving_model(torch.load(serving_model_file, map_location=device))
+    else:
+        with open(model_config_file, 'r') as f:
+            model_info = json.load(f)
+        
+        tsbir_model = CLIP(**model_info)
+        checkpoint = torch.load(model_file, map_location=device)
+        sd = checkpoint["state_dict"]
+        
+        if next(iter(sd.items()))[0].startswith('module'):
+            sd = {k[len('module.'):]: v for k, v in sd.items()}
+        
+        tsbir_model.load_state_dict(sd, strict=False)
+    tsbir_model.eval()
+    tsbir_model = tsbir_model.to(device)
     
-    if next(iter(sd.items()))[0].startswith('module'):
-        sd = {k[len('module.'):]: v for k, v in sd.items()}
+    if device.type == 'cuda':
+        # Convert weights to fp16
+        convert_weights(tsbir_model)
+    elif quantize == 'int8':
+        tsbir_model = quantize_dynamic_int8(tsbir_model)
+    elif quantize:
+        raise ValueError(f"Unsupported quantization {quantize!r}")
+    elif CPU_DTYPES[cpu_dtype] != torch.float32:
+        # Same layers as the fp16 conversion; LayerNorms stay in fp32
+        convert_weights(tsbir_model, CPU_DTYPES[cpu_dtype])
+    return tsbir_model
+
+def initialize_model(faiss_index_path=None, tour_data=None):
+    """
+    Initialize the model and FAISS index (from `faiss_index_path`, default FAISS_INDEX_PATH).
+    `tour_data` (tour dicts) enables difficulty / tag filters on the index.
+    """
+    global model, faiss_index, transformer, encoder_session
     
-    model.load_state_dict(sd, strict=False)
-    model.eval()
-    model = model.cuda()
+    # Initialize model (shared through the process-wide registry)
+    device = torch.device(SKETCH_DEVICE or default_device())
+    if device.type == 'cuda' and device.index is None:
+        device = torch.device('cuda', 0)
+    if device.type == 'cpu':
+        configure_cpu_threads()
+    model = get_registry().get('tsbir', str(device), lambda: _load_tsbir_model(device, SKETCH_CPU_DTYPE, SKETCH_QUANTIZE))
     
-    # Convert weights and set up transformer
-    convert_weights(model)
-    transformer = _transform(model.visual.input_resolution, is_train=False)
+    # Set up the encoder session (preprocessing, buffers) once; get_feature and the
+    # batcher reuse it
+    encoder_session = session_for(model)
+    transformer = encoder_session.preprocess
     
     # Load FAISS index
-    faiss_index = FaissMetadataIndex.load(FAISS_INDEX_PATH)
+    faiss_index = FaissMetadataIndex.load(faiss_index_path or FAISS_INDEX_PATH,
+                                          dimension=model.text_projection.shape[1], mmap=FAISS_MMAP)
+    if tour_data is not None:
+        faiss_index.set_tour_attributes(tour_data)
     
     print("Model and index initialized successfully")
     return model, faiss_index, transformer
-
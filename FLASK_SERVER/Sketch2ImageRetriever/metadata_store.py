@@ -0,0 +1,260 @@
+"""
+Columnar image metadata for FaissMetadataIndex, replacing the pickled list of dicts.
+
+Each field is stored as flat numpy arrays that are memory-mapped on load:
+
+    meta_tour_id.npy                    int64 tour ids
+    meta_date_created.npy               int64 dates (epoch days or seconds, see meta_info.json)
+    meta_<text>.npy / _offsets.npy      UTF-8 string table and int64 (N + 1) offsets
+    meta_<text>_valid.npy               bool, False where the value was None
+    meta_extra.npy (+ _offsets, _valid) JSON object of any other keys of the row
+
+so loading costs no unpickling and a row is only turned into a dict when a search
+result is formatted.
+
+Convert an existing index directory with:
+    python -m Sketch2ImageRetriever.metadata_store ./Sketch2ImageRetriever/faiss_index/
+"""
+import json
+import os
+import pickle
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+TEXT_FIELDS = ('url', 'caption')
+FIELDS = ('url', 'tour_id', 'caption', 'date_created')
+# String columns: the text fields, plus the other keys of each record as a JSON object
+STRING_COLUMNS = TEXT_FIELDS + ('extra',)
+_MISSING = np.iinfo(np.int64).min
+
+
+def write_atomic(path, write):
+    """
+    Run `write(temp_path)` and rename the result over `path`. Readers that memory-mapped
+    the old file keep its (unlinked) contents instead of seeing it truncated.
+    """
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def save_array(path, array):
+    """np.save through write_atomic"""
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.asarray(array))
+    write_atomic(path, write)
+
+
+def _encode_dates(values):
+    """ISO date strings -> (int64 array, unit); date-only strings keep day precision"""
+    present = [v for v in values if v]
+    unit = 'D' if all(len(str(v)) == 10 for v in present) else 's'
+    dates = np.full(len(values), _MISSING, dtype=np.int64)
+    for i, value in enumerate(values):
+        if value:
+            dates[i] = np.datetime64(str(value), unit).astype(np.int64)
+    return dates, unit
+
+
+def _encode_extra(record):
+    """JSON object of the keys outside FIELDS, or None; values must be JSON-serializable"""
+    extra = {key: value for key, value in record.items() if key not in FIELDS}
+    if not extra:
+        return None
+    try:
+        return json.dumps(extra, separators=(',', ':'))
+    except TypeError as e:
+        raise ValueError(f"Metadata keys {sorted(extra)} cannot be stored: {e}") from e
+
+
+def _encode_strings(values):
+    """list of str/None -> (uint8 blob, int64 offsets, bool valid)"""
+    encoded = [(v or '').encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    valid = np.array([v is not None for v in values], dtype=bool)
+    return blob, offsets, valid
+
+
+class ColumnarMetadataStore:
+    """
+    List-like view over columnar image metadata: `len(store)` and `store[i]` behave like
+    the old list of dicts, while `store.rows(indices, fields)` materializes only the
+    requested fields.
+    """
+    def __init__(self, columns, date_unit='D'):
+        if 'extra' not in columns:
+            # Stores written before extra keys were kept
+            rows = len(columns['tour_id'])
+            columns = dict(columns, extra=np.zeros(0, dtype=np.uint8), extra_offsets=np.zeros(rows + 1, dtype=np.int64),
+                           extra_valid=np.zeros(rows, dtype=bool))
+        self._columns = columns
+        self._date_unit = date_unit
+        # Records added by `extend`, folded into the columns on the next columnar read;
+        # the lock keeps searches on other threads from reading half-folded columns
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self):
+        self._fold_pending()
+        return self._columns
+
+    @property
+    def date_unit(self):
+        self._fold_pending()
+        return self._date_unit
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        tour_ids = [r.get('tour_id') for r in records]
+        missing = sum(tour_id is None for tour_id in tour_ids)
+        if missing:
+            print(f"Warning: {missing} metadata records have no tour_id; stored as -1")
+        columns = {'tour_id': np.array([-1 if tour_id is None else tour_id for tour_id in tour_ids], dtype=np.int64)}
+        columns['date_created'], date_unit = _encode_dates([r.get('date_created') for r in records])
+        values = {field: [r.get(field) for r in records] for field in TEXT_FIELDS}
+        values['extra'] = [_encode_extra(r) for r in records]
+        for field in STRING_COLUMNS:
+            blob, offsets, valid = _encode_strings(values[field])
+            columns[field] = blob
+            columns[f'{field}_offsets'] = offsets
+            columns[f'{field}_valid'] = valid
+        return cls(columns, date_unit)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        directory = Path(directory)
+        with open(directory / 'meta_info.json', 'r') as f:
+            info = json.load(f)
+        mode = 'r' if mmap else None
+        columns = {name: np.load(directory / f'meta_{name}.npy', mmap_mode=mode) for name in info['columns']}
+        return cls(columns, info['date_unit'])
+
+    @staticmethod
+    def exists(directory):
+        return (Path(directory) / 'meta_info.json').exists()
+
+    def save(self, directory):
+        directory = Path(directory)
+        # Atomic renames: the directory may be the one this store is memory-mapped from
+        for name, array in self.columns.items():
+            save_array(directory / f'meta_{name}.npy', array)
+        info = {'columns': list(self.columns), 'date_unit': self.date_unit, 'rows': len(self)}
+        write_atomic(directory / 'meta_info.json', lambda temp_path: temp_path.write_text(json.dumps(info)))
+
+    @property
+    def tour_ids(self):
+        return self.columns['tour_id']
+
+    @property
+    def dates(self):
+        """int64 dates in `date_unit` since the epoch; int64 min where missing"""
+        return self.columns['date_created']
+
+    def __len__(self):
+        with self._lock:
+            return len(self._columns['tour_id']) + len(self._pending)
+
+    def _text(self, field, i):
+        columns = self.columns
+        if not columns[f'{field}_valid'][i]:
+            return None
+        offsets = columns[f'{field}_offsets']
+        return columns[field][offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def _value(self, field, i):
+        if field == 'tour_id':
+            return int(self.columns['tour_id'][i])
+        if field == 'date_created':
+            value = self.columns['date_created'][i]
+            if value == _MISSING:
+                return None
+            return str(np.datetime64(int(value), self.date_unit))
+        if field in TEXT_FIELDS:
+            return self._text(field, i)
+        return self._extra(i).get(field)
+
+    def _extra(self, i):
+        extra = self._text('extra', i)
+        return json.loads(extra) if extra is not None else {}
+
+    def row(self, i, fields=FIELDS):
+        return {field: self._value(field, i) for field in fields}
+
+    def rows(self, indices, fields=FIELDS):
+        return [self.row(int(i), fields) for i in indices]
+
+    def __getitem__(self, i):
+        """The full record, including its extra keys"""
+        i = int(i)
+        return dict(self.row(i), **self._extra(i))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def extend(self, records):
+        """
+        Append records. They are buffered and encoded in one pass on the next columnar
+        read (row access, `columns`, `save`), so a chunked add stays linear.
+        """
+        records = list(records)
+        with self._lock:
+            self._pending.extend(records)
+
+    def _fold_pending(self):
+        """Encode the buffered records and append them to every column"""
+        if not self._pending:
+            return
+        with self._lock:
+            if self._pending:
+                self._fold_pending_locked()
+
+    def _fold_pending_locked(self):
+        added = ColumnarMetadataStore.from_records(self._pending)
+        self._pending = []
+        columns, new_columns = self._columns, added._columns
+
+        # Day-precision dates widen to seconds when either side has times
+        unit = 'D' if self._date_unit == added._date_unit == 'D' else 's'
+        dates = [self._widen_dates(columns['date_created'], self._date_unit, unit),
+                 self._widen_dates(new_columns['date_created'], added._date_unit, unit)]
+
+        merged = {'tour_id': np.concatenate([columns['tour_id'], new_columns['tour_id']]),
+                  'date_created': np.concatenate(dates)}
+        for field in STRING_COLUMNS:
+            offsets = columns[f'{field}_offsets']
+            merged[field] = np.concatenate([columns[field], new_columns[field]])
+            merged[f'{field}_offsets'] = np.concatenate([offsets, new_columns[f'{field}_offsets'][1:] + offsets[-1]])
+            merged[f'{field}_valid'] = np.concatenate([columns[f'{field}_valid'], new_columns[f'{field}_valid']])
+        self._columns, self._date_unit = merged, unit
+
+    @staticmethod
+    def _widen_dates(dates, unit, target):
+        if unit == target:
+            return dates
+        return np.where(dates == _MISSING, dates, dates * 86400)
+
+
+def convert_pickle_metadata(directory):
+    """Write the columnar store for an index directory that only has metadata.pkl"""
+    directory = Path(directory)
+    with open(directory / 'metadata.pkl', 'rb') as f:
+        records = pickle.load(f)
+    ColumnarMetadataStore.from_records(records).save(directory)
+    print(f"Wrote columnar metadata for {len(records)} images to {directory}")
+
+
+if __name__ == '__main__':
+    convert_pickle_metadata(sys.argv[1] if len(sys.argv) > 1 else './Sketch2ImageRetriever/faiss_index/')
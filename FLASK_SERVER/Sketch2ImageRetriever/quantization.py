@@ -0,0 +1,49 @@
+"""
+Int8 dynamic quantization of the TSBIR serving towers for CPU inference.
+
+Only the modules used at serve time are quantized: the sketch tower `visual2` and the
+text transformer. In every ResidualAttentionBlock the MLP (c_fc, c_proj) and the attention
+input / output projections run as int8 dynamic-quantized linears; LayerNorms, the patch
+embedding and the single-token output projections (`visual2.proj`, `text_projection`)
+stay in fp32.
+"""
+import torch
+from torch import nn
+
+from .code.clip.model import ResidualAttentionBlock
+
+
+class _ProjectedAttention(nn.Module):
+    """
+    Stands in for the nn.MultiheadAttention of a ResidualAttentionBlock, holding its input
+    and output projections as plain nn.Linear modules that dynamic quantization can replace
+    (nn.MultiheadAttention keeps the input projection as a bare parameter).
+    ResidualAttentionBlock.attention uses `in_proj` when it is present.
+    """
+    def __init__(self, attn: nn.MultiheadAttention):
+        super().__init__()
+        self.num_heads = attn.num_heads
+        self.in_proj = nn.Linear(attn.embed_dim, 3 * attn.embed_dim)
+        self.in_proj.weight.data.copy_(attn.in_proj_weight.data.float())
+        self.in_proj.bias.data.copy_(attn.in_proj_bias.data.float())
+        self.out_proj = nn.Linear(attn.embed_dim, attn.embed_dim)
+        self.out_proj.weight.data.copy_(attn.out_proj.weight.data.float())
+        self.out_proj.bias.data.copy_(attn.out_proj.bias.data.float())
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """
+    Quantize the serving towers of a fp32 TSBIR CLIP model in place and return it.
+    The photo tower `visual` is left untouched unless it is shared with `visual2`.
+    """
+    if model.dtype != torch.float32:
+        raise ValueError(f"Dynamic quantization needs fp32 weights, model is {model.dtype}")
+
+    towers = [model.visual2.transformer, model.transformer]
+    for tower in towers:
+        for block in tower.modules():
+            if isinstance(block, ResidualAttentionBlock) and isinstance(block.attn, nn.MultiheadAttention):
+                block.attn = _ProjectedAttention(block.attn)
+        torch.ao.quantization.quantize_dynamic(tower, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    model.quantization = 'int8'
+    return model
@@ -0,0 +1,82 @@
+"""
+Serving-only TSBIR checkpoint: the sketch tower (`visual2`), the text transformer and
+the fusion head, without the photo tower `visual` or training state.
+
+Export it once from the training checkpoint with:
+    python -m Sketch2ImageRetriever.serving_checkpoint
+initialize_model then loads it instead of the full checkpoint when it exists.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import torch
+
+from .code.clip.model import CLIP
+
+SERVING_FORMAT = 'tsbir-sketch-text-v1'
+
+
+def _strip_module_prefix(state_dict):
+    if next(iter(state_dict.items()))[0].startswith('module'):
+        return {k[len('module.'):]: v for k, v in state_dict.items()}
+    return state_dict
+
+
+def export_serving_checkpoint(checkpoint_path, config_path, out_path):
+    """Write the serving-only checkpoint and return (full_mb, serving_mb)"""
+    with open(config_path, 'r') as f:
+        model_info = json.load(f)
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    state_dict = _strip_module_prefix(checkpoint['state_dict'])
+
+    # Keep exactly the tensors of the sketch/text model
+    serving_keys = CLIP(**model_info, sketch_text_only=True).state_dict().keys()
+    missing = [k for k in serving_keys if k not in state_dict]
+    if missing:
+        # build_serving_model loads strictly, so such an export could never be served
+        raise ValueError(f"{len(missing)} serving tensors are not in {checkpoint_path}, e.g. {missing[:3]}")
+    serving_state = {k: v for k, v in state_dict.items() if k in serving_keys}
+
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({'format': SERVING_FORMAT, 'config': model_info, 'state_dict': serving_state}, out_path)
+
+    full_mb = Path(checkpoint_path).stat().st_size / 2**20
+    serving_mb = out_path.stat().st_size / 2**20
+    print(f"Wrote {out_path}: {len(serving_state)}/{len(state_dict)} tensors, {serving_mb:.1f} MB (full checkpoint {full_mb:.1f} MB)")
+    return full_mb, serving_mb
+
+
+def is_serving_checkpoint(checkpoint):
+    return isinstance(checkpoint, dict) and checkpoint.get('format') == SERVING_FORMAT
+
+
+def build_serving_model(checkpoint):
+    """
+    CLIP with only the sketch and text branches, loaded from a serving checkpoint.
+    Every tensor must be present: a stale or truncated export raises instead of serving
+    randomly initialized towers.
+    """
+    if not is_serving_checkpoint(checkpoint):
+        found = checkpoint.get('format') if isinstance(checkpoint, dict) else type(checkpoint).__name__
+        raise ValueError(f"Not a {SERVING_FORMAT} serving checkpoint (format {found!r}); "
+                         f"re-export it with python -m Sketch2ImageRetriever.serving_checkpoint")
+    model = CLIP(**checkpoint['config'], sketch_text_only=True)
+    model.load_state_dict(checkpoint['state_dict'], strict=True)
+    return model
+
+
+def main(argv=None):
+    from .initialize_model import model_config_file, model_file, serving_model_file
+
+    parser = argparse.ArgumentParser(description="Export the serving-only TSBIR checkpoint")
+    parser.add_argument('--checkpoint', default=str(model_file))
+    parser.add_argument('--config', default=str(model_config_file))
+    parser.add_argument('--out', default=str(serving_model_file))
+    args = parser.parse_args(argv)
+    export_serving_checkpoint(args.checkpoint, args.config, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import threading
+import weakref
+from typing import List, Optional, Sequence
+
+import torch
+from PIL import Image
+
+from ModelServing.text_cache import get_text_cache
+from .code.clip import tokenize, _transform
+
+
+class EncoderSession:
+    """
+    Per-model inference state for sketch / text queries, built once when the model is loaded.
+
+    Holds the preprocess pipeline, the model's device and dtype, pinned host staging
+    buffers for the host-to-GPU copies and the zero feature used for a missing modality,
+    so the request path only runs preprocessing and the forward passes.
+    """
+    def __init__(self, model, max_batch_size: int = 16, context_length: int = 77, trim_text: bool = True):
+        self.model = model.eval()
+        # Encode text only up to the batch's longest caption instead of all 77 positions
+        self.trim_text = trim_text
+        self.device = model.text_projection.device
+        self.dtype = model.dtype
+        self.embed_dim = model.text_projection.shape[1]
+        self.input_resolution = model.visual2.input_resolution
+        self.preprocess = _transform(self.input_resolution, is_train=False)
+        self.max_batch_size = max_batch_size
+
+        # Text features are cached per checkpoint / precision: the fingerprint of the text
+        # projection tells apart checkpoints sharing the persistent cache tier
+        self.text_cache = get_text_cache()
+        fingerprint = float(model.text_projection.detach().float().abs().sum())
+        self.text_cache_model = (f"tsbir:{str(self.dtype).split('.')[-1]}"
+                                 f":{getattr(model, 'quantization', 'none')}:{fingerprint:.6e}")
+
+        self.zero_feature = torch.zeros((1, self.embed_dim), device=self.device)
+
+        # Pinned staging buffers let the host-to-GPU copies run asynchronously
+        self._staging_lock = threading.Lock()
+        self._pinned = self.device.type == 'cuda'
+        if self._pinned:
+            self._image_buffer = torch.empty((max_batch_size, 3, self.input_resolution, self.input_resolution),
+                                             pin_memory=True)
+            self._token_buffer = torch.empty((max_batch_size, context_length), dtype=torch.long, pin_memory=True)
+            self._copy_done = torch.cuda.Event()
+
+    def _to_device(self, tensor: torch.Tensor, buffer_name: str) -> torch.Tensor:
+        """Copy a host batch to the model device, through the pinned buffer when it fits"""
+        if not self._pinned:
+            return tensor.to(self.device)
+        buffer = getattr(self, buffer_name)
+        if len(tensor) > len(buffer):
+            return tensor.to(self.device, non_blocking=True)
+        with self._staging_lock:
+            # The previous asynchronous copy must finish reading the buffer first
+            self._copy_done.synchronize()
+            staged = buffer[:len(tensor)]
+            staged.copy_(tensor)
+            on_device = staged.to(self.device, non_blocking=True)
+            self._copy_done.record()
+        return on_device
+
+    @torch.no_grad()
+    def encode_sketch_batch(self, sketches: Sequence[Image.Image]) -> torch.Tensor:
+        """(n, embed_dim) normalized float32 sketch features on the model device"""
+        images = self._to_device(torch.stack([self.preprocess(sketch) for sketch in sketches]), '_image_buffer')
+        features = self.model.encode_sketch(images)
+        features = features / features.norm(dim=-1, keepdim=True)
+        return features.float()
+
+    @torch.no_grad()
+    def encode_text_batch(self, texts: Sequence[str]) -> torch.Tensor:
+        """(n, embed_dim) normalized float32 text features on the model device"""
+        texts = [str(text) for text in texts]
+        if self.text_cache.capacity <= 0:
+            return self._encode_texts(texts)
+        # The CLIP tokenizer lowercases and collapses whitespace, so the cache key does too
+        features = self.text_cache.get_many(self.text_cache_model, 'normalized', texts,
+                                            lambda missing: self._encode_texts(missing).cpu().numpy(),
+                                            lowercase=True)
+        return torch.from_numpy(features).to(self.device)
+
+    def _encode_texts(self, texts: List[str]) -> torch.Tensor:
+        tokens = self._to_device(tokenize(texts), '_token_buffer')
+        features = self.model.encode_text(tokens, trim_padding=self.trim_text)
+        features = features / features.norm(dim=-1, keepdim=True)
+        return features.float()
+
+    def fuse(self, sketch_features: Optional[torch.Tensor] = None,
+             text_features: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Fused query features; a missing modality contributes the cached zero feature"""
+        if sketch_features is None and text_features is None:
+            raise ValueError("At least one of sketch_features or text_features is required")
+        if sketch_features is None:
+            sketch_features = self.zero_feature
+        if text_features is None:
+            text_features = self.zero_feature
+        return self.model.feature_fuse(sketch_features, text_features)
+
+    def encode_batch(self, sketches: List[Optional[Image.Image]], texts: List[Optional[str]]) -> torch.Tensor:
+        """
+        Fused (n, embed_dim) features for a batch where each query may lack its sketch or
+        its caption; one forward per modality covers all rows that have it
+        """
+        n = len(sketches)
+        sketch_rows = [i for i, sketch in enumerate(sketches) if sketch is not None]
+        text_rows = [i for i, text in enumerate(texts) if text]
+
+        sketch_features = text_features = None
+        if sketch_rows:
+            sketch_features = self.encode_sketch_batch([sketches[i] for i in sketch_rows])
+            if len(sketch_rows) < n:
+                sketch_features = self.zero_feature.expand(n, -1).index_copy(
+                    0, torch.tensor(sketch_rows, device=self.device), sketch_features)
+        if text_rows:
+            text_features = self.encode_text_batch([texts[i] for i in text_rows])
+            if len(text_rows) < n:
+                text_features = self.zero_feature.expand(n, -1).index_copy(
+                    0, torch.tensor(text_rows, device=self.device), text_features)
+        if sketch_features is None and text_features is None:
+            return self.zero_feature.expand(n, -1).clone()
+        return self.fuse(sketch_features, text_features)
+
+    def get_feature(self, query_sketch: Optional[Image.Image] = None, query_text: Optional[str] = None) -> torch.Tensor:
+        """Same contract as `get_feature(model, ...)`: returns a (1, embed_dim) fused feature"""
+        return self.encode_batch([query_sketch], [query_text])
+
+
+_sessions = weakref.WeakKeyDictionary()
+_sessions_lock = threading.Lock()
+
+
+def session_for(model) -> EncoderSession:
+    """The EncoderSession of `model`, created on first use and shared afterwards"""
+    with _sessions_lock:
+        session = _sessions.get(model)
+        if session is None:
+            session = _sessions[model] = EncoderSession(model)
+        return session
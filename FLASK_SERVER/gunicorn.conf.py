@@ -0,0 +1,105 @@
+"""
+gunicorn settings for fantasy2reality.
+
+Before forking the HTTP workers, the master starts one model server process that owns
+the CLIP/Jina models and the FAISS/Annoy indexes (ModelServing/model_server.py). Workers
+find it through F2R_MODEL_SERVER_SOCKET and stay small, so `workers` can be raised
+without multiplying model memory. Set F2R_MODEL_SERVER=0 to load models in every worker.
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+bind = '127.0.0.1:8000'
+workers = int(os.environ.get('F2R_WORKERS', 3))
+
+MODEL_SERVER_ENABLED = os.environ.get('F2R_MODEL_SERVER', '1') != '0'
+# Default: a fresh 0700 directory under XDG_RUNTIME_DIR (else the temp dir), so no other
+# local user can connect to the socket or squat its path
+MODEL_SERVER_SOCKET = os.environ.get('F2R_MODEL_SERVER_SOCKET')
+MODEL_SERVER_START_TIMEOUT = float(os.environ.get('F2R_MODEL_SERVER_START_TIMEOUT', 1800))
+# Restarts of a model server that died while serving before gunicorn is shut down
+MODEL_SERVER_MAX_RESTARTS = int(os.environ.get('F2R_MODEL_SERVER_MAX_RESTARTS', 5))
+
+
+def _private_socket_path(server):
+    if MODEL_SERVER_SOCKET:
+        directory = os.path.dirname(os.path.abspath(MODEL_SERVER_SOCKET))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return MODEL_SERVER_SOCKET
+    # mkdtemp creates the directory with mode 0700
+    server.model_server_dir = tempfile.mkdtemp(prefix='fantasy2reality-', dir=os.environ.get('XDG_RUNTIME_DIR'))
+    return os.path.join(server.model_server_dir, 'models.sock')
+
+
+def _start_model_server(server):
+    """Spawn the model server and wait until its socket exists; raises if it dies or times out"""
+    socket_path = server.model_server_socket
+    # The socket only appears once every model and index is loaded
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'ModelServing.model_server', '--socket', socket_path],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.model_server_process = process
+
+    deadline = time.time() + MODEL_SERVER_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError(f"Model server exited with code {process.returncode} during startup")
+        if time.time() > deadline:
+            process.terminate()
+            raise RuntimeError("Timed out waiting for the model server")
+        time.sleep(0.5)
+    server.log.info(f"Model server ready on {socket_path}")
+
+
+def _supervise_model_server(server):
+    """Restart the model server when it dies; shut gunicorn down when it keeps dying"""
+    restarts = 0
+    while True:
+        code = server.model_server_process.wait()
+        if server.model_server_stopping:
+            return
+        restarts += 1
+        if restarts > MODEL_SERVER_MAX_RESTARTS:
+            server.log.error(f"Model server exited with code {code} after {MODEL_SERVER_MAX_RESTARTS} restarts; "
+                             f"shutting down")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        server.log.error(f"Model server exited with code {code}; restarting ({restarts}/{MODEL_SERVER_MAX_RESTARTS})")
+        try:
+            _start_model_server(server)
+        except RuntimeError as e:
+            server.log.error(f"Could not restart the model server: {e}; shutting down")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+
+def on_starting(server):
+    if not MODEL_SERVER_ENABLED:
+        # Every worker runs its own models; CPU inference threads are split between them
+        os.environ.setdefault('F2R_MODEL_PROCESSES', str(workers))
+        return
+    server.model_server_stopping = False
+    server.model_server_socket = _private_socket_path(server)
+    _start_model_server(server)
+    # Inherited by the workers forked after this hook
+    os.environ['F2R_MODEL_SERVER_SOCKET'] = server.model_server_socket
+    threading.Thread(target=_supervise_model_server, args=(server,), daemon=True).start()
+
+
+def on_exit(server):
+    server.model_server_stopping = True
+    process = getattr(server, 'model_server_process', None)
+    if process is not None and process.poll() is None:
+        process.terminate()
+        process.wait(timeout=30)
+    directory = getattr(server, 'model_server_dir', None)
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,197 @@
+"""
+k-DPP sampling on factored kernels.
+
+The quiz kernel is a diagonal reweighting L = D K D of a fixed RBF kernel K. With K
+factored once as K ~= F F^T (F = V_r sqrt(lambda_r), rank r), every request's kernel is
+L = B B^T with B = sqrt(w)[:, None] * F, and the k-DPP is sampled in the r x r dual
+space (Kulesza & Taskar, "Determinantal Point Processes for Machine Learning", 3.3 / 5.2):
+
+    eigendecompose C = B^T B                               O(N r^2 + r^3)
+    pick k eigenvectors with elementary symmetric polynomials
+    lift them to V = B W / sqrt(lambda)                    O(N r k)
+    sample the projection DPP on V                         O(N k^2)
+
+An RBF kernel is full rank, so the sample is only exact for K when r keeps every
+eigenvalue (energy=None, max_rank=None). kernel_root otherwise keeps the leading
+eigenvalues holding an `energy` share of the trace, at most `max_rank` of them, and the
+sample follows the truncated kernel F F^T: every det(L_S) is underestimated, by a log
+det error that grows with the discarded share (measured by
+ServerTesting/dpp_scaling_benchmark.py). The rank cap is what makes the per-request cost
+O(N r^2 + r^3) linear in N; the energy rule alone lets r grow with N.
+
+greedy_map_dpp is the deterministic alternative: greedy MAP inference with an
+incremental Cholesky factor (Chen et al., "Fast Greedy MAP Inference for DPPs"), O(N k^2)
+given the kernel columns.
+
+Besides the eigen-factor of the exact kernel, F can be an explicit feature map of the
+RBF kernel (random Fourier features or Nystrom), which never forms the N x N kernel.
+"""
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+
+def kernel_root(kernel: np.ndarray, energy: Optional[float] = 0.99, max_rank: Optional[int] = None,
+                tol: float = 1e-6) -> np.ndarray:
+    """
+    (N, r) float32 factor F with kernel ~= F F^T, from the leading eigenpairs of the PSD
+    `kernel` above tol * largest eigenvalue: the fewest whose eigenvalues sum to `energy`
+    of the trace (all of them for energy=None), and at most `max_rank`. O(N^3), done once.
+    """
+    eig_vals, eig_vecs = np.linalg.eigh(np.asarray(kernel, dtype=np.float64))
+    order = np.argsort(eig_vals)[::-1]
+    keep = order[eig_vals[order] > tol * max(eig_vals.max(), 0)]
+    if energy is not None and len(keep):
+        captured = np.cumsum(eig_vals[keep]) / eig_vals[keep].sum()
+        keep = keep[:int(np.searchsorted(captured, energy)) + 1]
+    if max_rank is not None:
+        keep = keep[:max_rank]
+    return (eig_vecs[:, keep] * np.sqrt(eig_vals[keep])).astype(np.float32)
+
+
+def random_fourier_features(embedding_matrix: np.ndarray, gamma: float, dim: int = 512,
+                            rng: Optional[np.random.Generator] = None, chunk_size: int = 8192) -> np.ndarray:
+    """
+    (N, dim) float32 random Fourier features z with z(x) . z(y) ~= exp(-gamma ||x - y||^2)
+    (Rahimi & Recht): z(x) = sqrt(2 / dim) cos(W x + b), W ~ N(0, 2 gamma), b ~ U[0, 2 pi)
+    """
+    rng = rng or np.random.default_rng(0)
+    n, d = embedding_matrix.shape
+    projection = rng.normal(scale=np.sqrt(2 * gamma), size=(d, dim)).astype(np.float32)
+    offset = rng.uniform(0, 2 * np.pi, size=dim).astype(np.float32)
+    features = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        block = np.asarray(embedding_matrix[start:start + chunk_size], dtype=np.float32) @ projection
+        block += offset
+        features[start:start + chunk_size] = np.cos(block, out=block)
+    features *= np.float32(np.sqrt(2.0 / dim))
+    return features
+
+
+def nystrom_features(embedding_matrix: np.ndarray, gamma: float, landmarks: int = 512,
+                     rng: Optional[np.random.Generator] = None, chunk_size: int = 8192) -> np.ndarray:
+    """
+    (N, r <= landmarks) float32 Nystrom features F = K_nm K_mm^(-1/2) of the RBF kernel on
+    uniformly sampled landmark rows, so that F F^T = K_nm K_mm^+ K_mn
+    """
+    rng = rng or np.random.default_rng(0)
+    n = len(embedding_matrix)
+    chosen = np.sort(rng.choice(n, size=min(landmarks, n), replace=False))
+    centers = np.asarray(embedding_matrix[chosen], dtype=np.float32)
+    center_norms = np.einsum('ij,ij->i', centers, centers)
+
+    def rbf_to_centers(rows):
+        rows = np.asarray(rows, dtype=np.float32)
+        distances = np.einsum('ij,ij->i', rows, rows)[:, np.newaxis] + center_norms - 2 * rows @ centers.T
+        return np.exp(-gamma * np.maximum(distances, 0))
+
+    eig_vals, eig_vecs = np.linalg.eigh(rbf_to_centers(centers).astype(np.float64))
+    keep = eig_vals > 1e-6 * eig_vals.max()
+    inverse_root = (eig_vecs[:, keep] / np.sqrt(eig_vals[keep])).astype(np.float32)
+    features = np.empty((n, int(keep.sum())), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        features[start:start + chunk_size] = rbf_to_centers(embedding_matrix[start:start + chunk_size]) @ inverse_root
+    return features
+
+
+def elementary_symmetric_polynomials(eig_vals: np.ndarray, k: int) -> np.ndarray:
+    """(k + 1, n + 1) table E[l, m] = e_l(eig_vals[:m])"""
+    n = len(eig_vals)
+    table = np.zeros((k + 1, n + 1))
+    table[0] = 1.0
+    for l in range(1, k + 1):
+        table[l, 1:] = np.cumsum(eig_vals * table[l - 1, :-1])
+    return table
+
+
+def sample_k_eigenvectors(eig_vals: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Indices of the k eigenvectors of the elementary DPP mixture component of a k-DPP"""
+    # A k-DPP does not change when L is scaled; scaling keeps the polynomials in range
+    eig_vals = eig_vals / eig_vals.max()
+    table = elementary_symmetric_polynomials(eig_vals, k)
+    selected = []
+    remaining = k
+    for m in range(len(eig_vals), 0, -1):
+        if remaining == 0:
+            break
+        if rng.random() < eig_vals[m - 1] * table[remaining - 1, m - 1] / table[remaining, m]:
+            selected.append(m - 1)
+            remaining -= 1
+    return np.array(selected[::-1], dtype=np.int64)
+
+
+def sample_projection_dpp(eig_vecs: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Sample of the projection DPP with kernel V V^T (V with orthonormal columns), by the
+    chain rule with an incremental Cholesky factor of the selected rows
+    """
+    n, k = eig_vecs.shape
+    residual = np.einsum('ij,ij->i', eig_vecs, eig_vecs)
+    factors = np.zeros((k, n))
+    selected = []
+    for t in range(k):
+        probabilities = np.clip(residual, 0, None)
+        probabilities[selected] = 0
+        i = int(rng.choice(n, p=probabilities / probabilities.sum()))
+        selected.append(i)
+        column = eig_vecs @ eig_vecs[i] - factors[:t].T @ factors[:t, i]
+        factors[t] = column / np.sqrt(residual[i])
+        residual -= factors[t] ** 2
+    return np.array(selected, dtype=np.int64)
+
+
+def sample_k_dpp(kernel: np.ndarray, k: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Exact k-DPP sample of a small dense PSD kernel L (e.g. a candidate submatrix), O(M^3)"""
+    rng = rng or np.random.default_rng()
+    eig_vals, eig_vecs = np.linalg.eigh(np.asarray(kernel, dtype=np.float64))
+    nonzero = eig_vals > 1e-10 * max(eig_vals.max(), 0)
+    eig_vals, eig_vecs = eig_vals[nonzero], eig_vecs[:, nonzero]
+    if len(eig_vals) < k:
+        raise ValueError(f"Kernel has rank {len(eig_vals)}, cannot sample {k} items")
+    return sample_projection_dpp(eig_vecs[:, sample_k_eigenvectors(eig_vals, k, rng)], rng)
+
+
+def sample_k_dpp_dual(factor: np.ndarray, k: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    k-DPP sample of L = B B^T for the (N, r) factor B, computed in the r x r dual space.
+    Exact for B B^T, i.e. only approximate for a kernel B truncates (see kernel_root).
+    Returns k distinct row indices.
+    """
+    rng = rng or np.random.default_rng()
+    # float32 factors stay float32 (N can be large); the r x r dual is solved in float64
+    eig_vals, eig_vecs = np.linalg.eigh((factor.T @ factor).astype(np.float64))
+    nonzero = eig_vals > 1e-7 * max(eig_vals.max(), 0)
+    eig_vals, eig_vecs = eig_vals[nonzero], eig_vecs[:, nonzero]
+    if len(eig_vals) < k:
+        raise ValueError(f"Kernel has rank {len(eig_vals)}, cannot sample {k} items")
+
+    chosen = sample_k_eigenvectors(eig_vals, k, rng)
+    # Dual eigenvectors lifted to orthonormal eigenvectors of L
+    primal_vecs = factor @ (eig_vecs[:, chosen] / np.sqrt(eig_vals[chosen])).astype(factor.dtype)
+    return sample_projection_dpp(primal_vecs.astype(np.float64), rng)
+
+
+def greedy_map_dpp(column: Callable[[int], np.ndarray], diagonal: np.ndarray, k: int,
+                   excluded: Optional[Sequence[int]] = None, eps: float = 1e-10) -> np.ndarray:
+    """
+    Greedy approximation of argmax_{|S| = k} det(L_S): each step adds the item with the
+    largest log det gain, read off the residual diagonal of an incremental Cholesky
+    factor. `column(j)` returns L[:, j]; `excluded` items are never selected. Stops early
+    when no item adds volume.
+    """
+    residual = np.array(diagonal, dtype=np.float64)
+    if excluded is not None and len(excluded):
+        residual[np.asarray(excluded)] = -np.inf
+    factors = np.zeros((k, len(residual)))
+    selected = []
+    for t in range(k):
+        j = int(np.argmax(residual))
+        if residual[j] < eps:
+            break
+        selected.append(j)
+        if t == k - 1:
+            break
+        factors[t] = (np.asarray(column(j), dtype=np.float64) - factors[:t].T @ factors[:t, j]) / np.sqrt(residual[j])
+        residual -= factors[t] ** 2
+        residual[j] = -np.inf
+    return np.array(selected, dtype=np.int64)
@@ -1,10 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
 import numpy as np
-from typing import List, Dict, Any, Optional
-from sklearn.metrics import pairwise_distances
-from dppy.finite_dpps import FiniteDPP
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+from .dpp_samplers import (greedy_map_dpp, kernel_root, nystrom_features, random_fourier_features,
+                           sample_k_dpp, sample_k_dpp_dual)
+
+# RBF bandwidths whose base kernel is precomputed at startup (recommend() defaults to 0.1)
+DEFAULT_KERNEL_GAMMAS = (0.1,)
+# Share of the base kernel's spectrum (trace) its sampling factor keeps; 1 - energy is the
+# truncation. On synthetic tours with a flat spectrum (the hard case) 0.99 keeps 5-tour
+# log dets within 0.2 of the full kernel (mean -0.13); dpp_scaling_benchmark.py measures
+# it on the real corpus. None keeps every eigenvalue: exact, but O(N^3) per request
+DEFAULT_KERNEL_ENERGY = float(os.environ.get('F2R_QUIZ_KERNEL_ENERGY', 0.99))
+# Hard cap on the factor rank r. The energy rule alone lets r grow with N on a flat
+# spectrum, and the dual sampler costs O(N r^2 + r^3) per request; with r <= 512 the
+# request cost stays linear in N. Past the cap the factor keeps less than the energy
+# share, a larger truncation (log det) error that dpp_scaling_benchmark.py reports.
+# F2R_QUIZ_MAX_RANK=0 removes the cap
+DEFAULT_KERNEL_MAX_RANK = int(os.environ.get('F2R_QUIZ_MAX_RANK', 512)) or None
+# 'exact': dense N x N RBF kernel, eigen-factored once. 'rff' / 'nystrom': low-rank
+# feature map of the RBF kernel, O(N * feature_dim) memory, no N x N matrix at all
+KERNEL_MODES = ('exact', 'rff', 'nystrom')
+# Above this many tours the candidate index of the two-stage quiz is HNSW instead of exact
+HNSW_MIN_TOURS = 50000
+
+
+def embedding_fingerprint(embedding_matrix: np.ndarray) -> str:
+    """Digest of the embedding matrix, identifying the kernels precomputed from it"""
+    matrix = np.ascontiguousarray(embedding_matrix, dtype=np.float32)
+    return f"{matrix.shape[0]}x{matrix.shape[1]}-{hashlib.sha1(matrix.tobytes()).hexdigest()[:16]}"
+
+
+def squared_distance_matrix(embedding_matrix: np.ndarray) -> np.ndarray:
+    """(N, N) float32 squared euclidean distances, via ||a||^2 + ||b||^2 - 2ab"""
+    matrix = np.asarray(embedding_matrix, dtype=np.float32)
+    norms = np.einsum('ij,ij->i', matrix, matrix)
+    distances = matrix @ matrix.T
+    distances *= -2
+    distances += norms[:, np.newaxis]
+    distances += norms[np.newaxis, :]
+    np.maximum(distances, 0, out=distances)
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def rbf_kernel_file(gamma: float) -> str:
+    return f"rbf_gamma_{gamma:g}.npy"
+
+
+def rbf_root_file(gamma: float) -> str:
+    return f"rbf_gamma_{gamma:g}_root.npy"
+
+
+def precompute_kernels(embedding_matrix: np.ndarray, directory: Optional[Path] = None,
+                       gammas: Sequence[float] = DEFAULT_KERNEL_GAMMAS,
+                       energy: Optional[float] = DEFAULT_KERNEL_ENERGY,
+                       max_rank: Optional[int] = DEFAULT_KERNEL_MAX_RANK
+                       ) -> Tuple[np.ndarray, Dict[float, np.ndarray], Dict[float, np.ndarray]]:
+    """
+    Squared-distance matrix, base RBF kernel exp(-gamma * d^2) per gamma and its factor
+    keeping `energy` of the spectrum, at most max_rank (kernel ~= F F^T, see
+    dpp_samplers.kernel_root), as float32.
+
+    With `directory`, kernels saved there for the same embeddings are memory-mapped
+    instead of recomputed; otherwise they are computed and saved there (when writable)
+    for the next boot and the other workers.
+    """
+    fingerprint = embedding_fingerprint(embedding_matrix)
+    if directory is not None:
+        directory = Path(directory)
+        manifest_path = directory / 'kernels.json'
+        if manifest_path.exists():
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('fingerprint') == fingerprint and manifest.get('energy') == energy and \
+                    manifest.get('max_rank') == max_rank and all(
+                    (directory / name(gamma)).exists() for gamma in gammas for name in (rbf_kernel_file, rbf_root_file)):
+                return (np.load(directory / 'sq_distances.npy', mmap_mode='r'),
+                        {gamma: np.load(directory / rbf_kernel_file(gamma), mmap_mode='r') for gamma in gammas},
+                        {gamma: np.load(directory / rbf_root_file(gamma), mmap_mode='r') for gamma in gammas})
+
+    squared_distances = squared_distance_matrix(embedding_matrix)
+    base_kernels = {gamma: np.exp(-np.float32(gamma) * squared_distances) for gamma in gammas}
+    kernel_roots = {gamma: kernel_root(kernel, energy, max_rank) for gamma, kernel in base_kernels.items()}
+    if directory is not None:
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            # Workers that start concurrently may all get here. Every file is written under
+            # a private name and renamed into place, the manifest last, so a reader never
+            # memory-maps a file another worker is still writing.
+            manifest_path.unlink(missing_ok=True)
+            _save_atomic(directory / 'sq_distances.npy', squared_distances)
+            for gamma in gammas:
+                _save_atomic(directory / rbf_kernel_file(gamma), base_kernels[gamma])
+                _save_atomic(directory / rbf_root_file(gamma), kernel_roots[gamma])
+            manifest = {'fingerprint': fingerprint, 'gammas': list(gammas), 'energy': energy, 'max_rank': max_rank}
+            _save_atomic(manifest_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+        except OSError as e:
+            print(f"Could not save DPP kernels to {directory}: {e}")
+    return squared_distances, base_kernels, kernel_roots
+
+
+def _save_atomic(path: Path, content) -> None:
+    """Write an array (as .npy) or `content(file)` to a temporary file, then rename it to `path`"""
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            if callable(content):
+                content(f)
+            else:
+                np.save(f, content)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
 
 class DPPRecommender:
-    def __init__(self, embeddings: Dict[int, np.ndarray], tour_metadata: Dict[int, Dict]):
+    def __init__(self, embeddings: Dict[int, np.ndarray], tour_metadata: Dict[int, Dict],
+                 embedding_matrix: Optional[np.ndarray] = None,
+                 kernel_gammas: Sequence[float] = DEFAULT_KERNEL_GAMMAS,
+                 kernel_dir: Optional[Path] = None,
+                 kernel_energy: Optional[float] = DEFAULT_KERNEL_ENERGY,
+                 max_rank: Optional[int] = DEFAULT_KERNEL_MAX_RANK,
+                 kernel_mode: str = 'exact',
+                 feature_dim: int = 512,
+                 map_cache_size: int = 1024):
         """
         
         Initialize DPP recommender with tour embeddings and metadata.
@@ -15,11 +142,64 @@ class DPPRecommender:
             Dictionary mapping tour IDs to their embeddings
         tour_metadata : Dict[int, Dict]
             Dictionary mapping tour IDs to their metadata
+        embedding_matrix : np.ndarray, optional
+            Already stacked embeddings, one row per key of `embeddings` in the same order
+        kernel_gammas : Sequence[float]
+            Bandwidths whose base RBF kernel is precomputed; other gammas are derived
+            from the precomputed squared distances per request
+        kernel_dir : Path, optional
+            Directory the precomputed kernels are memory-mapped from / saved to
+            (default F2R_QUIZ_KERNEL_DIR, else kept in memory only)
+        kernel_energy : float, optional
+            Share of each base kernel's spectrum its sampling factor keeps (default
+            F2R_QUIZ_KERNEL_ENERGY, else 0.99). Sampling is only exact with None, which
+            keeps every eigenvalue above the tolerance
+        max_rank : int, optional
+            Hard cap on the factor rank (default F2R_QUIZ_MAX_RANK, else 512), bounding the
+            per-request cost independently of N at the price of a larger truncation
+            error; None leaves the rank to kernel_energy alone
+        kernel_mode : str
+            'exact', or 'rff' / 'nystrom' for L = B B^T with B random Fourier or Nystrom
+            features of the RBF kernel, for corpora too large for an N x N kernel
+        feature_dim : int
+            Number of random features / Nystrom landmarks of the low-rank modes
+        map_cache_size : int
+            Number of deterministic (greedy MAP) quiz results kept for repeated inputs
         """
         self.embeddings = embeddings
         self.tour_metadata = tour_metadata
-        self.embedding_matrix = np.stack(list(embeddings.values()))  #each row represents an embedding vector   
+        if embedding_matrix is None:
+            embedding_matrix = np.stack(list(embeddings.values()))
+        self.embedding_matrix = embedding_matrix  #each row represents an embedding vector   
         self.tour_ids = list(embeddings.keys())
+        self.row_of = {tour_id: i for i, tour_id in enumerate(self.tour_ids)}
+
+        # (sorted liked, sorted disliked, k, gamma, betas) -> greedy MAP row indices
+        self.map_cache_size = map_cache_size
+        self._map_cache = OrderedDict()
+        self._map_cache_lock = threading.Lock()
+        # Vector index over the embeddings for two-stage quizzes, built on first use
+        self._vector_index = None
+        self._vector_index_lock = threading.Lock()
+
+        if kernel_mode not in KERNEL_MODES:
+            raise ValueError(f"Unknown kernel_mode {kernel_mode!r}, expected one of {KERNEL_MODES}")
+        self.kernel_mode = kernel_mode
+        self.feature_dim = feature_dim
+        self.kernel_energy = kernel_energy
+        self.max_rank = max_rank
+        self._norms = np.einsum('ij,ij->i', np.asarray(embedding_matrix, dtype=np.float32),
+                                np.asarray(embedding_matrix, dtype=np.float32))
+
+        # Distances, base kernels and their factors depend only on the embeddings:
+        # computed once here
+        if kernel_mode == 'exact':
+            kernel_dir = kernel_dir or os.environ.get('F2R_QUIZ_KERNEL_DIR') or None
+            self.squared_distances, self.base_kernels, self.kernel_roots = precompute_kernels(
+                self.embedding_matrix, kernel_dir, kernel_gammas, kernel_energy, max_rank)
+        else:
+            self.squared_distances, self.base_kernels = None, {}
+            self.kernel_roots = {gamma: self._feature_map(gamma) for gamma in kernel_gammas}
         """
             _summary_
             DPP algorithms typically operate on a matrix representation of the items (in this case, tours). 
@@ -29,54 +209,78 @@ class DPPRecommender:
             np.stack efficiently transforms the collection of individual embedding vectors (from the embeddings dictionary) 
             into this required matrix format (self.embedding_matrix).
         """
+
+    @classmethod
+    def from_arrays(cls, tour_ids: np.ndarray, embedding_matrix: np.ndarray, tour_metadata: Dict[int, Dict],
+                    **kwargs):
+        """
+        Build the recommender from an already stacked (possibly memory-mapped) embedding
+        matrix, e.g. from a serving snapshot, without copying it.
+        """
+        embeddings = dict(zip((int(tour_id) for tour_id in tour_ids), embedding_matrix))
+        return cls(embeddings, tour_metadata, embedding_matrix=embedding_matrix, **kwargs)
+
+    def squared_distances_to(self, ids: List[int], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """(len(ids), N) squared distances of every tour (or only `rows`) to the given tours"""
+        anchor_rows = [self.row_of[tour_id] for tour_id in ids]
+        if self.squared_distances is not None:
+            distances = self.squared_distances[anchor_rows]
+            return np.asarray(distances if rows is None else distances[:, rows], dtype=np.float64)
+        anchors = np.asarray(self.embedding_matrix[anchor_rows], dtype=np.float32)
+        targets = np.asarray(self.embedding_matrix if rows is None else self.embedding_matrix[rows], dtype=np.float32)
+        norms = self._norms if rows is None else self._norms[rows]
+        distances = self._norms[anchor_rows][:, np.newaxis] + norms[np.newaxis, :] - 2 * anchors @ targets.T
+        return np.maximum(distances, 0).astype(np.float64)
+
+    def base_kernel(self, gamma: float) -> np.ndarray:
+        """
+        Base RBF kernel exp(-gamma * d^2): precomputed, or derived from the squared distances
+        (the low-rank modes build it from scratch, as a dense reference only)
+        """
+        kernel = self.base_kernels.get(gamma)
+        if kernel is None:
+            squared_distances = self.squared_distances
+            if squared_distances is None:
+                squared_distances = squared_distance_matrix(self.embedding_matrix)
+            kernel = np.exp(-np.float32(gamma) * squared_distances)
+        return kernel
+
+    def _feature_map(self, gamma: float) -> np.ndarray:
+        if self.kernel_mode == 'rff':
+            return random_fourier_features(self.embedding_matrix, gamma, self.feature_dim)
+        return nystrom_features(self.embedding_matrix, gamma, self.feature_dim)
+
+    def kernel_factor(self, gamma: float) -> np.ndarray:
+        """(N, r) factor F of the base kernel, K ~= F F^T; built once per gamma"""
+        root = self.kernel_roots.get(gamma)
+        if root is None:
+            if self.kernel_mode == 'exact':
+                root = kernel_root(self.base_kernel(gamma), self.kernel_energy, self.max_rank)
+            else:
+                root = self._feature_map(gamma)
+            self.kernel_roots[gamma] = root
+        return root
     
-    def compute_similarity_matrix(
-        self, 
-        positive_ids: Optional[List[int]] = None, 
+    def quality_weights(
+        self,
+        positive_ids: Optional[List[int]] = None,
         negative_ids: Optional[List[int]] = None,
-        gamma: float = 0.1, 
-        attract_beta: float = 0.5, 
-        repel_beta: float = 0.3
+        attract_beta: float = 0.5,
+        repel_beta: float = 0.3,
+        rows: Optional[np.ndarray] = None
     ) -> np.ndarray:
         """
-        Compute similarity matrix with dual influence from positive and negative examples.
-        Handles empty ID lists gracefully.
-        
-        Parameters:
-        -----------
-        positive_ids : List[str], optional
-            IDs of items to be attracted to
-        negative_ids : List[str], optional
-            IDs of items to be repelled from
-        gamma : float
-            Base kernel bandwidth parameter
-            
-            ->>>#### A smaller gamma means that the similarity between two items decreases 
-                #### more slowly as their distance in the embedding space increases. A larger
-                ####  gamma means the similarity decreases more quickly with distance. 
-                #### In simpler terms, it determines how far the influence of a single data point extends.
-            
-            
-        attract_beta : float
-            Strength of attraction
-            #TODO: write what happens if i increase this
-            
-        repel_beta : float
-            Strength of repulsion
-            #TODO: write what happens if i increase this
-            
-
-        Returns:
-        --------
-        np.ndarray
-            Modified similarity matrix
+        Per-tour weights in [0, 1] from the attraction to positive and the repulsion from
+        negative examples; the quiz kernel is the base kernel scaled by sqrt(w_i * w_j).
+        With `rows`, only those tours are weighted (normalized among themselves).
         """
         positive_ids = positive_ids or []
         negative_ids = negative_ids or []
         
         # Initialize weights
-        attraction_weights = np.ones(len(self.embedding_matrix))
-        repulsion_weights = np.ones(len(self.embedding_matrix))
+        size = len(self.embedding_matrix) if rows is None else len(rows)
+        attraction_weights = np.ones(size)
+        repulsion_weights = np.ones(size)
         
 
         """
@@ -97,11 +301,10 @@ class DPPRecommender:
         """
 
         if positive_ids:
-            positive_embeddings = np.stack([self.embeddings[pid] for pid in positive_ids])
-            for pos_emb in positive_embeddings:
-                distances = np.linalg.norm(self.embedding_matrix - pos_emb, axis=1)
-                weights = np.exp(-attract_beta * distances**2)
-                attraction_weights *= (1 + weights)
+            # Squared distances of every tour to each positive example (precomputed rows
+            # in the exact kernel mode)
+            weights = np.exp(-attract_beta * self.squared_distances_to(positive_ids, rows))
+            attraction_weights *= np.prod(1 + weights, axis=0)
         
         """
             similar to attract_beta we have a repel beta which redduces the weight 
@@ -109,11 +312,8 @@ class DPPRecommender:
             and if we decrease the attract_beta then the same point will have 
         """
         if negative_ids:
-            negative_embeddings = np.stack([self.embeddings[pid] for pid in negative_ids])
-            for neg_emb in negative_embeddings:
-                distances = np.linalg.norm(self.embedding_matrix - neg_emb, axis=1)
-                weights = np.exp(-repel_beta * distances**2)
-                repulsion_weights *= (1 - weights)
+            weights = np.exp(-repel_beta * self.squared_distances_to(negative_ids, rows))
+            repulsion_weights *= np.prod(1 - weights, axis=0)
         
         # Combine weights
         total_weights = attraction_weights * repulsion_weights
@@ -133,6 +333,51 @@ class DPPRecommender:
         else:
             normalized_weights = (total_weights - weights_min) / (weights_max - weights_min)
         
+        return normalized_weights
+
+    def compute_similarity_matrix(
+        self, 
+        positive_ids: Optional[List[int]] = None, 
+        negative_ids: Optional[List[int]] = None,
+        gamma: float = 0.1, 
+        attract_beta: float = 0.5, 
+        repel_beta: float = 0.3
+    ) -> np.ndarray:
+        """
+        Compute similarity matrix with dual influence from positive and negative examples.
+        Handles empty ID lists gracefully.
+        
+        Parameters:
+        -----------
+        positive_ids : List[str], optional
+            IDs of items to be attracted to
+        negative_ids : List[str], optional
+            IDs of items to be repelled from
+        gamma : float
+            Base kernel bandwidth parameter
+            
+            ->>>#### A smaller gamma means that the similarity between two items decreases 
+                #### more slowly as their distance in the embedding space increases. A larger
+                ####  gamma means the similarity decreases more quickly with distance. 
+                #### In simpler terms, it determines how far the influence of a single data point extends.
+            
+            
+        attract_beta : float
+            Strength of attraction
+            #TODO: write what happens if i increase this
+            
+        repel_beta : float
+            Strength of repulsion
+            #TODO: write what happens if i increase this
+            
+
+        Returns:
+        --------
+        np.ndarray
+            Modified similarity matrix
+        """
+        normalized_weights = self.quality_weights(positive_ids, negative_ids, attract_beta, repel_beta)
+        
         # Compute base similarity matrix
         """
             What it does: This line transforms the distances into similarities using a Gaussian (RBF) kernel.
@@ -145,15 +390,14 @@ class DPPRecommender:
                     Larger gamma: Similarity decreases more rapidly. Only very close items will have a significant similarity score.
                     Smaller gamma: Similarity decreases more slowly. Items farther apart will still have some non-negligible similarity.
         """
-        pairwise_distances_matrix = pairwise_distances(self.embedding_matrix, metric="euclidean")
-        base_similarity = np.exp(-gamma * pairwise_distances_matrix**2)
-        
-        # Modified kernel incorporating both influences symmetrically
-        weight_products = np.sqrt(normalized_weights[:, np.newaxis] * normalized_weights[np.newaxis, :])
-        similarity_matrix = base_similarity * weight_products
+        base_similarity = self.base_kernel(gamma)
         
-        # Ensure numerical stability and symmetry
-        similarity_matrix = (similarity_matrix + similarity_matrix.T) / 2
+        # Modified kernel incorporating both influences symmetrically:
+        # sqrt(w_i * w_j) * K_ij is the diagonal scaling D K D with D = diag(sqrt(w)),
+        # symmetric by construction
+        scale = np.sqrt(normalized_weights)
+        similarity_matrix = base_similarity * scale[:, np.newaxis]
+        similarity_matrix *= scale[np.newaxis, :]
         
         # Ensure PSD property
         """positive semidefinate is required by many graph algorithms so that is why we clip teh negetive eighen values an donly the positive remain and then
@@ -164,6 +408,133 @@ class DPPRecommender:
         
         return psd_matrix
     
+    @property
+    def vector_index(self):
+        """FAISS L2 index over the embeddings (HNSW for large corpora), built on first use"""
+        if self._vector_index is None:
+            with self._vector_index_lock:
+                if self._vector_index is None:
+                    import faiss
+                    vectors = np.ascontiguousarray(self.embedding_matrix, dtype=np.float32)
+                    if len(vectors) >= HNSW_MIN_TOURS:
+                        index = faiss.IndexHNSWFlat(vectors.shape[1], 32)
+                        index.hnsw.efSearch = 256
+                    else:
+                        index = faiss.IndexFlatL2(vectors.shape[1])
+                    index.add(vectors)
+                    self._vector_index = index
+        return self._vector_index
+
+    def candidate_rows(
+        self,
+        positive_ids: Optional[List[int]] = None,
+        negative_ids: Optional[List[int]] = None,
+        size: int = 300,
+        exploration: float = 0.2,
+        disliked_neighbours: int = 20,
+        rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+        """
+        First stage of the two-stage quiz: about `size` sorted candidate rows. The
+        (1 - exploration) share are the nearest neighbours of the liked-tour centroid,
+        the rest uniformly random tours (all random without liked tours). The liked and
+        disliked tours and the `disliked_neighbours` nearest neighbours of each disliked
+        tour are never candidates.
+        """
+        positive_ids = positive_ids or []
+        negative_ids = negative_ids or []
+        rng = rng or np.random.default_rng()
+        exploration = min(max(exploration, 0.0), 1.0)
+        n = len(self.embedding_matrix)
+        excluded = np.zeros(n, dtype=bool)
+        excluded[[self.row_of[tour_id] for tour_id in positive_ids + negative_ids]] = True
+        if negative_ids and disliked_neighbours > 0:
+            anchors = np.asarray(self.embedding_matrix[[self.row_of[tour_id] for tour_id in negative_ids]],
+                                 dtype=np.float32)
+            _, neighbours = self.vector_index.search(anchors, disliked_neighbours)
+            excluded[neighbours[neighbours >= 0]] = True
+
+        chosen = np.zeros(n, dtype=bool)
+        if positive_ids:
+            centroid = np.asarray(self.embedding_matrix[[self.row_of[tour_id] for tour_id in positive_ids]],
+                                  dtype=np.float32).mean(axis=0, keepdims=True)
+            wanted = int(round(size * (1 - exploration)))
+            # Over-fetch so the excluded rows do not leave the nearest share short
+            _, neighbours = self.vector_index.search(centroid, min(n, wanted + int(excluded.sum())))
+            neighbours = neighbours[0][neighbours[0] >= 0]
+            chosen[neighbours[~excluded[neighbours]][:wanted]] = True
+
+        pool = np.flatnonzero(~excluded & ~chosen)
+        explore = min(len(pool), size - int(chosen.sum()))
+        if explore > 0:
+            chosen[rng.choice(pool, explore, replace=False)] = True
+        return np.flatnonzero(chosen)
+
+    def candidate_kernel(self, rows: np.ndarray, gamma: float) -> np.ndarray:
+        """(M, M) base RBF kernel of the candidate rows: gathered if precomputed, else exact from the embeddings"""
+        base_kernel = self.base_kernels.get(gamma)
+        if base_kernel is not None:
+            return np.asarray(base_kernel[rows][:, rows], dtype=np.float64)
+        return np.exp(-gamma * squared_distance_matrix(self.embedding_matrix[rows]).astype(np.float64))
+
+    def greedy_map(
+        self,
+        positive_ids: Optional[List[int]] = None,
+        negative_ids: Optional[List[int]] = None,
+        k: int = 5,
+        gamma: float = 0.1,
+        attract_beta: float = 0.5,
+        repel_beta: float = 0.3,
+        candidates: Optional[int] = None,
+        exploration: float = 0.2
+    ) -> List[int]:
+        """
+        Row indices of the greedy MAP quiz for the reweighted kernel, excluding the liked
+        and disliked tours, over all tours or over `candidates` two-stage candidates.
+        The result depends only on its arguments, so it is cached.
+        """
+        positive_ids = positive_ids or []
+        negative_ids = negative_ids or []
+        key = (tuple(sorted(positive_ids)), tuple(sorted(negative_ids)), k, gamma, attract_beta, repel_beta,
+               candidates, exploration)
+        with self._map_cache_lock:
+            selected = self._map_cache.get(key)
+            if selected is not None:
+                self._map_cache.move_to_end(key)
+                return selected
+
+        if candidates:
+            # Exploration seeded by the inputs, so identical inputs keep the same candidates
+            rows = self.candidate_rows(positive_ids, negative_ids, candidates, exploration,
+                                       rng=np.random.default_rng(zlib.crc32(repr(key).encode())))
+            scale = np.sqrt(self.quality_weights(positive_ids, negative_ids, attract_beta, repel_beta, rows=rows))
+            kernel = scale[:, np.newaxis] * self.candidate_kernel(rows, gamma) * scale[np.newaxis, :]
+            selected = rows[greedy_map_dpp(lambda j: kernel[j], np.diagonal(kernel), k)].tolist()
+        else:
+            selected = self._greedy_map_all(positive_ids, negative_ids, k, gamma, attract_beta, repel_beta)
+
+        with self._map_cache_lock:
+            self._map_cache[key] = selected
+            if len(self._map_cache) > self.map_cache_size:
+                self._map_cache.popitem(last=False)
+        return selected
+
+    def _greedy_map_all(self, positive_ids, negative_ids, k, gamma, attract_beta, repel_beta):
+        scale = np.sqrt(self.quality_weights(positive_ids, negative_ids, attract_beta, repel_beta))
+        base_kernel = self.base_kernels.get(gamma)
+        if base_kernel is not None:
+            # L[:, j] = s * K[j] * s_j (K is symmetric, rows are contiguous) straight from the
+            # precomputed kernel: O(N) per column
+            column = lambda j: scale * base_kernel[j] * scale[j]
+            diagonal = scale ** 2 * np.diagonal(base_kernel)
+        else:
+            kernel_factor = self.kernel_factor(gamma)
+            factor = scale.astype(kernel_factor.dtype)[:, np.newaxis] * kernel_factor
+            column = lambda j: factor @ factor[j]
+            diagonal = np.einsum('ij,ij->i', factor, factor)
+        excluded = [self.row_of[tour_id] for tour_id in positive_ids + negative_ids]
+        return greedy_map_dpp(column, diagonal, k, excluded=excluded).tolist()
+
     def recommend(self, 
     positive_ids: Optional[List[int]] = None, 
     negative_ids: Optional[List[int]] = None, 
@@ -171,35 +542,66 @@ class DPPRecommender:
     gamma: float = 0.1,
     attract_beta: float = 0.5,
     repel_beta: float = 0.3,
-    include_embeddings: bool = True
+    include_embeddings: bool = True,
+    random_state: Optional[int] = None,
+    deterministic: bool = False,
+    candidates: Optional[int] = None,
+    exploration: float = 0.2
 ) -> Dict:
         """
-        Generate recommendations using DPP sampling.
+        Generate recommendations using DPP sampling, or greedy MAP inference when
+        `deterministic` is set.
         
         Parameters:
         -----------
         [previous parameters...]
         include_embeddings : bool
             Whether to include embeddings in the response
+        random_state : int, optional
+            Seed of the sampler, for reproducible quizzes
+        deterministic : bool
+            Pick the k most diverse high-quality tours (greedy MAP) instead of sampling;
+            never returns the liked / disliked tours, and identical inputs are served
+            from a cache
+        candidates : int, optional
+            Two-stage quiz: run the DPP only on this many candidates pre-selected from
+            the vector index (see candidate_rows) instead of on all tours; raised to
+            k + 1 when smaller, ignored when not positive
+        exploration : float
+            Share of the candidates drawn at random rather than near the liked tours,
+            clipped to [0, 1]
 
         Returns:
         --------
         Dict
             Dictionary containing recommendations and their embeddings
         """
-        # Compute similarity matrix
-        kernel_matrix = self.compute_similarity_matrix(
-            positive_ids, 
-            negative_ids, 
-            gamma=gamma, 
-            attract_beta=attract_beta, 
-            repel_beta=repel_beta
-        )
-        
-        # Sample from DPP
-        dpp = FiniteDPP(kernel_type='likelihood', L=kernel_matrix)
-        dpp.sample_exact_k_dpp(size=k)
-        selected_indices = dpp.list_of_samples[0]
+        # k candidates could not fill the quiz: the min-max normalized quality weights
+        # leave the least relevant candidate with weight 0
+        candidates = max(int(candidates), k + 1) if candidates and candidates > 0 else None
+        if candidates and candidates >= len(self.embedding_matrix):
+            candidates = None
+        exploration = min(max(float(exploration), 0.0), 1.0)
+        if deterministic:
+            selected_indices = self.greedy_map(positive_ids, negative_ids, k, gamma, attract_beta, repel_beta,
+                                               candidates, exploration)
+        elif candidates:
+            # Cost depends on the candidate count M, not on N: an M x M kernel per request
+            rng = np.random.default_rng(random_state)
+            rows = self.candidate_rows(positive_ids, negative_ids, candidates, exploration, rng=rng)
+            scale = np.sqrt(self.quality_weights(positive_ids, negative_ids, attract_beta, repel_beta, rows=rows))
+            kernel = scale[:, np.newaxis] * self.candidate_kernel(rows, gamma) * scale[np.newaxis, :]
+            selected_indices = rows[sample_k_dpp(kernel, k, rng)]
+        else:
+            # The quiz kernel is D K D with D = diag(sqrt(w)); with the base kernel factored
+            # once as K ~= F F^T it is B B^T for B = sqrt(w) * F, sampled in the dual space
+            # without any N x N matrix or decomposition per request. F keeps kernel_energy
+            # of K's spectrum in at most max_rank eigenvalues, so the sample is exact only
+            # for kernel_energy=None and max_rank=None
+            normalized_weights = self.quality_weights(positive_ids, negative_ids, attract_beta, repel_beta)
+            kernel_factor = self.kernel_factor(gamma)
+            factor = np.sqrt(normalized_weights).astype(kernel_factor.dtype)[:, np.newaxis] * kernel_factor
+            selected_indices = sample_k_dpp_dual(factor, k, np.random.default_rng(random_state))
         
         # Get selected tour IDs and metadata
         selected_tours = [self.tour_ids[i] for i in selected_indices]
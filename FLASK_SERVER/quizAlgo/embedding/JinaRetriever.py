@@ -1,17 +1,25 @@
-import torch
+import threading
 import torch
 from typing import List, Tuple, Union
 from PIL import Image
-import torch
 from transformers import AutoProcessor, AutoModel
 
+from ModelServing.text_cache import get_text_cache
+
 
 class JinaRetriever:
-    """Simple retrieval using Jina CLIP model"""
+    """
+    Simple retrieval using Jina CLIP model.
+    One instance is shared by every subsystem (see ModelServing.get_jina_retriever), so
+    preprocessing and the forward pass are guarded by a lock to keep it thread-safe.
+    """
     def __init__(self, model_name: str = "jinaai/jina-clip-v2", device: str = "cuda" if torch.cuda.is_available() else "cpu"):
+        self.model_name = model_name
         self.device = device
         self.processor = AutoProcessor.from_pretrained(model_name,trust_remote_code=True)
         self.model = AutoModel.from_pretrained(model_name, trust_remote_code=True).to(device)
+        self.model.eval()
+        self._lock = threading.Lock()
 
     def get_text_embeddings(self,
                            texts: Union[str, List[str]],
@@ -19,12 +27,23 @@ class JinaRetriever:
                            output_dim: int = None) -> torch.Tensor:
         """
         Extract text embeddings from input texts.
+        Repeated texts are served from the process-wide text feature cache.
         """
-        inputs = self.processor(text=texts, return_tensors="pt", padding=True)
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            text_features = self.model.get_text_features(**inputs)
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        cache = get_text_cache()
+        if cache.capacity <= 0:
+            return self._compute_text_embeddings(texts, normalize, output_dim)
+        features = cache.get_many(self.model_name, f"normalize={normalize}:dim={output_dim}", texts,
+                                  lambda missing: self._compute_text_embeddings(missing, normalize, output_dim).numpy())
+        return torch.from_numpy(features)
+
+    def _compute_text_embeddings(self, texts: List[str], normalize: bool, output_dim: int) -> torch.Tensor:
+        with self._lock:
+            inputs = self.processor(text=texts, return_tensors="pt", padding=True)
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+            with torch.no_grad():
+                text_features = self.model.get_text_features(**inputs)
 
         if normalize:
             text_features = torch.nn.functional.normalize(text_features, dim=-1)
@@ -42,11 +61,12 @@ class JinaRetriever:
         """
         Extract image embeddings from input images.
         """
-        inputs = self.processor(images=images, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with self._lock:
+            inputs = self.processor(images=images, return_tensors="pt")
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
 
-        with torch.no_grad():
-            image_features = self.model.get_image_features(**inputs)
+            with torch.no_grad():
+                image_features = self.model.get_image_features(**inputs)
 
         if normalize:
             image_features = torch.nn.functional.normalize(image_features, dim=-1)
@@ -0,0 +1,67 @@
+"""
+Validation of the JSON request fields of the Flask endpoints; the routes answer 400 when
+a helper returns None (or filters_error returns a message).
+"""
+from datetime import date
+
+
+def parse_int(value, minimum=1, maximum=None):
+    """`value` as an int when it is an integer (or integer string) in [minimum, maximum], else None"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    if value < minimum or (maximum is not None and value > maximum):
+        return None
+    return value
+
+
+def parse_fraction(value):
+    """`value` as a float when it is a number (or numeric string) in [0, 1], else None"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    return value if 0 <= value <= 1 else None
+
+
+def parse_flag(value):
+    """JSON booleans, 0 / 1 and 'true' / 'false' strings as a bool, else None"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false', '1', '0'):
+        return value.strip().lower() in ('true', '1')
+    return None
+
+
+def filters_error(filters):
+    """Why `filters` is not a valid search filter dict (see FaissMetadataIndex.compile_filters), or None"""
+    if not isinstance(filters, dict):
+        return 'filters must be an object'
+    unknown = set(filters) - {'tour_ids', 'date_from', 'date_to', 'difficulty', 'tags'}
+    if unknown:
+        return f'Unknown filters: {sorted(unknown)}'
+    tour_ids = filters.get('tour_ids')
+    if tour_ids is not None and (not isinstance(tour_ids, list)
+                                 or any(parse_int(tour_id, minimum=0) is None for tour_id in tour_ids)):
+        return 'tour_ids must be a list of tour ids'
+    for name in ('date_from', 'date_to'):
+        if filters.get(name) is None:
+            continue
+        try:
+            date.fromisoformat(filters[name])
+        except (TypeError, ValueError):
+            return f'{name} must be a YYYY-MM-DD date'
+    for name in ('difficulty', 'tags'):
+        values = filters.get(name)
+        if values is None or isinstance(values, str):
+            continue
+        if not isinstance(values, list) or not all(isinstance(value, (str, int)) for value in values):
+            return f'{name} must be a string or a list of strings'
+    return None
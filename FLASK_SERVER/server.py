@@ -1,22 +1,45 @@
 from flask import Flask, request, jsonify
+import os
 import torch
 import base64
 from PIL import Image
 import io
 from pathlib import Path
 import sys
-from Sketch2ImageRetriever import get_feature, process_sketch, initialize_model
+import threading
+import time
+from Sketch2ImageRetriever import process_sketch, initialize_model, FeatureBatcher
+from request_validation import parse_int, parse_fraction, parse_flag, filters_error
 from quizAlgo.embedding.embedding_utils import TourEmbeddingHandler_Quiz
 from quizAlgo.dpp_utils import DPPRecommender  
-from quizAlgo.embedding.JinaRetriever import JinaRetriever
+from ModelServing import (get_jina_retriever, get_registry, get_text_cache, ModelServerClient,
+                          RemoteSketchEncoder, RemoteFaissIndex, RemoteJinaRetriever, RemoteAnnoyIndex)
+from ModelServing.snapshot import load_snapshot, load_tour_data
 import json
 from RecommendationSystem import ContentBasedTourRecommender
-import os
 from tqdm import tqdm
 from flask_cors import CORS
 
 #global variables
 EMBEDDING_DIM_one_part=1024
+# Micro-batching of concurrent Sketch2ImageRetriever queries
+SKETCH_BATCH_WINDOW_MS = float(os.environ.get('SKETCH_BATCH_WINDOW_MS', 5))
+SKETCH_MAX_BATCH_SIZE = int(os.environ.get('SKETCH_MAX_BATCH_SIZE', 16))
+# Quiz DPP kernel: 'exact', or 'rff' / 'nystrom' low-rank features for large corpora
+QUIZ_KERNEL_MODE = os.environ.get('F2R_QUIZ_KERNEL', 'exact')
+QUIZ_FEATURE_DIM = int(os.environ.get('F2R_QUIZ_FEATURE_DIM', 512))
+# Two-stage quiz: DPP over this many vector-index candidates (0 = over all tours), of which
+# the exploration share is random rather than near the liked tours
+QUIZ_CANDIDATES = int(os.environ.get('F2R_QUIZ_CANDIDATES', 0))
+QUIZ_EXPLORATION = float(os.environ.get('F2R_QUIZ_EXPLORATION', 0.2))
+# Upper bounds of the per-request index knobs: each bounds the work of one search
+SEARCH_PARAM_LIMITS = {'nprobe': 4096, 'efSearch': 4096, 'rerank_factor': 16}
+# Limits of the grouped (group_by_tour) search
+MAX_GROUPED_TOURS = 500
+MAX_IMAGES_PER_TOUR = 50
+TOUR_AGGREGATES = ('max', 'mean', 'top_m')
+# Image metadata fields returned by /Sketch2ImageRetriever
+RESULT_FIELDS = ['url', 'tour_id', 'caption', 'date_created']
 
 # Define base paths
 BASE_DIR = Path(__file__).resolve().parent
@@ -32,38 +55,66 @@ app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Prevent caching of static files
 embedding_handler = None
 dpp_recommender = None
 recommender=None
+sketch_batcher = None
+model = None
+faiss_index = None
+transformer = None
+query_encoder = None
+
+# When gunicorn started a model server (see gunicorn.conf.py), models and indexes live
+# there and this worker only holds thin clients
+MODEL_SERVER_SOCKET = os.environ.get('F2R_MODEL_SERVER_SOCKET')
+model_server = ModelServerClient(MODEL_SERVER_SOCKET) if MODEL_SERVER_SOCKET else None
+
+# Memory-mappable snapshot of the derived serving state (None falls back to the source files)
+serving_snapshot = load_snapshot()
+
+def shared_retriever():
+    """Jina retriever used by the quiz and recommendation systems"""
+    if model_server is not None:
+        return RemoteJinaRetriever(model_server)
+    return get_jina_retriever()
+
+def initialize_sketch_retriever():
+    """Returns (model, faiss_index, transformer, query_encoder)"""
+    global sketch_batcher
+    if model_server is not None:
+        # Batching happens in the model server, where all workers' queries meet
+        model_server.ping()
+        encoder = RemoteSketchEncoder(model_server)
+        return encoder, RemoteFaissIndex(model_server), None, encoder.get_feature
+    sketch_model, index, sketch_transformer = initialize_model(
+        serving_snapshot.faiss_index_dir if serving_snapshot else None,
+        tour_data=load_tour_data(serving_snapshot))
+    sketch_batcher = FeatureBatcher(sketch_model, max_batch_size=SKETCH_MAX_BATCH_SIZE,
+                                    window_ms=SKETCH_BATCH_WINDOW_MS)
+    return sketch_model, index, sketch_transformer, sketch_batcher.get_feature
+
+def initialize_sketch_system():
+    global model, faiss_index, transformer, query_encoder
+    try:
+        model, faiss_index, transformer, query_encoder = initialize_sketch_retriever()
+        print("Sketch2Image model initialized successfully")
+        return True
+    except Exception as e:
+        print(f"Failed to initialize Sketch2Image model: {str(e)}")
+        return False
 
 def initialize_recommendation_system():
     global recommender    
     try:
-        # Initialize retriever (reuse the one from quiz system)
-        retriever = JinaRetriever()        
+        # Reuse the Jina model already loaded for the quiz system
+        retriever = shared_retriever()
         # Initialize recommender
         recommender = ContentBasedTourRecommender(retriever,embedding_dim=EMBEDDING_DIM_one_part)
         
-        #opening the Tour Data
-        tour_data_path = DATA_DIR / 'final_data_multi.json'
-        if not tour_data_path.exists():
-            raise FileNotFoundError(f"Tour data file not found at {tour_data_path}")
-            
-        with open(tour_data_path, 'r', encoding='utf-8') as f:
-            tour_data = json.load(f)
-        
-        if not tour_data:
-            raise ValueError("Tour data is empty")
-        
-        # Check for recommendation index
-        recommendation_index_path = DATA_DIR / 'recommendation_index.ann'
-        
-        if recommendation_index_path.exists():
-            print("Loading existing recommendation index...")
-            recommender.annoy_index.load(str(recommendation_index_path))
-            
+        if model_server is not None:
+            # The model server already loaded (or built) the recommendation index
+            recommender.annoy_index = RemoteAnnoyIndex(model_server)
         else:
-            print("Building new recommendation index...")
-            recommender.build_index(tour_data)
-            # Save the index and tour_id_map for future use
-            recommender.annoy_index.save(str(recommendation_index_path))
+            index_path = (serving_snapshot.recommendation_index_path if serving_snapshot
+                          else DATA_DIR / 'recommendation_index.ann')
+            recommender.load_or_build_index(str(index_path), str(DATA_DIR / 'final_data_multi.json'))
         
         print("Recommendation system initialized successfully")
         return True
@@ -75,10 +126,20 @@ def initialize_recommendation_system():
 def initialize_quiz_server():
     global embedding_handler, dpp_recommender
     try:
-        # Initialize retriever
-        retriever = JinaRetriever()
+        # Initialize retriever (shared with the recommendation system)
+        retriever = shared_retriever()
         embedding_handler = TourEmbeddingHandler_Quiz(retriever,singlePartDim=EMBEDDING_DIM_one_part)
         
+        if serving_snapshot is not None:
+            # Map the stacked embeddings and tour records instead of parsing the sources
+            tour_ids, embedding_matrix, tour_metadata = serving_snapshot.load_quiz_state()
+            dpp_recommender = DPPRecommender.from_arrays(tour_ids, embedding_matrix, tour_metadata,
+                                                         kernel_dir=serving_snapshot.quiz_kernel_dir,
+                                                         kernel_mode=QUIZ_KERNEL_MODE,
+                                                         feature_dim=QUIZ_FEATURE_DIM)
+            print("Quiz server initialized successfully from snapshot")
+            return True
+        
         # Load tour data with proper path handling
         tour_data_path = DATA_DIR / 'final_data_multi.json'
         if not tour_data_path.exists():
@@ -122,7 +183,8 @@ def initialize_quiz_server():
             raise ValueError("No valid embeddings or tour metadata generated")
         # Initialize DPP recommender
         
-        dpp_recommender = DPPRecommender(embeddings, tour_metadata)
+        dpp_recommender = DPPRecommender(embeddings, tour_metadata, kernel_mode=QUIZ_KERNEL_MODE,
+                                         feature_dim=QUIZ_FEATURE_DIM)
         
         print("Quiz server initialized successfully")
         return True
@@ -134,11 +196,9 @@ def initialize_quiz_server():
 @app.route('/quiz', methods=['POST'])
 def quiz():
     try:
-        if dpp_recommender is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'Quiz server not properly initialized'
-            }), 500
+        unavailable = subsystem_unavailable('quiz')
+        if unavailable:
+            return unavailable
            
         data = request.json
         if not data:
@@ -149,6 +209,18 @@ def quiz():
         positive_ids = data.get('liked_tours', [])
         negative_ids = data.get('disliked_tours', [])
         include_embeddings = data.get('include_embeddings', True)  # New parameter
+        k = 5
+        # Greedy MAP selection: same quiz for the same liked / disliked tours, served from cache
+        deterministic = parse_flag(data.get('deterministic', False))
+        if deterministic is None:
+            return jsonify({'status': 'error', 'message': 'deterministic must be true or false'}), 400
+        # Two-stage quiz: 0 runs the DPP over all tours, otherwise at least k candidates
+        candidates = parse_int(data.get('candidates', QUIZ_CANDIDATES), minimum=0)
+        if candidates is None or 0 < candidates < k:
+            return jsonify({'status': 'error', 'message': f'candidates must be 0 or an integer >= {k}'}), 400
+        exploration = parse_fraction(data.get('exploration', QUIZ_EXPLORATION))
+        if exploration is None:
+            return jsonify({'status': 'error', 'message': 'exploration must be a number between 0 and 1'}), 400
        
         # Validate tour IDs exist in our metadata
         invalid_positive = [id for id in positive_ids if id not in dpp_recommender.tour_metadata]
@@ -164,8 +236,11 @@ def quiz():
         result = dpp_recommender.recommend(
             positive_ids=positive_ids,
             negative_ids=negative_ids,
-            k=5,
-            include_embeddings=include_embeddings
+            k=k,
+            include_embeddings=include_embeddings,
+            deterministic=deterministic,
+            candidates=candidates or None,
+            exploration=exploration
         )
        
         return jsonify({
@@ -183,11 +258,9 @@ def quiz():
 @app.route('/recommendations', methods=['POST'])
 def get_recommendations():
     try:
-        if 'recommender' not in globals() or recommender is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'Recommendation system not properly initialized'
-            }), 500
+        unavailable = subsystem_unavailable('recommendations')
+        if unavailable:
+            return unavailable
 
         data = request.json
         if not data:
@@ -225,11 +298,29 @@ def get_recommendations():
         
 @app.route('/', methods=['GET'])
 def check_connection():
+    with subsystem_lock:
+        subsystems = {name: dict(status) for name, status in subsystem_status.items()}
     return jsonify({
         'status': 'success',
-        'message': 'You are connected to the server'
+        'message': 'You are connected to the server',
+        'ready': all(status['state'] == 'ready' for status in subsystems.values()),
+        'subsystems': subsystems
     })        
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Model memory usage, Sketch2ImageRetriever batching and text feature cache metrics"""
+    response = {
+        'status': 'success',
+        'memory': get_registry().memory_report(),
+        'text_cache': get_text_cache().metrics()
+    }
+    if sketch_batcher is not None:
+        response['sketch_batching'] = sketch_batcher.metrics()
+    if model_server is not None:
+        response['model_server'] = model_server.stats()
+    return jsonify(response)
+
 @app.route('/Sketch2ImageRetriever', methods=['POST'])
 def sketch2image_retriever():
     """
@@ -238,12 +329,9 @@ def sketch2image_retriever():
     """
     try:
         # Check model initialization
-        if 'model' not in globals() or 'faiss_index' not in globals():
-            app.logger.error("Model or index not initialized")
-            return jsonify({
-                'status': 'error',
-                'message': 'Sketch2Image model not properly initialized'
-            }), 600
+        unavailable = subsystem_unavailable('sketch2image')
+        if unavailable:
+            return unavailable
         
         # Validate request data
         data = request.json
@@ -253,6 +341,35 @@ def sketch2image_retriever():
         
         sketch_base64 = data.get('sketch')
         caption = data.get('caption', '')
+        # Optional query-time knobs for approximate (IVF / HNSW / PQ) image indexes
+        search_params = {}
+        for name, maximum in SEARCH_PARAM_LIMITS.items():
+            if data.get(name) is None:
+                continue
+            value = parse_int(data[name], maximum=maximum)
+            if value is None:
+                return jsonify({'error': f'{name} must be an integer between 1 and {maximum}'}), 400
+            search_params[name] = value
+        # One entry per tour with its best images instead of 150 raw image hits
+        group_by_tour = parse_flag(data.get('group_by_tour', False))
+        if group_by_tour is None:
+            return jsonify({'error': 'group_by_tour must be true or false'}), 400
+        if group_by_tour:
+            n_tours = parse_int(data.get('n_tours', 50), maximum=MAX_GROUPED_TOURS)
+            images_per_tour = parse_int(data.get('images_per_tour', 3), maximum=MAX_IMAGES_PER_TOUR)
+            aggregate = data.get('aggregate', 'max')
+            if n_tours is None:
+                return jsonify({'error': f'n_tours must be an integer between 1 and {MAX_GROUPED_TOURS}'}), 400
+            if images_per_tour is None:
+                return jsonify({'error': f'images_per_tour must be an integer between 1 and {MAX_IMAGES_PER_TOUR}'}), 400
+            if aggregate not in TOUR_AGGREGATES:
+                return jsonify({'error': f'aggregate must be one of {list(TOUR_AGGREGATES)}'}), 400
+        # Optional attribute filters: tour_ids, date_from, date_to, difficulty, tags
+        if data.get('filters'):
+            error = filters_error(data['filters'])
+            if error:
+                return jsonify({'error': error}), 400
+            search_params['filters'] = data['filters']
         
         app.logger.debug(f"Received request - Sketch empty: {not sketch_base64}, Caption: {caption}")
         
@@ -276,11 +393,28 @@ def sketch2image_retriever():
         
         # Get feature embedding
         try:
-            query_feature = get_feature(model, processed_sketch, caption)
+            query_feature = query_encoder(processed_sketch, caption)
             
             # Convert to numpy and search
             query_np = query_feature.cpu().numpy()
-            results = faiss_index.search(query_np, k=150)
+
+            if group_by_tour:
+                tours = faiss_index.search_grouped(
+                    query_np,
+                    n_tours=n_tours,
+                    aggregate=aggregate,
+                    images_per_tour=images_per_tour,
+                    fields=RESULT_FIELDS,
+                    **search_params)
+                for tour in tours:
+                    tour['images'] = [dict(image['metadata'], similarity=image['similarity'])
+                                      for image in tour['images']]
+                return jsonify({
+                    'status': 'success',
+                    'tours': tours
+                })
+
+            results = faiss_index.search(query_np, k=150, fields=RESULT_FIELDS, **search_params)
             # print(results)
             # Format results
             formatted_results = []
@@ -317,21 +451,52 @@ def sketch2image_retriever():
             'status': 'error',
             'message': str(e)
         }), 500
-# Global initialization
-try:
-    print("Initializing Sketch2Image model...")
-    model, faiss_index, transformer = initialize_model()
+# Global initialization: the three subsystems load concurrently in background threads
+# and each endpoint comes online as soon as its own subsystem is ready
+SUBSYSTEMS = {
+    'sketch2image': initialize_sketch_system,
+    'quiz': initialize_quiz_server,
+    'recommendations': initialize_recommendation_system,
+}
+subsystem_lock = threading.Lock()
+subsystem_status = {name: {'state': 'pending', 'load_seconds': None} for name in SUBSYSTEMS}
 
-    print("Initializing quiz server...")
-    if not initialize_quiz_server():
-        raise RuntimeError("Failed to initialize quiz server")
-        
-    print("Initializing recommendation system...")
-    if not initialize_recommendation_system():
-        raise RuntimeError("Failed to initialize recommendation system")
-except Exception as e:
-    print(f"Initialization error: {str(e)}")
-    sys.exit(1)
+def _initialize_subsystem(name, initializer):
+    with subsystem_lock:
+        subsystem_status[name]['state'] = 'loading'
+    print(f"Initializing {name}...")
+    start = time.perf_counter()
+    try:
+        ready = initializer()
+    except Exception as e:
+        print(f"Initialization error in {name}: {str(e)}")
+        ready = False
+    with subsystem_lock:
+        subsystem_status[name]['state'] = 'ready' if ready else 'failed'
+        subsystem_status[name]['load_seconds'] = round(time.perf_counter() - start, 3)
+
+def subsystem_unavailable(name):
+    """Error response while a subsystem is still loading (503) or failed to load (500)"""
+    with subsystem_lock:
+        state = subsystem_status[name]['state']
+    if state == 'ready':
+        return None
+    if state == 'failed':
+        return jsonify({
+            'status': 'error',
+            'message': f'{name} not properly initialized'
+        }), 500
+    return jsonify({
+        'status': 'error',
+        'message': f'{name} is still initializing, retry shortly'
+    }), 503
+
+initialization_threads = [
+    threading.Thread(target=_initialize_subsystem, args=(name, initializer), name=f'init-{name}', daemon=True)
+    for name, initializer in SUBSYSTEMS.items()
+]
+for thread in initialization_threads:
+    thread.start()
 
 # Start the app
 if __name__ == '__main__':
@@ -0,0 +1,30 @@
+"""
+Shared fixtures. Run from the FLASK_SERVER directory:
+    python -m pytest tests
+"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+
+@pytest.fixture(scope='session')
+def clip_model():
+    """Randomly initialized CLIP with the serving architecture (no checkpoint needed)"""
+    torch = pytest.importorskip('torch')
+    from Sketch2ImageRetriever.code.clip import CLIP
+    from Sketch2ImageRetriever.initialize_model import model_config_file
+
+    torch.manual_seed(0)
+    with open(BASE_DIR / model_config_file, 'r') as f:
+        return CLIP(**json.load(f)).eval()
+
+
+@pytest.fixture
+def rng():
+    import numpy as np
+    return np.random.default_rng(0)
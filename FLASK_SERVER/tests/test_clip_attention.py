@@ -0,0 +1,38 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from Sketch2ImageRetriever.code.clip import tokenize
+from ServerTesting.sdpa_attention_check import mha_encode_sketch, mha_encode_text
+
+CAPTIONS = ["mountain", "a wooden bridge over a mountain stream at sunset", ""]
+
+
+def test_fused_text_attention_matches_mha(clip_model):
+    text = tokenize(CAPTIONS)
+    with torch.no_grad():
+        fused = clip_model.encode_text(text)
+    assert torch.allclose(fused, mha_encode_text(clip_model, text), atol=1e-4)
+
+
+def test_fused_sketch_attention_matches_mha(clip_model):
+    resolution = clip_model.visual2.input_resolution
+    images = torch.randn(2, 3, resolution, resolution, generator=torch.Generator().manual_seed(0))
+    with torch.no_grad():
+        fused = clip_model.encode_sketch(images)
+    assert torch.allclose(fused, mha_encode_sketch(clip_model, images), atol=1e-4)
+
+
+def test_trimmed_text_matches_padded(clip_model):
+    text = tokenize(CAPTIONS)
+    with torch.no_grad():
+        padded = clip_model.encode_text(text)
+        trimmed = clip_model.encode_text(text, trim_padding=True)
+    assert torch.allclose(trimmed, padded, atol=1e-4)
+
+
+def test_trimming_keeps_full_length_captions(clip_model):
+    text = tokenize([" ".join(["word"] * 100), "short"])
+    assert text[0, -1] != 0
+    with torch.no_grad():
+        assert torch.allclose(clip_model.encode_text(text, trim_padding=True), clip_model.encode_text(text), atol=1e-4)
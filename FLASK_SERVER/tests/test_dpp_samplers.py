@@ -0,0 +1,137 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+# quizAlgo/__init__ imports the Jina retriever (transformers)
+dpp_samplers = pytest.importorskip('quizAlgo.dpp_samplers')
+dpp_utils = pytest.importorskip('quizAlgo.dpp_utils')
+
+
+def rbf_kernel(points, gamma):
+    distances = ((points[:, None, :] - points[None, :, :]) ** 2).sum(-1)
+    return np.exp(-gamma * distances)
+
+
+def k_dpp_probabilities(kernel, k):
+    subsets = list(combinations(range(len(kernel)), k))
+    dets = np.array([np.linalg.det(kernel[np.ix_(s, s)]) for s in subsets])
+    return subsets, dets / dets.sum()
+
+
+def total_variation(sampler, kernel, k, samples=8000):
+    subsets, probabilities = k_dpp_probabilities(kernel, k)
+    position = {s: i for i, s in enumerate(subsets)}
+    counts = np.zeros(len(subsets))
+    for _ in range(samples):
+        counts[position[tuple(sorted(int(i) for i in sampler()))]] += 1
+    return 0.5 * np.abs(counts / samples - probabilities).sum()
+
+
+@pytest.fixture
+def small_kernel(rng):
+    points = rng.normal(size=(6, 3))
+    weights = rng.uniform(0.2, 1.0, size=6)
+    return np.sqrt(weights)[:, None] * rbf_kernel(points, 0.5) * np.sqrt(weights)[None, :]
+
+
+def test_k_dpp_sampler_matches_exact_distribution(small_kernel, rng):
+    assert total_variation(lambda: dpp_samplers.sample_k_dpp(small_kernel, 2, rng), small_kernel, 2) < 0.05
+
+
+def test_dual_sampler_matches_exact_distribution(small_kernel, rng):
+    factor = dpp_samplers.kernel_root(small_kernel, energy=None)
+    assert np.allclose(factor @ factor.T, small_kernel, atol=1e-5)
+    assert total_variation(lambda: dpp_samplers.sample_k_dpp_dual(factor, 2, rng), small_kernel, 2) < 0.05
+
+
+def test_dual_sampler_returns_distinct_rows(rng):
+    factor = rng.normal(size=(200, 20)).astype(np.float32)
+    for _ in range(20):
+        rows = dpp_samplers.sample_k_dpp_dual(factor, 8, rng)
+        assert len(set(rows.tolist())) == 8
+
+
+def test_samplers_reject_k_above_rank(rng):
+    factor = rng.normal(size=(10, 2))
+    with pytest.raises(ValueError):
+        dpp_samplers.sample_k_dpp_dual(factor, 3, rng)
+    with pytest.raises(ValueError):
+        dpp_samplers.sample_k_dpp(factor @ factor.T, 3, rng)
+
+
+def test_greedy_map_matches_brute_force_greedy(rng):
+    points = rng.normal(size=(30, 4))
+    scale = np.sqrt(rng.uniform(0.5, 1.5, size=30))
+    kernel = scale[:, None] * rbf_kernel(points, 0.3) * scale[None, :]
+    excluded = [0, 5]
+
+    expected = []
+    for _ in range(6):
+        candidates = [j for j in range(30) if j not in expected and j not in excluded]
+        gains = [np.linalg.slogdet(kernel[np.ix_(expected + [j], expected + [j])])[1] for j in candidates]
+        expected.append(candidates[int(np.argmax(gains))])
+
+    selected = dpp_samplers.greedy_map_dpp(lambda j: kernel[:, j], np.diag(kernel), 6, excluded=excluded)
+    assert selected.tolist() == expected
+
+
+def test_greedy_map_stops_when_no_item_adds_volume():
+    factor = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 0.0], [0.0, 1.0]])
+    kernel = factor @ factor.T
+    assert len(dpp_samplers.greedy_map_dpp(lambda j: kernel[:, j], np.diag(kernel), 3)) == 2
+
+
+def test_kernel_root_energy_and_rank_cap(rng):
+    kernel = rbf_kernel(rng.normal(size=(80, 5)), 0.2)
+    full = dpp_samplers.kernel_root(kernel, energy=None)
+    assert np.allclose(full @ full.T, kernel, atol=1e-4)
+
+    truncated = dpp_samplers.kernel_root(kernel, energy=0.9)
+    kept = np.square(truncated, dtype=np.float64).sum() / np.trace(kernel)
+    assert 0.9 <= kept and truncated.shape[1] < full.shape[1]
+
+    capped = dpp_samplers.kernel_root(kernel, energy=0.9, max_rank=3)
+    assert capped.shape == (80, 3)
+    assert np.allclose(capped, truncated[:, :3])
+
+
+def test_random_fourier_features_approximate_rbf(rng):
+    points = rng.normal(scale=0.5, size=(40, 6)).astype(np.float32)
+    features = dpp_samplers.random_fourier_features(points, 0.1, dim=8192, rng=rng)
+    assert np.abs(features @ features.T - rbf_kernel(points, 0.1)).max() < 0.08
+
+
+def test_nystrom_features_are_exact_on_landmarks(rng):
+    points = rng.normal(size=(30, 4)).astype(np.float32)
+    features = dpp_samplers.nystrom_features(points, 0.2, landmarks=30, rng=rng)
+    assert np.allclose(features @ features.T, rbf_kernel(points, 0.2), atol=1e-3)
+
+
+@pytest.fixture
+def recommender(rng):
+    embedding_matrix = rng.normal(size=(120, 8)).astype(np.float32)
+    tour_ids = np.arange(1000, 1120)
+    return dpp_utils.DPPRecommender.from_arrays(tour_ids, embedding_matrix,
+                                                {int(i): {'name': f'tour {i}'} for i in tour_ids})
+
+
+@pytest.mark.parametrize('options', [{}, {'candidates': 30}, {'candidates': 30, 'exploration': 1.0},
+                                     {'deterministic': True}, {'deterministic': True, 'candidates': 30}])
+def test_recommend_returns_k_distinct_tours(recommender, options):
+    response = recommender.recommend([1001, 1002], [1003], k=5, random_state=0, **options)
+    tour_ids = [r['tour_id'] for r in response['recommendations']]
+    assert len(set(tour_ids)) == 5
+    assert set(response['embeddings']) == set(tour_ids)
+    assert all(r['name'] == f"tour {r['tour_id']}" for r in response['recommendations'])
+
+
+def test_deterministic_recommend_is_repeatable(recommender):
+    first = recommender.recommend([1001], [1003], k=5, deterministic=True, include_embeddings=False)
+    recommender._map_cache.clear()
+    assert recommender.recommend([1001], [1003], k=5, deterministic=True, include_embeddings=False) == first
+
+
+def test_factor_rank_is_capped_by_default(recommender):
+    assert recommender.max_rank == dpp_utils.DEFAULT_KERNEL_MAX_RANK
+    assert recommender.kernel_factor(0.1).shape[1] <= (recommender.max_rank or len(recommender.tour_ids))
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip('faiss')
+
+from Sketch2ImageRetriever.faiss_class import GPU_MAX_K, FaissMetadataIndex
+from Sketch2ImageRetriever.metadata_store import ColumnarMetadataStore
+
+DIM = 16
+TOURS = [
+    {'tour_id': 1, 'difficulty': 'Easy', 'tags': ['Lake', 'family']},
+    {'tour_id': 2, 'difficulty': 'hard', 'tags': 'alpine'},
+    {'tour_id': 3, 'difficulty': None, 'tags': [None, 7]},
+    {'tour_id': None, 'difficulty': 'easy'},
+]
+
+
+@pytest.fixture
+def index(rng):
+    embeddings = rng.normal(size=(60, DIM)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    metadata = [{'url': f'img{i}.jpg', 'tour_id': 1 + i % 3, 'caption': f'image {i}',
+                 'date_created': f'2021-0{1 + i % 9}-15'} for i in range(60)]
+    index = FaissMetadataIndex(dimension=DIM, use_gpu=False)
+    index.add_embeddings(embeddings, metadata)
+    index.set_tour_attributes(TOURS)
+    return index, embeddings
+
+
+def brute_force(index, embeddings, query, rows):
+    scores = embeddings[rows] @ query
+    return [int(rows[i]) for i in np.argsort(-scores)]
+
+
+def test_search_returns_exact_ranking(index):
+    index, embeddings = index
+    results = index.search(embeddings[5], k=10)
+    expected = brute_force(index, embeddings, embeddings[5], np.arange(60))[:10]
+    assert [r['metadata']['url'] for r in results] == [f'img{i}.jpg' for i in expected]
+    assert results[0]['similarity'] == pytest.approx(1.0, abs=1e-5)
+
+
+@pytest.mark.parametrize('filters, allowed', [
+    ({'tour_ids': [2]}, lambda m: m['tour_id'] == 2),
+    ({'date_from': '2021-03-01', 'date_to': '2021-05-31'}, lambda m: '2021-03' <= m['date_created'][:7] <= '2021-05'),
+    ({'difficulty': 'EASY'}, lambda m: m['tour_id'] == 1),
+    ({'difficulty': 'unrated'}, lambda m: m['tour_id'] == 3),
+    ({'tags': ['alpine', '7']}, lambda m: m['tour_id'] in (2, 3)),
+    ({'tags': 'lake', 'tour_ids': [1, 2]}, lambda m: m['tour_id'] == 1),
+])
+def test_filtered_search_matches_brute_force(index, filters, allowed):
+    index, embeddings = index
+    rows = np.array([i for i, m in enumerate(index.metadata) if allowed(m)])
+    results = index.search(embeddings[0], k=100, filters=filters)
+    assert [r['metadata']['url'] for r in results] == [f'img{i}.jpg' for i in brute_force(index, embeddings,
+                                                                                              embeddings[0], rows)]
+
+
+def test_unknown_filter_raises(index):
+    index, embeddings = index
+    with pytest.raises(ValueError):
+        index.search(embeddings[0], k=5, filters={'colour': 'red'})
+
+
+@pytest.mark.parametrize('aggregate', ['max', 'mean', 'top_m'])
+def test_grouped_search_scores_tours(index, aggregate):
+    index, embeddings = index
+    query = embeddings[7]
+    # Fetching every image makes the tour scores exact
+    results = index.search_grouped(query, n_tours=3, aggregate=aggregate, top_m=2, images_per_tour=2, fetch_k=60)
+    assert len(results) == 3
+
+    scores = embeddings @ query
+    for tour in results:
+        tour_scores = np.sort(scores[[i for i, m in enumerate(index.metadata) if m['tour_id'] == tour['tour_id']]])[::-1]
+        expected = {'max': tour_scores[0], 'mean': tour_scores.mean(), 'top_m': tour_scores[:2].mean()}[aggregate]
+        assert tour['score'] == pytest.approx(expected, abs=1e-5)
+        assert tour['num_hits'] == len(tour_scores)
+        assert [image['similarity'] for image in tour['images']] == pytest.approx(tour_scores[:2], abs=1e-5)
+    assert [tour['score'] for tour in results] == sorted((tour['score'] for tour in results), reverse=True)
+
+
+def test_grouped_search_respects_filters(index):
+    index, embeddings = index
+    results = index.search_grouped(embeddings[0], n_tours=3, filters={'tour_ids': [1, 3]})
+    assert sorted(tour['tour_id'] for tour in results) == [1, 3]
+
+
+def test_grouped_search_rejects_unknown_aggregate(index):
+    index, embeddings = index
+    with pytest.raises(ValueError):
+        index.search_grouped(embeddings[0], aggregate='median')
+
+
+class RecordingIndex:
+    """Wraps a faiss index and records the k of every search"""
+    def __init__(self, index):
+        self.index = index
+        self.ntotal = index.ntotal
+        self.searched_k = []
+
+    def search(self, queries, k, **kwargs):
+        self.searched_k.append(k)
+        return self.index.search(queries, k, **kwargs)
+
+
+@pytest.fixture
+def gpu_like_index(rng, monkeypatch):
+    """A CPU index flagged as on_gpu, so the GPU code paths (top-k limit, post-filtering) run"""
+    if not hasattr(faiss, 'GpuParameterSpace'):
+        monkeypatch.setattr(faiss, 'GpuParameterSpace', faiss.ParameterSpace, raising=False)
+    embeddings = rng.normal(size=(3 * GPU_MAX_K, DIM)).astype(np.float32)
+    metadata = [{'url': f'img{i}.jpg', 'tour_id': i, 'caption': None, 'date_created': None}
+                for i in range(len(embeddings))]
+    index = FaissMetadataIndex(dimension=DIM, use_gpu=False)
+    index.add_embeddings(embeddings, metadata)
+    index.index = RecordingIndex(index.index)
+    index.on_gpu = True
+    return index, embeddings
+
+
+def test_gpu_searches_stay_within_top_k_limit(gpu_like_index):
+    index, embeddings = gpu_like_index
+    results = index.search_grouped(embeddings[0], n_tours=GPU_MAX_K + 100, max_fetch=4 * GPU_MAX_K)
+    assert len(results) == GPU_MAX_K
+    index.search(embeddings[0], k=10, filters={'tour_ids': list(range(0, 3 * GPU_MAX_K, 2))})
+    assert max(index.index.searched_k) <= GPU_MAX_K
+
+
+def test_gpu_post_filtering_matches_cpu_selector(gpu_like_index):
+    index, embeddings = gpu_like_index
+    filters = {'tour_ids': list(range(0, 3 * GPU_MAX_K, 3))}
+    post_filtered = index.search(embeddings[1], k=20, filters=filters)
+    index.index, index.on_gpu = index.index.index, False
+    assert post_filtered == index.search(embeddings[1], k=20, filters=filters)
+
+
+def test_save_and_mmap_load_round_trip(index, tmp_path):
+    index, embeddings = index
+    index.save(tmp_path)
+    loaded = FaissMetadataIndex.load(tmp_path, dimension=DIM, mmap=True)
+    assert isinstance(loaded.metadata, ColumnarMetadataStore)
+    assert loaded.search(embeddings[3], k=5) == index.search(embeddings[3], k=5)
+
+    # Saving over the directory the index is mapped from must not disturb the mapping
+    loaded.save(tmp_path)
+    assert loaded.search(embeddings[3], k=5) == index.search(embeddings[3], k=5)
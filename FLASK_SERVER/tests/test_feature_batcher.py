@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+torch = pytest.importorskip('torch')
+from PIL import Image
+
+from Sketch2ImageRetriever import FeatureBatcher
+from Sketch2ImageRetriever.session import EncoderSession
+
+
+def random_sketch(seed):
+    pixels = torch.randint(0, 256, (64, 64, 3), generator=torch.Generator().manual_seed(seed), dtype=torch.uint8)
+    return Image.fromarray(pixels.numpy(), 'RGB')
+
+
+QUERIES = [(random_sketch(0), "mountain"), (None, "castle ruins"), (random_sketch(1), None),
+           (random_sketch(2), "lake with boats")]
+
+
+def test_batched_features_match_single_queries(clip_model):
+    reference = EncoderSession(clip_model)
+    expected = [reference.get_feature(sketch, text) for sketch, text in QUERIES]
+
+    batcher = FeatureBatcher(clip_model, max_batch_size=len(QUERIES), window_ms=200)
+    results = [None] * len(QUERIES)
+
+    def query(i):
+        results[i] = batcher.get_feature(*QUERIES[i])
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(len(QUERIES))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    for result, feature in zip(results, expected):
+        assert result.shape == (1, feature.shape[1])
+        assert torch.allclose(result, feature.cpu(), atol=1e-4)
+
+    metrics = batcher.metrics()
+    assert metrics['requests'] == len(QUERIES)
+    assert metrics['batches'] < len(QUERIES)
+    assert metrics['queue_wait_ms']['p99'] >= 0
+
+
+def test_errors_reach_every_caller_of_the_batch(clip_model):
+    batcher = FeatureBatcher(clip_model, max_batch_size=2, window_ms=1)
+    with pytest.raises(Exception):
+        batcher.get_feature("not an image", None)
+    # The scheduler keeps serving after a failed batch
+    assert batcher.get_feature(None, "mountain").shape[0] == 1
@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+import pytest
+
+from Sketch2ImageRetriever.metadata_store import FIELDS, ColumnarMetadataStore
+
+RECORDS = [
+    {'url': 'a.jpg', 'tour_id': 1, 'caption': 'lake', 'date_created': '2021-05-01'},
+    {'url': 'b.jpg', 'tour_id': 2, 'caption': None, 'date_created': None},
+    {'url': 'c.jpg', 'tour_id': 3, 'caption': 'Zürich café', 'date_created': '2022-01-31', 'photographer': 'ana',
+     'width': 640},
+]
+
+
+def test_records_round_trip():
+    store = ColumnarMetadataStore.from_records(RECORDS)
+    assert len(store) == len(RECORDS)
+    assert list(store) == RECORDS
+    assert store.rows([2, 0], fields=['url', 'photographer']) == [{'url': 'c.jpg', 'photographer': 'ana'},
+                                                                  {'url': 'a.jpg', 'photographer': None}]
+    assert store.tour_ids.tolist() == [1, 2, 3]
+
+
+def test_missing_tour_id_is_stored_as_unknown(capsys):
+    store = ColumnarMetadataStore.from_records([{'url': 'x.jpg'}])
+    assert store.tour_ids.tolist() == [-1]
+    assert 'no tour_id' in capsys.readouterr().out
+
+
+def test_unserializable_extra_values_are_rejected():
+    with pytest.raises(ValueError):
+        ColumnarMetadataStore.from_records([{'tour_id': 1, 'vector': object()}])
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_and_load(tmp_path, mmap):
+    ColumnarMetadataStore.from_records(RECORDS).save(tmp_path)
+    assert ColumnarMetadataStore.exists(tmp_path)
+    store = ColumnarMetadataStore.load(tmp_path, mmap=mmap)
+    assert list(store) == RECORDS
+
+
+def test_save_over_mapped_directory(tmp_path):
+    ColumnarMetadataStore.from_records(RECORDS).save(tmp_path)
+    mapped = ColumnarMetadataStore.load(tmp_path)
+    mapped.extend([{'url': 'd.jpg', 'tour_id': 4, 'caption': 'new', 'date_created': '2023-02-02'}])
+    mapped.save(tmp_path)
+    assert list(mapped)[:3] == RECORDS
+    assert list(ColumnarMetadataStore.load(tmp_path))[3]['url'] == 'd.jpg'
+
+
+def test_stores_without_extra_column_still_load():
+    columns = dict(ColumnarMetadataStore.from_records([{k: r[k] for k in FIELDS} for r in RECORDS]).columns)
+    for name in ('extra', 'extra_offsets', 'extra_valid'):
+        del columns[name]
+    store = ColumnarMetadataStore(columns)
+    assert store[2] == {k: RECORDS[2][k] for k in FIELDS}
+
+
+def test_extend_widens_dates_to_seconds():
+    store = ColumnarMetadataStore.from_records(RECORDS[:1])
+    store.extend([{'url': 'e.jpg', 'tour_id': 5, 'caption': None, 'date_created': '2021-05-02T10:30:00'}])
+    assert len(store) == 2
+    assert store.date_unit == 's'
+    assert store[0]['date_created'] == '2021-05-01T00:00:00'
+    assert store[1]['date_created'] == '2021-05-02T10:30:00'
+
+
+def test_concurrent_extend_and_reads():
+    store = ColumnarMetadataStore.from_records(RECORDS)
+    errors = []
+
+    def writer():
+        for i in range(200):
+            store.extend([{'url': f'{i}.jpg', 'tour_id': i, 'caption': 'x', 'date_created': None}])
+
+    def reader():
+        try:
+            for _ in range(200):
+                n = len(store.tour_ids)
+                store.rows(np.arange(n), fields=['url', 'tour_id'])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(store) == len(RECORDS) + 200
+    assert store[len(store) - 1]['url'] == '199.jpg'
@@ -0,0 +1,65 @@
+import pytest
+
+from request_validation import filters_error, parse_flag, parse_fraction, parse_int
+
+
+@pytest.mark.parametrize('value, kwargs, expected', [
+    (5, {}, 5),
+    ('12', {}, 12),
+    (0, {}, None),
+    (0, {'minimum': 0}, 0),
+    (4096, {'maximum': 4096}, 4096),
+    (4097, {'maximum': 4096}, None),
+    ('10000000', {'maximum': 500}, None),
+    (True, {}, None),
+    (2.5, {}, None),
+    ('2.5', {}, None),
+    ('abc', {}, None),
+    (None, {}, None),
+    ([3], {}, None),
+])
+def test_parse_int(value, kwargs, expected):
+    assert parse_int(value, **kwargs) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    (0, 0.0), (1, 1.0), (0.25, 0.25), ('0.5', 0.5),
+    (1.5, None), (-0.1, None), (True, None), ('nan', None), ('x', None), (None, None),
+])
+def test_parse_fraction(value, expected):
+    assert parse_fraction(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), (1, True), (0, False), ('true', True), (' FALSE ', False), ('1', True),
+    (2, None), ('yes', None), (None, None), ([], None),
+])
+def test_parse_flag(value, expected):
+    assert parse_flag(value) is expected
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'tour_ids': [1, '2', 0]},
+    {'date_from': '2021-01-01', 'date_to': '2021-12-31'},
+    {'date_from': None, 'difficulty': 'easy', 'tags': ['lake', 'alpine']},
+    {'difficulty': ['easy', 3]},
+])
+def test_valid_filters(filters):
+    assert filters_error(filters) is None
+
+
+@pytest.mark.parametrize('filters, message', [
+    ([1, 2], 'filters must be an object'),
+    ('tour_ids', 'filters must be an object'),
+    ({'colour': 'red'}, "Unknown filters: ['colour']"),
+    ({'tour_ids': 5}, 'tour_ids must be a list of tour ids'),
+    ({'tour_ids': [1, -2]}, 'tour_ids must be a list of tour ids'),
+    ({'tour_ids': [1.5]}, 'tour_ids must be a list of tour ids'),
+    ({'date_from': '2021-13-01'}, 'date_from must be a YYYY-MM-DD date'),
+    ({'date_to': 20210101}, 'date_to must be a YYYY-MM-DD date'),
+    ({'tags': {'lake': True}}, 'tags must be a string or a list of strings'),
+    ({'difficulty': [None]}, 'difficulty must be a string or a list of strings'),
+])
+def test_invalid_filters(filters, message):
+    assert filters_error(filters) == message
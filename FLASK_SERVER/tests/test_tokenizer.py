@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip('ftfy')
+
+from Sketch2ImageRetriever.code.clip import tokenize
+from Sketch2ImageRetriever.code.clip.clip import get_tokenizer
+from ServerTesting.tokenizer_benchmark import SHORT_QUERIES, LegacyTokenizer
+
+TEXTS = SHORT_QUERIES + [
+    "",
+    "   A  wooden\tbridge\nover a mountain stream   ",
+    "Sunset at the Lake's edge, 2019 -- don't miss it!!",
+    "&amp;lt;b&amp;gt; castle ruins &amp;amp; moat",
+    "Café crème brûlée in Zürich",
+    "山の上の城",
+    "emoji 🏔️🌲 trail",
+    "<start_of_text>already marked<end_of_text>",
+    "supercalifragilisticexpialidocious antidisestablishmentarianism",
+    " ".join(["long caption"] * 60),
+]
+
+
+@pytest.fixture(scope='module')
+def legacy():
+    return LegacyTokenizer()
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_encode_matches_legacy_tokenizer(legacy, text):
+    assert get_tokenizer().encode(text) == legacy.encode(text)
+
+
+def test_encode_batch_matches_encode():
+    tokenizer = get_tokenizer()
+    texts = TEXTS + TEXTS[:3]
+    assert tokenizer.encode_batch(texts) == [tokenizer.encode(text) for text in texts]
+
+
+def test_tokenize_layout(legacy):
+    tokenizer = get_tokenizer()
+    sot, eot = tokenizer.encoder["<start_of_text>"], tokenizer.encoder["<end_of_text>"]
+    tokens = tokenize(TEXTS)
+    assert tokens.shape == (len(TEXTS), 77)
+    for row, text in zip(tokens.tolist(), TEXTS):
+        expected = ([sot] + legacy.encode(text) + [eot])[:77]
+        assert row[:len(expected)] == expected
+        assert not any(row[len(expected):])
+
+
+def test_word_cache_is_bounded():
+    from Sketch2ImageRetriever.code.clip.tokenizer import SimpleTokenizer
+
+    tokenizer = SimpleTokenizer(cache_size=4)
+    first = tokenizer.encode("alpha beta gamma delta epsilon zeta")
+    assert len(tokenizer.cache) == 4
+    assert tokenizer.encode("alpha beta gamma delta epsilon zeta") == first